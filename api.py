@@ -1,6 +1,9 @@
 #!/usr/bin/env python3
 
-from core import main
+from core import create_app
+
+app = create_app()
 
 if __name__ == '__main__':
+    from core import main
     main.run()
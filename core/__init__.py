@@ -1,12 +1,17 @@
+import logging
 import secrets
 import string
+import threading
+import time
+from contextlib import contextmanager
 from pathlib import Path
 import sys
 
 from core.plugin_manager import PluginManager
 from core.plugin_manager import Policy
 from core.config import Config
-from core.utils import CustomBaseQuery, init_db
+from core.utils import CustomBaseQuery, init_db, init_engine, get_engine_options
+from core import metrics
 
 from flask import Flask, jsonify
 from flask_jwt_extended import JWTManager
@@ -15,11 +20,26 @@ from flask_sqlalchemy import SQLAlchemy
 #from core.auth import Auth
 
 
+logger = logging.getLogger('app')
+
+# seconds spent in every startup phase, see create_app()
+startup_timings = {}
+
+@contextmanager
+def timed(phase):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        startup_timings[phase] = time.perf_counter() - start
+
+
 def gen_password(length=20):
     alphabet = string.ascii_letters + string.digits
     return ''.join(secrets.choice(alphabet) for i in range(length))
 
 # init config file
+_config_start = time.perf_counter()
 config = Config()
 config.set_path(Path(__file__).parent.parent / 'config.yml')
 
@@ -29,14 +49,52 @@ config['core']['plugins_enabled'] = ['ipfs']
 config["core"]["jwt_secret_key"] = gen_password()
 config["core"]["user_token_expiration_days"] = 1000000
 config["core"]["sensor_token_expiration_days"] = 1000000
+config["core"]["comments_cache_control"] = "public, no-cache"
+config["core"]["stable_responses"] = False
+config["core"]["immutable_cache_control"] = "public, max-age=31536000, immutable"
+config["core"]["permission_cache_ttl"] = 60
+config["core"]["metrics_public"] = False
+config["core"]["hash_workers"] = 2
+config["core"]["hash_max_pending"] = 8
+config["core"]["hash_timeout"] = 30
+config["core"]["profiling"] = False
+config["core"]["profiling_dir"] = str((Path(__file__).parent.parent / 'profiles').absolute())
+config["core"]["profiling_interval"] = 0.001
 config["core"]["admin"] = {}
 config["core"]["admin"]["username"] = "admin"
 config["core"]["admin"]["password"] = gen_password()
 config['plugins'] = {}
 config['sqlite'] = {}
 config['sqlite']['path'] = str((Path(__file__).parent.parent / 'db.sqlite').absolute())
+config['sqlite']['journal_mode'] = 'WAL'
+config['sqlite']['synchronous'] = 'NORMAL'
+config['sqlite']['busy_timeout'] = 5
+config['sqlite']['pool_size'] = 5
+config['sqlite']['max_overflow'] = 10
+config['sqlite']['pool_timeout'] = 30
 config['plugins']['ipfs'] = {}
 config['plugins']["ipfs"]["root_cid"] = ''
+config['plugins']["ipfs"]["root_store_path"] = str((Path(__file__).parent.parent / 'roots.sqlite').absolute())
+config['plugins']["ipfs"]["cache_size"] = 64 * 1024 * 1024
+config['plugins']["ipfs"]["response_cache_size"] = 16 * 1024 * 1024
+config['plugins']["ipfs"]["max_concurrency"] = 8
+config['plugins']["ipfs"]["addr"] = '/dns/localhost/tcp/5001/http'
+config['plugins']["ipfs"]["pool_size"] = 8
+config['plugins']["ipfs"]["timeout"] = 30
+config['plugins']["ipfs"]["pool_timeout"] = 30
+config['plugins']["ipfs"]["local_timeout"] = 2
+config['plugins']["ipfs"]["shard_threshold"] = 256
+config['plugins']["ipfs"]["page_size"] = 50
+config['plugins']["ipfs"]["thread_max_depth"] = 10
+config['plugins']["ipfs"]["thread_max_children"] = 100
+config['plugins']["ipfs"]["commit_window"] = 0.05
+config['plugins']["ipfs"]["commit_batch_size"] = 100
+config['plugins']["ipfs"]["commit_timeout"] = 30
+config['plugins']["ipfs"]["comment_index"] = False
+config['plugins']["ipfs"]["block_codec"] = 'dag-cbor'
+config['plugins']["ipfs"]["car_path"] = ''
+config['plugins']["ipfs"]["blockstore"] = 'http'
+config['plugins']["ipfs"]["blockstore_path"] = ''
 
 #config["core"]["users"] = []
 #admin_user = {}
@@ -44,10 +102,10 @@ config['plugins']["ipfs"]["root_cid"] = ''
 #admin_user["password"] = gen_password()
 #config["core"]["users"].append(admin_user)
 
-if not config.configfile_exists():
-    config.write(commented=False)
-
-config.load(merge=False)
+# a missing config file is written by create_app(), importing core never writes files
+if config.configfile_exists():
+    config.load(merge=False)
+startup_timings['config'] = time.perf_counter() - _config_start
 
 
 # handles plugins and plugin hooks
@@ -56,17 +114,16 @@ plugin_manager = PluginManager()
 # add plugin manager hooks that plugins can subscribe to
 plugin_manager.register_hook('add_comment', run_policy=Policy.FIRST)
 plugin_manager.register_hook('get_comments', run_policy=Policy.FIRST)
+plugin_manager.register_hook('get_post_cid', run_policy=Policy.FIRST)
+plugin_manager.register_hook('get_node', run_policy=Policy.FIRST)
+plugin_manager.register_hook('get_comments_by_cid', run_policy=Policy.FIRST)
 
-# initialize plugins, this also adds the plugin templates path to jinja2 env
-plugin_manager.load_plugins(['ipfs'])
-
-# init flask
+# init flask, the extensions are bound to the app in create_app()
 app = Flask(__name__)
 
-
 # Setup flask_jwt_extended
 app.config['JWT_SECRET_KEY'] = config["core"]["jwt_secret_key"]
-jwt = JWTManager(app)
+jwt = JWTManager()
 
 # custom JWT error message on expired token, should probably be placed somewhere else
 @jwt.expired_token_loader
@@ -77,10 +134,73 @@ def my_expired_token_callback(expired_token):
 # Database
 app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{config["sqlite"]["path"]}'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = get_engine_options(config['sqlite'])
+
+db = SQLAlchemy(query_class=CustomBaseQuery)
+
+
+_app_created = False
+_app_lock = threading.Lock()
+
+def create_app():
+    """ Load plugins, bind the extensions and add the routes, return the app.
+        Importing core doesn't do any of this, so tools and tests only pay for what they use.
+        The database is initialized on the first request, or by calling init_database() """
+    global _app_created
+    with _app_lock:
+        if _app_created:
+            return app
+
+        if not config.configfile_exists():
+            config.write(commented=False)
+
+        # initialize plugins, this also adds the plugin templates path to jinja2 env
+        with timed('plugins'):
+            plugin_manager.load_plugins(['ipfs'])
+
+        with timed('extensions'):
+            jwt.init_app(app)
+            db.init_app(app)
+            with app.app_context():
+                init_engine(db, config['sqlite'])
+            # runs before every other request hook, they may need the database
+            app.before_request(init_database)
+
+        with timed('routes'):
+            import core.main
+
+        _app_created = True
+
+    logger.info("Created app: " + ', '.join(f"{phase}={seconds * 1000:.1f}ms" for phase, seconds in startup_timings.items()))
+    return app
+
+
+_db_initialized = False
+_db_lock = threading.Lock()
+
+def init_database():
+    """ Create the tables and the admin user, once per process """
+    global _db_initialized
+    if _db_initialized:
+        return
+
+    with _db_lock:
+        if _db_initialized:
+            return
+
+        with timed('database'), app.app_context():
+            init_db(db,
+                    config["core"]["admin"]["username"],
+                    config["core"]["admin"]["password"],
+                    config["core"]["jwt_secret_key"])
+        _db_initialized = True
+
+    logger.info(f"Initialized database in {startup_timings['database'] * 1000:.1f}ms")
+
 
-# Init db
-db = SQLAlchemy(app, query_class=CustomBaseQuery)
+def collect_startup_timings():
+    """ Startup phases for the metrics endpoint """
+    return [("startup_phase_seconds", 'gauge', "Seconds spent in a startup phase",
+             [({'phase': phase}, seconds) for phase, seconds in startup_timings.items()])]
 
-init_db(db,
-        config["core"]["admin"]["username"],
-        config["core"]["admin"]["password"])
+metrics.registry.register_collector(collect_startup_timings)
@@ -1,25 +1,33 @@
 import logging
 import sys
+import time
 from pprint import pprint
 from functools import wraps
 
 from core import app
 from core import config
 from core import plugin_manager
+from core import metrics
+from core import db
 from core.messages import message
 
 from core.exceptions import AuthException, AuthUserNotAddedError, AuthUserNotChangedError
 from core.exceptions import UnauthorizedError, ForbiddenError, NotFoundError, BadRequestError, ConflictError, InternalServerError
+from core.exceptions import ServiceUnavailableError
 from core.exceptions import BadRequestError
 
 from core.auth import Auth
 
 from core.models import User
+from core.permissions import get_permission_cache
 
 from flask import jsonify
 from flask import request
+from flask import make_response
+from flask import g
 
 from flask_jwt_extended import jwt_required, get_jwt_identity 
+from sqlalchemy.exc import SQLAlchemyError
 
 # configure logging
 formatter_info = logging.Formatter('%(message)s')
@@ -40,10 +48,34 @@ streamhandler.setFormatter(formatter_debug)
 @app.errorhandler(BadRequestError)
 @app.errorhandler(ConflictError)
 @app.errorhandler(InternalServerError)
+@app.errorhandler(ServiceUnavailableError)
 def handle_error(error):
+    metrics.api_errors.inc(error=type(error).__name__)
     return jsonify(error.to_dict()), error.status_code
 
 
+def get_route():
+    """ Return the url rule of the request, so all posts share one label """
+    return request.url_rule.rule if request.url_rule != None else 'none'
+
+@app.before_request
+def start_request_metrics():
+    g.request_start = time.perf_counter()
+    metrics.start_request(get_route())
+
+@app.after_request
+def record_request_metrics(response):
+    metrics.http_request_seconds.observe(time.perf_counter() - g.request_start,
+                                         route=get_route(),
+                                         method=request.method,
+                                         status=response.status_code)
+    return response
+
+@app.teardown_request
+def end_request_metrics(error=None):
+    metrics.end_request()
+
+
 def requires_post_data(func):
     """ Raise BadRequestError if no post data is given """
     @wraps(func)
@@ -55,7 +87,7 @@ def requires_post_data(func):
 
 def check_admin_identity(func):
     """ Decorator function that checks if token identity corresponds
-        with an admin user id from the database """
+        with an admin user id, permissions come from the permission cache """
     @wraps(func)
     def inside(*args, **kwargs):
         try:
@@ -67,7 +99,8 @@ def check_admin_identity(func):
             logger.error(f"Unauthorized: failed to get JWT identity")
             raise UnauthorizedError
         else:
-            if not User.query.filter_by(user_id=user_id, admin=True).first():
+            permissions = get_permission_cache().get(user_id)
+            if permissions == None or not permissions.admin:
                 logger.error(f"Unauthorized: user {user_id} is not an admin")
                 raise UnauthorizedError
             return func(*args, **kwargs)
@@ -88,35 +121,31 @@ def check_appid_permissions(func):
             logger.error(f"Unauthorized: failed to get JWT identity")
             raise UnauthorizedError
         else:
+            permissions = get_permission_cache().get(user_id)
+            if permissions == None:
+                logger.error(f"Unauthorized: user {user_id} does not exist")
+                raise UnauthorizedError
+
             # admin may always post
-            if not User.query.filter_by(user_id=user_id, admin=True).first():
+            if not permissions.admin:
 
                 # try to get app_id from request
                 try:
                     app_id = request.json["app_id"]
                 except KeyError as e:
-                    logger.error(f"Failed login attempt for user {user.username} with id {user.user_id}: no app_id in request")
+                    logger.error(f"Failed login attempt for user {permissions.username} with id {user_id}: no app_id in request")
                     raise UnauthorizedError
                 except TypeError as e:
-                    logger.error(f"Failed login attempt for user {user.username} with id {user.user_id}: no app_id in request")
+                    logger.error(f"Failed login attempt for user {permissions.username} with id {user_id}: no app_id in request")
                     raise UnauthorizedError
                 else:
                     if app_id == None:
-                        logger.error(f"Failed login attempt for user {user.username} with id {user.user_id}: no app_id in request")
+                        logger.error(f"Failed login attempt for user {permissions.username} with id {user_id}: no app_id in request")
                         raise UnauthorizedError(f"Missing app_id in body")
 
-                user = User.query.get_or_404(user_id)
-
-                # try to match app_id from request to the access rights of user. remove whitespace and stuff
-                try:
-                    user_app_ids = [x.strip() for x in user.app_ids.split(',')]
-                except AttributeError as e:
-                    logger.error(f"Failed login attempt for user {user.username} with id {user.user_id}: insufficient rights on app_id: {app_id}")
+                if not permissions.allows(str(app_id).strip()):
+                    logger.error(f"Failed login attempt for user {permissions.username} with id {user_id}: insufficient rights on app_id: {app_id}")
                     raise UnauthorizedError
-                else:
-                    if not app_id in user_app_ids:
-                        logger.error(f"Failed login attempt for user {user.username} with id {user.user_id}: insufficient rights on app_id: {app_id}")
-                        raise UnauthorizedError
 
             return func(*args, **kwargs)
     return inside
@@ -192,6 +221,8 @@ class APIUser(Auth):
             user = self.update_user(user, dict(request.json))
         except AuthUserNotChangedError as e:
             raise ConflictError("Failed to create user", trace=e)
+        finally:
+            get_permission_cache().invalidate(user_id)
 
         return message(msg=f"Successfully updated user: {user.user_id}", payload=user.serialize())
 
@@ -204,18 +235,81 @@ class APIUser(Auth):
             db.session.commit()
         except SQLAlchemyError as e:
             raise ConflictError(f"Failed to delete user: {user_id}", trace=e)
+        finally:
+            get_permission_cache().invalidate(user_id)
 
         return message(msg=f"Successfully deleted user: {user.user_id}", payload=user.serialize())
 
 
 class APIComments():
+    def cache_headers(self, response, etag):
+        """ The CID of a post changes with every change to its comments.
+            It is a strong ETag only when the body is the same for the same CID, by default the body
+            has a timestamp and the ETag is weak """
+        if etag:
+            response.set_etag(etag, weak=not config['core'].get('stable_responses', False))
+        response.headers['Cache-Control'] = config['core'].get('comments_cache_control', 'public, no-cache')
+        return response
+
     def get_comments(self, site_id, blog_id, post_id):
+        etag = plugin_manager.run_hook('get_post_cid', site_id, blog_id, post_id)
+
+        # client already has this version of the post, don't serialize anything
+        # If-None-Match uses the weak comparison, W/"cid" and "cid" are the same version
+        if etag and request.if_none_match.contains_weak(etag):
+            return self.cache_headers(make_response('', 304), etag)
+
+        # paginated: newest first, cursor comes from next_cursor of the previous page
+        limit = request.args.get('limit', type=int)
+        cursor = request.args.get('cursor')
+        if limit != None and limit < 1:
+            raise BadRequestError("limit must be a positive number")
+
+        # replies nested under the comment they reply to
+        threaded = request.args.get('threaded', default=0, type=int) == 1
+        max_depth = request.args.get('depth', type=int)
+        max_children = request.args.get('max_children', type=int)
+        if (max_depth != None and max_depth < 1) or (max_children != None and max_children < 1):
+            raise BadRequestError("depth and max_children must be positive numbers")
 
         # call plugins to create extra pages, eg: rss, site_map etc...
-        res = plugin_manager.run_hook('get_comments', site_id, blog_id, post_id)
+        res = plugin_manager.run_hook('get_comments', site_id, blog_id, post_id,
+                                      limit=limit,
+                                      cursor=cursor,
+                                      threaded=threaded,
+                                      max_depth=max_depth,
+                                      max_children=max_children)
 
         #raise InternalServerError("disko", trace={"bla": "bla"})
-        return message(payload=res)
+        stable = config['core'].get('stable_responses', False)
+        return self.cache_headers(message(payload=res, timestamp=not stable), etag)
+
+    def immutable(self, payload, cid):
+        """ Everything that is addressed by CID never changes, it can be cached forever """
+        response = message(payload=payload, timestamp=False)
+        response.set_etag(cid)
+        response.headers['Cache-Control'] = config['core'].get('immutable_cache_control', 'public, max-age=31536000, immutable')
+        return response
+
+    def not_modified(self, cid):
+        response = make_response('', 304)
+        response.set_etag(cid)
+        response.headers['Cache-Control'] = config['core'].get('immutable_cache_control', 'public, max-age=31536000, immutable')
+        return response
+
+    def get_node(self, cid):
+        if request.if_none_match.contains(cid):
+            return self.not_modified(cid)
+
+        res = plugin_manager.run_hook('get_node', cid)
+        return self.immutable(res, cid)
+
+    def get_comments_by_cid(self, cid):
+        if request.if_none_match.contains(cid):
+            return self.not_modified(cid)
+
+        res = plugin_manager.run_hook('get_comments_by_cid', cid)
+        return self.immutable(res, cid)
 
     @jwt_required()
     @requires_post_data
@@ -226,3 +320,22 @@ class APIComments():
 
         #raise InternalServerError("disko", trace={"bla": "bla"})
         return message(msg="Added comment", payload=res)
+
+
+class APIMetrics():
+    def render(self):
+        """ Metrics in the Prometheus text format """
+        response = make_response(metrics.registry.render())
+        response.headers['Content-Type'] = 'text/plain; version=0.0.4; charset=utf-8'
+        return response
+
+    @jwt_required()
+    @check_admin_identity
+    def get_admin_metrics(self):
+        return self.render()
+
+    def get_metrics(self):
+        """ Only admins can read metrics, unless metrics_public is set, eg: for a scraper on a private network """
+        if config['core'].get('metrics_public', False):
+            return self.render()
+        return self.get_admin_metrics()
@@ -3,7 +3,6 @@
 import logging
 import datetime
 
-from passlib.hash import sha256_crypt
 from flask_jwt_extended import create_access_token
 from sqlalchemy.exc import SQLAlchemyError
 
@@ -12,14 +11,14 @@ from flask_jwt_extended import get_jwt_identity
 from core import db
 from core.models import User
 from core.exceptions import AuthUserNotFoundError, AuthUserNotAddedError, AuthUserNotChangedError
-from core.utils import get_password_hash
+from core.hashing import hash_password, verify_password
 
 logger = logging.getLogger('app')
 
 class Auth():
     def verify_password(self, username, password):
         user = User.query.filter_by(username=username).first()
-        return sha256_crypt.verify(password, user.password)
+        return verify_password(password, user.password)
 
     def check_user_identity(self):
         """ Check if JWT token identity exists in user table, and if user has admin permissions """
@@ -44,7 +43,7 @@ class Auth():
 
             # TODO do some password testing
             if k == "password":
-                v = get_password_hash(str(v))
+                v = hash_password(str(v))
 
             setattr(user, k, v)
 
@@ -64,7 +63,7 @@ class Auth():
 
             # TODO do some password testing
             if k == "password":
-                v = get_password_hash(str(v))
+                v = hash_password(str(v))
 
             setattr(user, k, v)
 
@@ -74,6 +74,15 @@ class ConflictError(APIResponseBaseException):
         self.status = "409: Conflict"
         self.message = message
 
+class ServiceUnavailableError(APIResponseBaseException):
+    """ For overload, the client may retry later """
+    def __init__(self, message="Service unavailable", payload={}, trace=None):
+        self.status_code = 503
+        self.payload = payload
+        self.trace = str(trace)
+        self.status = "503: Service Unavailable"
+        self.message = message
+
 class InternalServerError(APIResponseBaseException):
     def __init__(self, message="Internal server error", payload={}, trace=None):
         self.status_code = 500
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from passlib.hash import sha256_crypt
+
+from core import config
+from core import metrics
+from core.exceptions import ServiceUnavailableError
+
+logger = logging.getLogger('app')
+
+
+# these run in the worker processes
+def _hash(password):
+    return sha256_crypt.hash(password)
+
+def _verify(password, password_hash):
+    return sha256_crypt.verify(password, password_hash)
+
+
+class HashPool():
+    """ Runs sha256_crypt in worker processes, a hash takes hundreds of milliseconds of CPU
+        that would otherwise block a request thread and hold the GIL.
+        At most max_pending jobs wait or run, more are rejected with ServiceUnavailableError
+        so a burst of logins fails fast instead of queueing up behind each other.
+        With workers=0 hashing runs on the calling thread.
+        Workers are started with forkserver (spawn where that isn't available), forking a process
+        that already runs request and commit threads can copy a lock that is held and deadlock. """
+    def __init__(self, workers, max_pending, timeout=30):
+        self._workers = workers
+        self._max_pending = max_pending
+        self._timeout = timeout
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._pool = self._create_pool() if workers > 0 else None
+
+        self.rejected = 0
+        self.restarts = 0
+
+    def _create_pool(self):
+        method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+        return ProcessPoolExecutor(max_workers=self._workers, mp_context=multiprocessing.get_context(method))
+
+    def _restart(self, pool):
+        """ Replace a broken pool, unless another thread already did """
+        with self._lock:
+            if self._pool is not pool:
+                return
+            logger.error("Hash pool broken, a worker died, restarting the pool")
+            self._pool = self._create_pool()
+            self.restarts += 1
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    @property
+    def pending(self):
+        return self._pending
+
+    def _done(self, future):
+        with self._lock:
+            self._pending -= 1
+
+    def run(self, fn, *args):
+        if self._pool == None:
+            return fn(*args)
+
+        with self._lock:
+            if self._pending >= self._max_pending:
+                self.rejected += 1
+                logger.error(f"Hash pool full, {self._pending} jobs pending")
+                raise ServiceUnavailableError("Too many login attempts, try again later")
+            self._pending += 1
+
+        pool = self._pool
+        try:
+            future = pool.submit(fn, *args)
+        except BrokenProcessPool as e:
+            self._done(None)
+            self._restart(pool)
+            raise ServiceUnavailableError("Password hashing unavailable, try again", trace=e)
+        future.add_done_callback(self._done)
+        try:
+            return future.result(timeout=self._timeout)
+        except TimeoutError as e:
+            raise ServiceUnavailableError("Password hashing timed out", trace=e)
+        except BrokenProcessPool as e:
+            self._restart(pool)
+            raise ServiceUnavailableError("Password hashing unavailable, try again", trace=e)
+
+    def hash(self, password):
+        return self.run(_hash, password)
+
+    def verify(self, password, password_hash):
+        return self.run(_verify, password, password_hash)
+
+    def shutdown(self):
+        if self._pool != None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+_hash_pool = None
+_hash_pool_lock = threading.Lock()
+
+def get_hash_pool():
+    """ Return the process wide hash pool, create it on first use """
+    global _hash_pool
+    with _hash_pool_lock:
+        if _hash_pool == None:
+            cfg = config['core']
+            workers = int(cfg.get('hash_workers', min(4, os.cpu_count() or 1)))
+            max_pending = int(cfg.get('hash_max_pending', 4 * max(workers, 1)))
+            _hash_pool = HashPool(workers, max_pending, float(cfg.get('hash_timeout', 30)))
+            logger.info(f"Created hash pool, workers={workers}, max_pending={max_pending}")
+    return _hash_pool
+
+def hash_password(password):
+    return get_hash_pool().hash(password)
+
+def verify_password(password, password_hash):
+    return get_hash_pool().verify(password, password_hash)
+
+
+def collect_hash_stats():
+    """ Statistics of the hash pool for the metrics endpoint, zeros until the first hash starts the pool """
+    pool = _hash_pool
+    pending, rejected, restarts = (0, 0, 0) if pool == None else (pool.pending, pool.rejected, pool.restarts)
+    return [("hash_pool_pending", 'gauge', "Password hash jobs waiting or running", [({}, pending)]),
+            ("hash_pool_rejected_total", 'counter', "Password hash jobs rejected because the pool was full", [({}, rejected)]),
+            ("hash_pool_restarts_total", 'counter', "Hash pool restarts after a worker died", [({}, restarts)])]
+
+metrics.registry.register_collector(collect_hash_stats)
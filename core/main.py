@@ -1,13 +1,15 @@
 #!/usr/bin/env python3
 
 from core import app
+from core import config
 from core import api
-from core.api import APIAuth, APIUser, APIComments
+from core.api import APIAuth, APIUser, APIComments, APIMetrics
 
 
 auth_resource = APIAuth()
 users_resource = APIUser()
 comments_resource = APIComments()
+metrics_resource = APIMetrics()
 
 prefix = "/v0.1"
 app.add_url_rule(f"{prefix}/auth", view_func=auth_resource.post_login, methods=["POST"])
@@ -21,6 +23,16 @@ app.add_url_rule(f"{prefix}/users/<user_id>", view_func=users_resource.put_user,
 app.add_url_rule(f"{prefix}/sites/<site_id>/blogs/<blog_id>/posts/<post_id>/comments", view_func=comments_resource.get_comments, methods=["GET"])
 app.add_url_rule(f"{prefix}/sites/<site_id>/blogs/<blog_id>/posts/<post_id>/comments", view_func=comments_resource.post_comment, methods=["POST"])
 
+# content addressed, responses never change
+app.add_url_rule(f"{prefix}/cid/<cid>", view_func=comments_resource.get_node, methods=["GET"])
+app.add_url_rule(f"{prefix}/cid/<cid>/comments", view_func=comments_resource.get_comments_by_cid, methods=["GET"])
+
+app.add_url_rule("/metrics", view_func=metrics_resource.get_metrics, methods=["GET"])
+
+if config['core'].get('profiling', False):
+    from core.profiling import init_profiling
+    init_profiling(app)
+
 # only for development purposes
 def run():
     app.run(debug=True, host='0.0.0.0')
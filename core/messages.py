@@ -3,10 +3,12 @@ import datetime
 from flask import jsonify
 
 
-def message(msg='ok', payload={}):
+def message(msg='ok', payload={}, timestamp=True):
+    """ Without timestamp the same payload always gives the same body, so it can be cached """
     d = {}
     d["message"] = msg
     d["status_code"] = 200
     d["payload"] = payload
-    d["time"] = datetime.datetime.utcnow()
+    if timestamp:
+        d["time"] = datetime.datetime.utcnow()
     return jsonify(d)
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+
+import contextvars
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger('app')
+
+# same as the prometheus client defaults
+DEFAULT_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1.0, 2.5, 5.0, 10.0)
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    values = [f'{k}="{escape(v)}"' for k,v in labels.items()]
+    return '{' + ','.join(values) + '}'
+
+
+class Metric():
+    """ Base class of a metric with a fixed set of label names """
+    type = None
+
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.type}"]
+        with self._lock:
+            values = dict(self._values)
+        for key, value in sorted(values.items()):
+            lines += self.render_value(dict(zip(self.labels, key)), value)
+        return lines
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    def render_value(self, labels, value):
+        return [f"{self.name}{format_labels(labels)} {value}"]
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, description, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, description, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            if (entry := self._values.get(key)) == None:
+                # per bucket counts, sum, count
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    def render_value(self, labels, value):
+        counts, total, count = value
+        lines = []
+        cumulative = 0
+        for bound, n in zip(self.buckets, counts):
+            cumulative += n
+            lines.append(f"{self.name}_bucket{format_labels({**labels, 'le': bound})} {cumulative}")
+        lines.append(f"{self.name}_bucket{format_labels({**labels, 'le': '+Inf'})} {count}")
+        lines.append(f"{self.name}_sum{format_labels(labels)} {total}")
+        lines.append(f"{self.name}_count{format_labels(labels)} {count}")
+        return lines
+
+
+class Registry():
+    """ All metrics of the process, rendered in the Prometheus text format.
+        Collectors are functions that are called on every render and return values that
+        are kept somewhere else, eg: cache statistics, as a list of:
+            (name, type, description, [(labels, value)]) """
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def counter(self, *args, **kwargs):
+        metric = Counter(*args, **kwargs)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, *args, **kwargs):
+        metric = Histogram(*args, **kwargs)
+        self._metrics.append(metric)
+        return metric
+
+    def register_collector(self, collector):
+        self._collectors.append(collector)
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines += metric.render()
+
+        for collector in self._collectors:
+            try:
+                collected = collector()
+            except Exception as e:
+                logger.error(f"Metrics collector failed: {e}")
+                continue
+            for name, _type, description, values in collected:
+                lines += [f"# HELP {name} {description}", f"# TYPE {name} {_type}"]
+                lines += [f"{name}{format_labels(labels)} {value}" for labels, value in values]
+
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+http_request_seconds = registry.histogram('http_request_duration_seconds', "Time spent handling requests", labels=('route', 'method', 'status'))
+api_errors = registry.counter('api_errors_total', "API errors by exception class", labels=('error',))
+ipfs_calls = registry.counter('ipfs_calls_total', "IPFS block store calls", labels=('op', 'route'))
+ipfs_bytes = registry.counter('ipfs_bytes_total', "Bytes read from and written to the IPFS block store", labels=('op', 'route'))
+ipfs_seconds = registry.histogram('ipfs_call_duration_seconds', "Time spent in IPFS block store calls", labels=('op', 'route'))
+
+
+class RequestIO():
+    """ IPFS I/O of one request, shared with the threads that work for the request """
+    def __init__(self, route):
+        self.route = route
+        self.calls = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, nbytes, seconds, calls=1):
+        with self._lock:
+            self.calls += calls
+            self.bytes += nbytes
+            self.seconds += seconds
+
+    def merge(self, other):
+        """ Count the I/O of other as well, eg: of work that was done for several requests at once """
+        self.add(other.bytes, other.seconds, calls=other.calls)
+
+
+# threads in a pool only see these when they run in a copy of the request's context
+_request_io = contextvars.ContextVar('request_io', default=None)
+
+def start_request(route):
+    """ Start counting I/O for the request that runs in the current context """
+    io = RequestIO(route)
+    _request_io.set(io)
+    return io
+
+def end_request():
+    _request_io.set(None)
+
+def get_request_io():
+    return _request_io.get()
+
+
+class IOCall():
+    """ Set bytes to the size of the transferred block """
+    bytes = 0
+
+@contextmanager
+def ipfs_io(op):
+    """ Count and time one block store call """
+    call = IOCall()
+    start = time.perf_counter()
+    try:
+        yield call
+    finally:
+        seconds = time.perf_counter() - start
+        io = _request_io.get()
+        route = io.route if io != None else 'none'
+
+        ipfs_calls.inc(op=op, route=route)
+        ipfs_bytes.inc(call.bytes, op=op, route=route)
+        ipfs_seconds.observe(seconds, op=op, route=route)
+        if io != None:
+            io.add(call.bytes, seconds)
@@ -29,7 +29,32 @@ class User(db.Model):
     admin = db.Column(db.Boolean(), default=False)
 
     # the app ids the user is allowed to post data to, an admin is allowed to post to all app ids
-    app_ids = db.Column(db.String(1000), nullable=True)
+    app_id_rows = db.relationship('UserAppId', cascade='all, delete-orphan', lazy='selectin')
+
+    @property
+    def app_ids(self):
+        """ Comma separated app ids, the format the API has always used """
+        if not self.app_id_rows:
+            return None
+        return ','.join(sorted(row.app_id for row in self.app_id_rows))
+
+    @app_ids.setter
+    def app_ids(self, value):
+        """ Accepts comma separated app ids or a list of app ids """
+        if value == None:
+            value = []
+        elif isinstance(value, str):
+            value = value.split(',')
+
+        app_ids = {str(x).strip() for x in value if str(x).strip()}
+        self.app_id_rows = [row for row in self.app_id_rows if row.app_id in app_ids]
+        existing = {row.app_id for row in self.app_id_rows}
+        self.app_id_rows += [UserAppId(app_id=x) for x in sorted(app_ids - existing)]
+
+    @classmethod
+    def with_app_id(cls, app_id):
+        """ Query of the users that may post to app_id, admins not included """
+        return cls.query.join(UserAppId).filter(UserAppId.app_id == app_id)
 
     def serialize(self):
         data = {}
@@ -43,3 +68,24 @@ class User(db.Model):
 
     def __repr__(self):
         return str(self.serialize())
+
+
+class Setting(db.Model):
+    """ Key value pairs the app keeps for itself, eg: the fingerprint of the configured admin password """
+    __tablename__ = 'settings'
+
+    key = db.Column(db.String(120), primary_key=True)
+    value = db.Column(db.Text, nullable=True)
+
+
+class UserAppId(db.Model):
+    """ One row for every app id a user is allowed to post to.
+        The primary key answers "which app ids has this user", the index "which users may post to this app id" """
+    __tablename__ = 'user_app_ids'
+    __table_args__ = (db.Index('ix_user_app_ids_app_id_user_id', 'app_id', 'user_id'),)
+
+    user_id = db.Column(db.Integer, db.ForeignKey('user.user_id', ondelete='CASCADE'), primary_key=True)
+    app_id = db.Column(db.String(120), primary_key=True)
+
+    def __repr__(self):
+        return f"UserAppId({self.user_id}, {self.app_id})"
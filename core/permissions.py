@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+
+import logging
+import threading
+import time
+
+from core import config
+from core import metrics
+from core.models import User
+
+logger = logging.getLogger('app')
+
+
+class Permissions():
+    """ What a user is allowed to do, an admin is allowed to post to all app ids """
+    def __init__(self, user_id, username, admin, app_ids):
+        self.user_id = user_id
+        self.username = username
+        self.admin = bool(admin)
+        self.app_ids = app_ids
+
+    def allows(self, app_id):
+        return self.admin or app_id in self.app_ids
+
+
+class PermissionCache():
+    """ In-process cache that maps a user id to its permissions, so authorization doesn't query the database
+        on every request. Entries expire after ttl seconds, changes to a user invalidate its entry right away.
+        Other processes only see a change after the ttl, unknown users are not cached. """
+    def __init__(self, ttl):
+        self._ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def load(self, user_id):
+        user = User.query.get(user_id)
+        if user == None:
+            return
+        return Permissions(user.user_id, user.username, user.admin, frozenset(row.app_id for row in user.app_id_rows))
+
+    def get(self, user_id):
+        """ Return Permissions of user or None if the user doesn't exist """
+        key = str(user_id)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry != None and entry[1] > now:
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+
+        permissions = self.load(user_id)
+        if permissions != None and self._ttl > 0:
+            with self._lock:
+                self._entries[key] = (permissions, now + self._ttl)
+        return permissions
+
+    def invalidate(self, user_id=None):
+        """ Drop the entry of one user, or all entries """
+        with self._lock:
+            if user_id == None:
+                self._entries.clear()
+            else:
+                self._entries.pop(str(user_id), None)
+
+    def stats(self):
+        return {"hits"    : self.hits,
+                "misses"  : self.misses,
+                "entries" : len(self._entries),
+                "ttl"     : self._ttl}
+
+
+_permission_cache = None
+_permission_cache_lock = threading.Lock()
+
+def get_permission_cache():
+    """ Return the process wide permission cache, create it on first use """
+    global _permission_cache
+    with _permission_cache_lock:
+        if _permission_cache == None:
+            ttl = float(config['core'].get('permission_cache_ttl', 60))
+            _permission_cache = PermissionCache(ttl)
+            logger.info(f"Created permission cache, ttl={ttl}")
+    return _permission_cache
+
+
+def collect_permission_stats():
+    """ Statistics of the permission cache for the metrics endpoint """
+    stats = get_permission_cache().stats()
+    return [("permission_cache_hits_total", 'counter', "Permission cache hits", [({}, stats['hits'])]),
+            ("permission_cache_misses_total", 'counter', "Permission cache misses", [({}, stats['misses'])]),
+            ("permission_cache_entries", 'gauge', "Permission cache entries", [({}, stats['entries'])])]
+
+metrics.registry.register_collector(collect_permission_stats)
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+
+import cProfile
+import datetime
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+
+from core import config
+from core import metrics
+from core.api import check_admin_identity
+from core.exceptions import UnauthorizedError
+
+from flask import request
+from flask import g
+from flask_jwt_extended import verify_jwt_in_request
+from flask_jwt_extended.exceptions import JWTExtendedException
+from jwt.exceptions import PyJWTError
+
+logger = logging.getLogger('app')
+
+# request header that asks for a profile of the request
+PROFILE_HEADER = 'X-Profile'
+
+
+class StackSampler(threading.Thread):
+    """ Sample the stack of one thread at a fixed interval.
+        Stacks are kept as collapsed stacks, the input format of flamegraph.pl and speedscope:
+            outer;inner;innermost count """
+    def __init__(self, thread_id, interval=0.001):
+        super().__init__(name='profile-sampler', daemon=True)
+        self._thread_id = thread_id
+        self._interval = interval
+        self._stop_event = threading.Event()
+        self.stacks = Counter()
+
+    def run(self):
+        while not self._stop_event.wait(self._interval):
+            if (frame := sys._current_frames().get(self._thread_id)) == None:
+                continue
+
+            stack = []
+            while frame != None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            self.stacks[';'.join(reversed(stack))] += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+    def collapsed(self):
+        return '\n'.join(f"{stack} {count}" for stack, count in self.stacks.most_common()) + '\n'
+
+
+class RequestProfiler():
+    """ Profiles one request with cProfile (deterministic, for pstats) and a stack sampler (for flame graphs).
+        Only one request is profiled at a time, the interpreter allows one active profiler """
+    _lock = threading.Lock()
+
+    def __init__(self, interval):
+        self._profile = cProfile.Profile()
+        self._sampler = StackSampler(threading.get_ident(), interval)
+        self._start = None
+
+    def start(self):
+        if not self._lock.acquire(blocking=False):
+            return False
+        self._start = time.perf_counter()
+        self._sampler.start()
+        self._profile.enable()
+        return True
+
+    def stop(self):
+        self._profile.disable()
+        self._sampler.stop()
+        self.seconds = time.perf_counter() - self._start
+        self._lock.release()
+
+    def write(self, path, route, status):
+        """ Write <name>.prof, <name>.collapsed and <name>.json, return name """
+        io = metrics.get_request_io()
+        ipfs_calls = io.calls if io != None else 0
+
+        slug = re.sub(r'[^a-zA-Z0-9]+', '_', route).strip('_') or 'none'
+        name = f"{datetime.datetime.utcnow().strftime('%Y%m%d_%H%M%S_%f')}_{slug}_{ipfs_calls}calls"
+
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        self._profile.dump_stats(path / f"{name}.prof")
+        (path / f"{name}.collapsed").write_text(self._sampler.collapsed())
+        (path / f"{name}.json").write_text(json.dumps({"route"      : route,
+                                                       "method"     : request.method,
+                                                       "url"        : request.full_path,
+                                                       "status"     : status,
+                                                       "seconds"    : self.seconds,
+                                                       "ipfs_calls" : ipfs_calls,
+                                                       "ipfs_bytes" : io.bytes if io != None else 0,
+                                                       "ipfs_seconds" : io.seconds if io != None else 0}, indent=4))
+        return name
+
+
+@check_admin_identity
+def check_admin():
+    return True
+
+def start_profile():
+    if not request.headers.get(PROFILE_HEADER):
+        return
+
+    # profiling must never change the response, a client that isn't an admin just isn't profiled
+    try:
+        verify_jwt_in_request()
+        check_admin()
+    except (JWTExtendedException, PyJWTError, UnauthorizedError) as e:
+        logger.debug(f"Not profiling request, not an admin: {e}")
+        return
+
+    profiler = RequestProfiler(float(config['core'].get('profiling_interval', 0.001)))
+    if not profiler.start():
+        logger.info("Not profiling request, another request is being profiled")
+        return
+    g.profiler = profiler
+
+def stop_profile(response):
+    if (profiler := g.pop('profiler', None)) == None:
+        return response
+
+    profiler.stop()
+    route = request.url_rule.rule if request.url_rule != None else 'none'
+    name = profiler.write(config['core']['profiling_dir'], route, response.status_code)
+    logger.info(f"Wrote profile: {name}")
+    response.headers['X-Profile-Id'] = name
+    return response
+
+def abort_profile(error=None):
+    """ The request failed before a response was made, release the profiler without writing """
+    if (profiler := g.pop('profiler', None)) != None:
+        profiler.stop()
+
+def init_profiling(app):
+    """ Profile requests of admins that send the X-Profile header.
+        Only called when profiling is enabled, otherwise requests don't run any of this """
+    app.before_request(start_profile)
+    app.after_request(stop_profile)
+    app.teardown_request(abort_profile)
+    logger.info(f"Profiling enabled, profiles are written to: {config['core']['profiling_dir']}")
@@ -1,3 +1,5 @@
+import hashlib
+import hmac
 import logging
 from passlib.hash import sha256_crypt
 
@@ -6,7 +8,9 @@ from passlib.hash import sha256_crypt
 from flask_sqlalchemy import SQLAlchemy, BaseQuery
 
 from core.exceptions import NotFoundError, InternalServerError, AuthException, AuthUserNotAddedError
+from sqlalchemy import event, inspect, text
 from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.pool import QueuePool
 
 
 logger = logging.getLogger('app')
@@ -40,6 +44,12 @@ class CustomBaseQuery(BaseQuery):
 def get_password_hash(password):
     return sha256_crypt.encrypt(password)
 
+def admin_fingerprint(secret, username, password, password_hash):
+    """ Cheap stand-in for verifying the configured admin password against its hash at startup.
+        The stored hash is part of it, so a password that was changed through the API is set back """
+    message = '\0'.join([username, password, password_hash]).encode()
+    return hmac.new(secret.encode(), message, hashlib.sha256).hexdigest()
+
 def add_admin_user(username, password, db):
     from core.models import User
     admin_user = User()
@@ -55,26 +65,83 @@ def add_admin_user(username, password, db):
         print(e)
 
 
-def init_db(db, admin_username, admin_password):
-    from core.models import User
+def get_engine_options(cfg):
+    """ SQLAlchemy engine options from config['sqlite'].
+        A pool keeps connections open, so the pragmas are only set once per connection """
+    options = {'connect_args' : {'timeout' : float(cfg.get('busy_timeout', 5)),
+                                 'check_same_thread' : False}}
+    pool_size = int(cfg.get('pool_size', 5))
+    if pool_size > 0:
+        options['poolclass'] = QueuePool
+        options['pool_size'] = pool_size
+        options['max_overflow'] = int(cfg.get('max_overflow', 10))
+        options['pool_timeout'] = float(cfg.get('pool_timeout', 30))
+    return options
+
+def sqlite_pragmas(journal_mode='WAL', synchronous='NORMAL'):
+    """ Return a connect listener that configures every new connection.
+        In WAL mode readers don't block behind a writer, and with synchronous=NORMAL
+        a commit doesn't wait for an fsync of the database, only checkpoints do """
+    def on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute(f"PRAGMA journal_mode={journal_mode}")
+        cursor.execute(f"PRAGMA synchronous={synchronous}")
+        cursor.execute("PRAGMA foreign_keys=ON")
+        cursor.close()
+    return on_connect
+
+def migrate_app_ids(db):
+    """ Move the comma separated app ids of the user table to the user_app_ids table.
+        The old column is emptied, not dropped, so running this again does nothing """
+    columns = [c['name'] for c in inspect(db.engine).get_columns('user')]
+    if 'app_ids' not in columns:
+        return
+
+    with db.engine.begin() as connection:
+        rows = connection.execute(text("SELECT user_id, app_ids FROM user WHERE app_ids IS NOT NULL AND app_ids != ''")).fetchall()
+        for user_id, app_ids in rows:
+            for app_id in {x.strip() for x in app_ids.split(',') if x.strip()}:
+                connection.execute(text("INSERT OR IGNORE INTO user_app_ids (user_id, app_id) VALUES (:user_id, :app_id)"),
+                                   {"user_id": user_id, "app_id": app_id})
+        connection.execute(text("UPDATE user SET app_ids = NULL"))
+
+    if rows:
+        logger.info(f"Migrated app ids of {len(rows)} users to user_app_ids")
+
+
+def init_engine(db, sqlite_config):
+    """ Configure the connections of the engine, call before the first connection is made """
+    event.listen(db.engine, 'connect', sqlite_pragmas(sqlite_config.get('journal_mode', 'WAL'),
+                                                      sqlite_config.get('synchronous', 'NORMAL')))
+
+
+def init_db(db, admin_username, admin_password, secret):
+    from core.models import User, Setting
 
     db.create_all()
     logger.info("Created database...")
+    migrate_app_ids(db)
 
     user = User.query.filter_by(username=admin_username).first()
-    print(user)
+    fingerprint = Setting.query.get('admin_fingerprint')
     if not user:
-        print("Created new admin user")
+        logger.info("Created new admin user")
         user = User()
+    elif user.admin and fingerprint != None and hmac.compare_digest(fingerprint.value,
+            admin_fingerprint(secret, admin_username, str(admin_password), user.password)):
+        # an HMAC instead of a sha256_crypt run, the hash is only computed when the password changed
+        logger.info("Admin user is up to date")
+        return
     else:
-        print("Updated admin user")
+        logger.info("Updated admin user")
 
     user.username = admin_username
     user.password = get_password_hash(str(admin_password))
     user.admin = True
-    print(">>>>>>>>>>", user)
 
     db.session.add(user)
+    db.session.merge(Setting(key='admin_fingerprint',
+                             value=admin_fingerprint(secret, admin_username, str(admin_password), user.password)))
 
     try:
         db.session.commit()
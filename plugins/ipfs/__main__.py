@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+
+""" Maintenance commands for the IPFS plugin, run as: python -m plugins.ipfs <command> """
+
+import argparse
+import json
+import logging
+import sys
+
+from core import create_app, config
+
+from plugins.ipfs.blockstore import get_block_store
+from plugins.ipfs.roots import get_root_store, RootStoreConflictError
+
+logger = logging.getLogger('app')
+
+
+def publish(root_store, version, cid):
+    """ Publish cid as the new root, returns False when another writer published a root since version was read.
+        The blocks are already written, so running the command again only redoes the work on the new root """
+    try:
+        root_store.compare_and_swap(version, cid)
+    except RootStoreConflictError as e:
+        print(f"Root changed while running, not published: {cid}, run the command again ({e})")
+        return False
+    return True
+
+
+def reindex(args):
+    """ Rebuild the local comment index from the current root """
+    from plugins.ipfs.index import get_comment_index
+
+    version, root_cid = get_root_store().get()
+    if not root_cid:
+        print("No root CID found")
+        return 1
+
+    with create_app().app_context():
+        get_comment_index().rebuild(get_block_store(), root_cid)
+
+    print(f"Indexed root: {root_cid}")
+
+
+def migrate(args):
+    """ Rewrite the tree of the current root in another block codec and publish it as the new root """
+    from plugins.ipfs.models import migrate_tree
+
+    if args.codec:
+        config['plugins']['ipfs']['block_codec'] = args.codec
+
+    root_store = get_root_store()
+    version, root_cid = root_store.get()
+    if not root_cid:
+        print("No root CID found")
+        return 1
+
+    root = migrate_tree(get_block_store(), root_cid)
+
+    if not publish(root_store, version, root.cid):
+        return 1
+    print(f"Migrated root: {root_cid} -> {root.cid}")
+
+
+def import_comments(args):
+    """ Import comments from a JSON array or NDJSON dump and publish the new root """
+    from plugins.ipfs.importer import BulkImporter, read_records
+
+    root_store = get_root_store()
+    version, root_cid = root_store.get()
+
+    importer = BulkImporter(get_block_store(), root_cid=None if args.new else root_cid, batch_size=args.batch_size)
+
+    f = sys.stdin if args.file == '-' else open(args.file)
+    with f:
+        root = importer.import_records(read_records(f))
+
+    if importer.imported == 0:
+        print(f"Nothing imported, skipped {importer.skipped} records")
+        return 1
+
+    if not publish(root_store, version, root.cid):
+        return 1
+    print(f"Imported {importer.imported} comments, skipped {importer.skipped} records, root: {root.cid}")
+
+
+def export_car(args):
+    """ Export all blocks of the current root, or of --root, to a CAR file """
+    from plugins.ipfs.car import export_car
+    from plugins.ipfs.models import RootNode
+
+    root_cid = args.root or get_root_store().get()[1]
+    if not root_cid:
+        print("No root CID found")
+        return 1
+
+    with open(args.file, 'wb') as f:
+        blocks = export_car(RootNode(get_block_store(), 'root', cid=root_cid, lazy=True), f, root_cid)
+
+    print(f"Exported {blocks} blocks of root: {root_cid} to: {args.file}")
+
+
+def import_car(args):
+    """ Copy the blocks of a CAR file into the block store and publish its root """
+    from plugins.ipfs.car import CarReader, import_car
+
+    reader = CarReader(args.file)
+    if len(reader.roots) != 1:
+        print(f"Expected one root in CAR file, found: {len(reader.roots)}")
+        return 1
+
+    blocks = import_car(reader, get_block_store())
+    reader.close()
+
+    root_store = get_root_store()
+    version, current = root_store.get()
+    if not publish(root_store, version, reader.roots[0]):
+        return 1
+    print(f"Imported {blocks} blocks, root: {current} -> {reader.roots[0]}")
+
+
+def bench(args):
+    """ Benchmark reads and writes on a generated tree in memory, results are written as JSON """
+    from plugins.ipfs.bench import Benchmark
+
+    benchmark = Benchmark(sites=args.sites, blogs=args.blogs, posts=args.posts, comments=args.comments,
+                          skew=args.skew, samples=args.samples, writers=args.writers, seed=args.seed)
+    results = json.dumps(benchmark.run(), indent=4)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(results)
+        print(f"Wrote results to: {args.output}")
+    else:
+        print(results)
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m plugins.ipfs')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    subparsers.add_parser('reindex', help=reindex.__doc__.strip())
+
+    parser_migrate = subparsers.add_parser('migrate', help=migrate.__doc__.strip())
+    parser_migrate.add_argument('--codec', choices=['dag-cbor', 'dag-json'], help="block codec, default: block_codec from config")
+
+    parser_import = subparsers.add_parser('import', help=import_comments.__doc__.strip())
+    parser_import.add_argument('file', help="dump with records like: {site_id, blog_id, post_id, name, author, datetime, reply_to, content}, - for stdin")
+    parser_import.add_argument('--new', action='store_true', help="start a new tree instead of adding to the current root")
+    parser_import.add_argument('--batch-size', type=int, default=1000, help="comments that are written concurrently, default: 1000")
+
+    parser_export_car = subparsers.add_parser('export-car', help=export_car.__doc__.strip())
+    parser_export_car.add_argument('file', help="CAR file to write")
+    parser_export_car.add_argument('--root', help="root CID to export, default: current root")
+
+    parser_import_car = subparsers.add_parser('import-car', help=import_car.__doc__.strip())
+    parser_import_car.add_argument('file', help="CAR file to read")
+
+    parser_bench = subparsers.add_parser('bench', help=bench.__doc__.strip())
+    parser_bench.add_argument('--sites', type=int, default=2)
+    parser_bench.add_argument('--blogs', type=int, default=2, help="blogs per site")
+    parser_bench.add_argument('--posts', type=int, default=50, help="posts per blog")
+    parser_bench.add_argument('--comments', type=int, default=10000, help="comments in total")
+    parser_bench.add_argument('--skew', type=float, default=1.0, help="zipf exponent of comments per post, 0 is uniform")
+    parser_bench.add_argument('--samples', type=int, default=200, help="reads and writes per benchmark")
+    parser_bench.add_argument('--writers', type=int, default=8, help="concurrent writers")
+    parser_bench.add_argument('--seed', type=int, default=0)
+    parser_bench.add_argument('--output', help="JSON file to write, default: stdout")
+
+    args = parser.parse_args()
+    commands = {'reindex'    : reindex,
+                'migrate'    : migrate,
+                'import'     : import_comments,
+                'export-car' : export_car,
+                'import-car' : import_car,
+                'bench'      : bench}
+    return commands[args.command](args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+
+""" Benchmarks of the read and write paths on a generated tree in a local block store """
+
+import datetime
+import logging
+import platform
+import random
+import statistics
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from plugins.ipfs.blockstore import MemoryBlockStore
+from plugins.ipfs.cache import get_block_cache
+from plugins.ipfs.commit import CommitQueue
+from plugins.ipfs.importer import BulkImporter
+from plugins.ipfs.models import load_tree
+from plugins.ipfs.roots import RootStore
+
+logger = logging.getLogger('app')
+
+
+def zipf_weights(n, skew):
+    """ Weight of rank 1..n, skew 0 is uniform, higher skew makes the first ranks hotter """
+    return [1 / (rank ** skew) for rank in range(1, n + 1)]
+
+def post_ids(sites, blogs, posts):
+    return [(f"site_{s}", f"blog_{b}", f"post_{p}") for s in range(sites) for b in range(blogs) for p in range(posts)]
+
+def generate_records(sites, blogs, posts, comments, skew=0.0, seed=0):
+    """ Yield comment records for a tree of sites x blogs x posts with comments comments in total.
+        Comments are spread over the posts with a Zipf distribution, so with skew > 0 a few posts are hot """
+    rnd = random.Random(seed)
+    ids = post_ids(sites, blogs, posts)
+    rnd.shuffle(ids)
+    weights = zipf_weights(len(ids), skew)
+
+    for i in range(comments):
+        site_id, blog_id, post_id = rnd.choices(ids, weights)[0]
+        yield {"site_id"  : site_id,
+               "blog_id"  : blog_id,
+               "post_id"  : post_id,
+               "name"     : f"comment_{i}",
+               "author"   : f"author_{rnd.randrange(1000)}",
+               "datetime" : str(datetime.datetime(2021, 1, 1) + datetime.timedelta(seconds=i)),
+               "reply_to" : None,
+               "content"  : "x" * rnd.randint(20, 500)}
+
+def percentiles(samples):
+    """ Summary of latencies in seconds """
+    samples = sorted(samples)
+    def pct(p):
+        return samples[min(len(samples) - 1, int(p * len(samples)))]
+    return {"count" : len(samples),
+            "mean"  : statistics.mean(samples),
+            "p50"   : pct(0.50),
+            "p95"   : pct(0.95),
+            "p99"   : pct(0.99),
+            "max"   : samples[-1]}
+
+
+class Measure():
+    """ Wall time and peak traced memory of a block of code.
+        Tracing memory slows Python down, throughput is measured without it """
+    def __init__(self, memory=True):
+        self._memory = memory
+        self.peak_bytes = None
+
+    def __enter__(self):
+        if self._memory:
+            tracemalloc.start()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.seconds = time.perf_counter() - self._start
+        if self._memory:
+            self.peak_bytes = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+    def result(self, **kwargs):
+        return {"seconds" : self.seconds, "peak_bytes" : self.peak_bytes, **kwargs}
+
+
+class Benchmark():
+    """ Build a tree in a MemoryBlockStore and time the read and write paths on it.
+        The block cache is cleared before every cold measurement """
+    def __init__(self, sites=2, blogs=2, posts=50, comments=10000, skew=1.0, samples=200, writers=8, seed=0):
+        self.params = dict(sites=sites, blogs=blogs, posts=posts, comments=comments, skew=skew,
+                           samples=samples, writers=writers, seed=seed)
+        self._store = MemoryBlockStore()
+        self._root_cid = None
+        self._rnd = random.Random(seed)
+
+    def sample_posts(self, n):
+        """ Posts to read, hot posts are picked as often as they are commented on """
+        p = self.params
+        ids = post_ids(p['sites'], p['blogs'], p['posts'])
+        random.Random(p['seed']).shuffle(ids)
+        return self._rnd.choices(ids, zipf_weights(len(ids), p['skew']), k=n)
+
+    def bench_generate(self):
+        p = self.params
+        get_block_cache().clear()
+        with Measure() as m:
+            importer = BulkImporter(self._store)
+            root = importer.import_records(generate_records(p['sites'], p['blogs'], p['posts'], p['comments'], p['skew'], p['seed']))
+        self._root_cid = root.cid
+        return m.result(blocks=len(self._store))
+
+    def bench_load_tree(self):
+        get_block_cache().clear()
+        with Measure() as m:
+            load_tree(self._store, self._root_cid)
+        return m.result()
+
+    def bench_get_comments(self, cold):
+        latencies = []
+        for site_id, blog_id, post_id in self.sample_posts(self.params['samples']):
+            if cold:
+                get_block_cache().clear()
+            start = time.perf_counter()
+            root = load_tree(self._store, self._root_cid, lazy=True)
+            [c.get_json() for c in root.get_comments(site_id, blog_id, post_id)]
+            latencies.append(time.perf_counter() - start)
+        return percentiles(latencies)
+
+    def bench_get_page(self, limit=50):
+        latencies = []
+        for site_id, blog_id, post_id in self.sample_posts(self.params['samples']):
+            get_block_cache().clear()
+            start = time.perf_counter()
+            root = load_tree(self._store, self._root_cid, lazy=True)
+            root.find_post(site_id, blog_id, post_id).get_page(limit)
+            latencies.append(time.perf_counter() - start)
+        return percentiles(latencies)
+
+    def bench_add_comment(self):
+        """ Comments submitted by concurrent writers through the group commit queue """
+        p = self.params
+        with tempfile.TemporaryDirectory() as tmp:
+            root_store = RootStore(Path(tmp) / 'roots.sqlite')
+            root_store.compare_and_swap(0, self._root_cid)
+            queue = CommitQueue(store=self._store, root_store=root_store)
+
+            def add(post):
+                data = {"name": "bench", "author": "bench", "datetime": "", "reply_to": None, "content": "bench"}
+                start = time.perf_counter()
+                queue.submit(*post, data).result()
+                return time.perf_counter() - start
+
+            posts = self.sample_posts(p['samples'])
+            try:
+                with Measure(memory=False) as m:
+                    with ThreadPoolExecutor(max_workers=p['writers']) as pool:
+                        latencies = list(pool.map(add, posts))
+            finally:
+                queue.close()
+
+            self._root_cid = root_store.get()[1]
+
+        return m.result(comments_per_second=len(posts) / m.seconds, latency=percentiles(latencies))
+
+    def run(self):
+        results = {}
+        for name, bench in [("generate",           self.bench_generate),
+                            ("load_tree",          self.bench_load_tree),
+                            ("get_comments_cold",  lambda: self.bench_get_comments(cold=True)),
+                            ("get_comments_warm",  lambda: self.bench_get_comments(cold=False)),
+                            ("get_page_cold",      self.bench_get_page),
+                            ("add_comment",        self.bench_add_comment)]:
+            logger.info(f"Running benchmark: {name}")
+            results[name] = bench()
+
+        return {"params"    : self.params,
+                "python"    : platform.python_version(),
+                "date"      : str(datetime.datetime.utcnow()),
+                "root_cid"  : self._root_cid,
+                "results"   : results}
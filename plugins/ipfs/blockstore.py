@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+
+import io
+import logging
+import os
+import base64
+import tempfile
+import threading
+from pathlib import Path
+
+from core import config
+
+from plugins.ipfs import codec
+
+logger = logging.getLogger('app')
+
+# input encoding flag of dag put for every block codec
+INPUT_ENC = {'dag-cbor' : 'cbor',
+             'dag-json' : 'json'}
+
+# format flag of block put for the codecs the daemon can't take as dag, dag-pb gets a CIDv0 like ipfs add
+BLOCK_FORMAT = {'dag-pb' : 'v0',
+                'raw'    : 'raw'}
+
+
+class BlockStoreException(Exception): pass
+class BlockNotFoundError(BlockStoreException): pass
+class ReadOnlyError(BlockStoreException): pass
+
+
+class BlockStore():
+    """ Storage of encoded blocks by CID, the nodes do all their I/O through a block store.
+        Stores that compute CIDs themselves use CIDv1 with sha2-256, the same CIDs the daemon gives. """
+    # only stores that can resolve a path in one call set this, the others are walked
+    can_resolve = False
+
+    def get(self, cid):
+        """ Return encoded block, raise BlockNotFoundError when it isn't in the store """
+        raise NotImplementedError
+
+    def put(self, data, codec_name):
+        """ Store encoded block, codec_name is one of codec.BLOCK_CODECS. Returns CID """
+        raise NotImplementedError
+
+    def has(self, cid):
+        """ Return True when the block is in the store, never looks for it anywhere else """
+        raise NotImplementedError
+
+    def get_many(self, cids):
+        """ Return encoded blocks in the order of cids """
+        return [self.get(cid) for cid in cids]
+
+    def put_many(self, blocks):
+        """ Store (data, codec_name) pairs, return their CIDs """
+        return [self.put(data, codec_name) for data, codec_name in blocks]
+
+    def resolve(self, path):
+        """ Return CID of the node at a path like: <cid>/key/key """
+        raise BlockStoreException(f"{type(self).__name__} can't resolve paths")
+
+    def get_decoded(self, cid):
+        """ Return a block in a codec that can't be decoded locally, as json """
+        raise BlockStoreException(f"{type(self).__name__} can't decode: {cid}")
+
+    def close(self):
+        pass
+
+
+class HttpBlockStore(BlockStore):
+    """ Blocks in the IPFS daemon, every call borrows a client from the pool.
+        ipfshttpclient is only imported here, the other stores work without it """
+    can_resolve = True
+
+    def __init__(self, pool, local_timeout=2):
+        import ipfshttpclient
+        self._errors = ipfshttpclient.exceptions
+        self._pool = pool
+        self._local_timeout = local_timeout
+
+    def get(self, cid):
+        with self._pool.client() as client:
+            try:
+                return client.block.get(cid)
+            except self._errors.ErrorResponse as e:
+                raise BlockNotFoundError(f"Failed to get block: {cid}, {e}")
+
+    def put(self, data, codec_name):
+        with self._pool.client() as client:
+            if codec_name in BLOCK_FORMAT:
+                return client.block.put(io.BytesIO(data), opts={'format': BLOCK_FORMAT[codec_name]})['Key']
+            res = client.dag.put(io.BytesIO(data), format=codec_name, input_enc=INPUT_ENC[codec_name])
+        return res['Cid']['/']
+
+    def has(self, cid):
+        """ Only the daemon's own blocks count, offline mode keeps it from searching the network """
+        with self._pool.client() as client:
+            try:
+                client.block.stat(cid, offline=True, timeout=self._local_timeout)
+            except (self._errors.ErrorResponse, self._errors.TimeoutError):
+                return False
+        return True
+
+    def resolve(self, path):
+        with self._pool.client() as client:
+            try:
+                res = client.dag.resolve(path)
+            except self._errors.ErrorResponse as e:
+                raise BlockStoreException(f"Failed to resolve: {path}, {e}")
+
+        if res.get('RemPath'):
+            raise BlockNotFoundError(f"Failed to resolve: {path}, remaining path: {res['RemPath']}")
+        return res['Cid']['/']
+
+    def get_decoded(self, cid):
+        with self._pool.client() as client:
+            try:
+                return client.dag.get(cid).as_json()
+            except self._errors.ErrorResponse as e:
+                raise BlockNotFoundError(f"Failed to get block: {cid}, {e}")
+
+
+class MemoryBlockStore(BlockStore):
+    """ Blocks in a dict, for tests, benchmarks and throwaway trees.
+        Blocks are keyed by CIDv1, so a dag-pb block is found by its CIDv0 too """
+    def __init__(self):
+        self._blocks = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._blocks)
+
+    def get(self, cid):
+        try:
+            return self._blocks[codec.cid_v1(cid)]
+        except KeyError:
+            raise BlockNotFoundError(f"Failed to get block: {cid}")
+
+    def put(self, data, codec_name):
+        cid = codec.make_cid(data, codec.BLOCK_CODECS[codec_name])
+        with self._lock:
+            self._blocks[cid] = bytes(data)
+        return cid
+
+    def has(self, cid):
+        return codec.cid_v1(cid) in self._blocks
+
+
+class FlatFSBlockStore(BlockStore):
+    """ Blocks as files in a directory, in the flatfs layout of the daemon (next-to-last/2):
+            <path>/<2 chars>/<base32 multihash>.data
+        where the 2 chars are the next-to-last two characters of the key """
+    def __init__(self, path):
+        self._path = Path(path)
+        self._path.mkdir(parents=True, exist_ok=True)
+
+    def block_path(self, cid):
+        key = base64.b32encode(codec.cid_digest(cid)).decode().rstrip('=')
+        return self._path / key[-3:-1] / f"{key}.data"
+
+    def get(self, cid):
+        try:
+            return self.block_path(cid).read_bytes()
+        except FileNotFoundError:
+            raise BlockNotFoundError(f"Failed to get block: {cid}")
+
+    def put(self, data, codec_name):
+        cid = codec.make_cid(data, codec.BLOCK_CODECS[codec_name])
+        path = self.block_path(cid)
+        if path.exists():
+            return cid
+
+        # write to a temporary file first so a reader never sees half a block
+        path.parent.mkdir(exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+        return cid
+
+    def has(self, cid):
+        return self.block_path(cid).exists()
+
+
+class OverlayBlockStore(BlockStore):
+    """ Read from a read-only store first, eg: a CAR file, everything else goes to store """
+    def __init__(self, overlay, store):
+        self._overlay = overlay
+        self._store = store
+
+    @property
+    def can_resolve(self):
+        return self._store.can_resolve
+
+    def get(self, cid):
+        try:
+            return self._overlay.get(cid)
+        except BlockNotFoundError:
+            return self._store.get(cid)
+
+    def put(self, data, codec_name):
+        return self._store.put(data, codec_name)
+
+    def has(self, cid):
+        return self._overlay.has(cid) or self._store.has(cid)
+
+    def resolve(self, path):
+        return self._store.resolve(path)
+
+    def get_decoded(self, cid):
+        return self._store.get_decoded(cid)
+
+
+_block_store = None
+_block_store_lock = threading.Lock()
+
+def get_block_store():
+    """ Return the process wide block store, create it on first use.
+        config: blockstore is one of: http, memory, flatfs """
+    global _block_store
+    with _block_store_lock:
+        if _block_store == None:
+            cfg = config['plugins']['ipfs']
+            kind = cfg.get('blockstore', 'http')
+
+            if kind == 'http':
+                from plugins.ipfs.pool import get_client_pool
+                store = HttpBlockStore(get_client_pool(), float(cfg.get('local_timeout', 2)))
+            elif kind == 'memory':
+                store = MemoryBlockStore()
+            elif kind == 'flatfs':
+                store = FlatFSBlockStore(cfg.get('blockstore_path') or Path(config['sqlite']['path']).parent / 'blocks')
+            else:
+                raise BlockStoreException(f"Unknown blockstore: {kind}, choose from: http, memory, flatfs")
+
+            # car.py depends on this module
+            from plugins.ipfs.car import get_car_reader
+            if (car := get_car_reader()) != None:
+                store = OverlayBlockStore(car, store)
+
+            _block_store = store
+            logger.info(f"Created block store: {type(store).__name__}")
+    return _block_store
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+
+import json
+import logging
+import threading
+from collections import OrderedDict
+
+from core import config
+
+logger = logging.getLogger('app')
+
+
+class BlockCache():
+    """ In-process LRU cache that maps a CID to its decoded block.
+        A CID names content that never changes so entries never go stale,
+        they are only evicted when the byte budget is exceeded. """
+    def __init__(self, max_bytes):
+        self._max_bytes = max_bytes
+        self._blocks = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._blocks)
+
+    def __contains__(self, cid):
+        return cid in self._blocks
+
+    @property
+    def size(self):
+        return self._size
+
+    def get(self, cid):
+        """ Return cached block or None, a hit moves the entry to the front """
+        with self._lock:
+            try:
+                block, size = self._blocks[cid]
+            except KeyError:
+                self.misses += 1
+                return
+            self._blocks.move_to_end(cid)
+            self.hits += 1
+            return block
+
+    def put(self, cid, block, size=None):
+        """ Add block to cache, evict least recently used blocks when over budget """
+        if size == None:
+            size = len(json.dumps(block))
+
+        # don't let one huge block flush the whole cache
+        if size > self._max_bytes:
+            return
+
+        with self._lock:
+            if cid in self._blocks:
+                self._blocks.move_to_end(cid)
+                return
+
+            self._blocks[cid] = (block, size)
+            self._size += size
+
+            while self._size > self._max_bytes:
+                _, (_, evicted_size) = self._blocks.popitem(last=False)
+                self._size -= evicted_size
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._blocks.clear()
+            self._size = 0
+
+    def stats(self):
+        return {"hits"      : self.hits,
+                "misses"    : self.misses,
+                "evictions" : self.evictions,
+                "blocks"    : len(self._blocks),
+                "bytes"     : self._size,
+                "max_bytes" : self._max_bytes}
+
+
+_block_cache = None
+_block_cache_lock = threading.Lock()
+
+def get_block_cache():
+    """ Return the process wide block cache, create it on first use """
+    global _block_cache
+    with _block_cache_lock:
+        if _block_cache == None:
+            max_bytes = config['plugins']['ipfs'].get('cache_size', 64 * 1024 * 1024)
+            _block_cache = BlockCache(int(max_bytes))
+            logger.info(f"Created block cache, max_bytes={max_bytes}")
+    return _block_cache
+
+
+_response_cache = None
+_response_cache_lock = threading.Lock()
+
+def get_response_cache():
+    """ Return the process wide cache for results that are addressed by CID, eg: the comments of a post """
+    global _response_cache
+    with _response_cache_lock:
+        if _response_cache == None:
+            max_bytes = config['plugins']['ipfs'].get('response_cache_size', 16 * 1024 * 1024)
+            _response_cache = BlockCache(int(max_bytes))
+            logger.info(f"Created response cache, max_bytes={max_bytes}")
+    return _response_cache
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+
+import logging
+import mmap
+import threading
+
+from core import config
+
+from plugins.ipfs import codec
+from plugins.ipfs.blockstore import BlockStore, BlockNotFoundError, ReadOnlyError
+
+logger = logging.getLogger('app')
+
+
+class CarException(Exception): pass
+
+
+def read_cid(data, offset):
+    """ Read a binary CID from data at offset, returns (cid, offset after the CID) """
+    start = offset
+    if data[offset] == codec.SHA2_256 and data[offset+1] == 32:
+        # CIDv0 is a bare sha2-256 multihash
+        offset += 34
+    else:
+        version, offset = codec.varint_decode(data, offset)
+        block_codec, offset = codec.varint_decode(data, offset)
+        hash_code, offset = codec.varint_decode(data, offset)
+        length, offset = codec.varint_decode(data, offset)
+        offset += length
+    return codec.cid_from_bytes(bytes(data[start:offset])), offset
+
+
+class CarWriter():
+    """ Write blocks to a CARv1 file:
+            varint(len(header)) | header: dag-cbor {"roots": [links], "version": 1}
+        followed by a section for every block:
+            varint(len(cid) + len(block)) | binary cid | block """
+    def __init__(self, f, roots):
+        self._f = f
+        header = codec.encode({"roots": [{'/': cid} for cid in roots], "version": 1})
+        self._f.write(codec.varint_encode(len(header)) + header)
+        self.blocks = 0
+
+    def write_block(self, cid, data):
+        cid_bytes = codec.cid_to_bytes(cid)
+        self._f.write(codec.varint_encode(len(cid_bytes) + len(data)) + cid_bytes + data)
+        self.blocks += 1
+
+
+class CarReader(BlockStore):
+    """ Read-only block store on the blocks of a CARv1 file.
+        The file is memory mapped and one pass over the sections builds an index of
+        CID -> (offset, length), after that a block is a slice of the map """
+    def __init__(self, path):
+        self._path = str(path)
+        with open(self._path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._index = {}
+
+        header_length, offset = codec.varint_decode(self._map, 0)
+        header = codec.decode(self._map[offset:offset+header_length])
+        if header.get('version') != 1:
+            raise CarException(f"Unsupported CAR version: {header.get('version')}")
+        self.roots = [link['/'] for link in header['roots']]
+        offset += header_length
+
+        while offset < len(self._map):
+            length, offset = codec.varint_decode(self._map, offset)
+            cid, data_offset = read_cid(self._map, offset)
+            self._index[cid] = (data_offset, length - (data_offset - offset))
+            offset += length
+
+        logger.info(f"Opened CAR file: {self._path}, {len(self._index)} blocks")
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, cid):
+        return cid in self._index
+
+    def cids(self):
+        return list(self._index.keys())
+
+    def get(self, cid):
+        if (entry := self._index.get(cid)) == None:
+            raise BlockNotFoundError(f"Block not in CAR file: {cid}")
+        offset, length = entry
+        return self._map[offset:offset+length]
+
+    def put(self, data, codec_name):
+        raise ReadOnlyError(f"CAR file is read-only: {self._path}")
+
+    def has(self, cid):
+        return cid in self._index
+
+    def close(self):
+        self._map.close()
+
+
+def export_car(node, f, root_cid):
+    """ Write every block that is reachable from root_cid to f as a CAR file.
+        node does the block I/O, blocks are fetched level by level and concurrently within a level.
+        Links of dag-pb blocks are followed too, eg: a file added to the daemon, raw blocks have none.
+        Returns the number of blocks written """
+    writer = CarWriter(f, [root_cid])
+    seen = {root_cid}
+    level = [root_cid]
+
+    while level:
+        next_level = []
+        for cid, data in zip(level, node.get_raw_blocks(level)):
+            writer.write_block(cid, data)
+            for link in codec.block_links(data, codec.cid_codec(cid)):
+                if link not in seen:
+                    seen.add(link)
+                    next_level.append(link)
+        level = next_level
+
+    return writer.blocks
+
+
+def import_car(reader, store, batch_size=100):
+    """ Copy all blocks of a CAR file into store, returns the number of blocks """
+    names = {v: k for k,v in codec.BLOCK_CODECS.items()}
+    cids = reader.cids()
+
+    for i in range(0, len(cids), batch_size):
+        batch = cids[i:i+batch_size]
+        blocks = []
+        for cid in batch:
+            if (codec_name := names.get(codec.cid_codec(cid))) == None:
+                raise CarException(f"Unsupported codec in CAR file: {cid}")
+            blocks.append((reader.get(cid), codec_name))
+
+        for expected, cid in zip(batch, store.put_many(blocks)):
+            # a store can give the CIDv1 of a dag-pb block that has a CIDv0 in the file
+            if codec.cid_v1(cid) != codec.cid_v1(expected):
+                raise CarException(f"Block changed CID on import: {expected} -> {cid}")
+
+    return len(cids)
+
+
+_car_reader = None
+_car_reader_lock = threading.Lock()
+
+def get_car_reader():
+    """ Return the CAR file that is used as read-only block source, or None when car_path isn't configured """
+    global _car_reader
+    with _car_reader_lock:
+        if _car_reader == None and (path := config['plugins']['ipfs'].get('car_path')):
+            _car_reader = CarReader(path)
+    return _car_reader
@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+
+""" Encoding of IPLD blocks and CIDs, so blocks can be encoded, decoded and addressed
+    without a round trip through the daemon. Supports the subset of dag-cbor and dag-json
+    that the tree uses: maps, lists, strings, integers, floats, booleans, null and links. """
+
+import base64
+import hashlib
+import json
+import math
+import struct
+
+DAG_PB = 0x70
+DAG_CBOR = 0x71
+DAG_JSON = 0x0129
+RAW = 0x55
+
+# codecs the tree is encoded in
+CODECS = {'dag-cbor' : DAG_CBOR,
+          'dag-json' : DAG_JSON}
+
+# codecs a block store can hold, dag-pb and raw blocks are stored and linked but never decoded
+BLOCK_CODECS = dict(CODECS, **{'dag-pb' : DAG_PB,
+                               'raw'    : RAW})
+
+SHA2_256 = 0x12
+
+BASE58_ALPHABET = '123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz'
+
+
+class CodecError(Exception): pass
+
+
+def varint_encode(n):
+    out = bytearray()
+    while True:
+        byte = n & 0x7f
+        n >>= 7
+        if n:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+def varint_decode(data, offset=0):
+    """ Returns (value, offset after the varint) """
+    n = 0
+    shift = 0
+    while True:
+        if offset >= len(data):
+            raise CodecError("Truncated varint")
+        byte = data[offset]
+        offset += 1
+        n |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return n, offset
+        shift += 7
+
+def base58_encode(data):
+    n = int.from_bytes(data, 'big')
+    out = ''
+    while n:
+        n, r = divmod(n, 58)
+        out = BASE58_ALPHABET[r] + out
+    return '1' * (len(data) - len(data.lstrip(b'\0'))) + out
+
+def base58_decode(s):
+    n = 0
+    for c in s:
+        n = n * 58 + BASE58_ALPHABET.index(c)
+    body = n.to_bytes((n.bit_length() + 7) // 8, 'big')
+    return b'\0' * (len(s) - len(s.lstrip('1'))) + body
+
+
+def cid_to_bytes(cid):
+    """ Binary form of a CID string, CIDv0 (Qm...), base32 CIDv1 (b...) or base58 CIDv1 (z...) """
+    if cid.startswith('Qm'):
+        return base58_decode(cid)
+    if cid.startswith('z'):
+        return base58_decode(cid[1:])
+    if cid.startswith('b'):
+        s = cid[1:].upper()
+        return base64.b32decode(s + '=' * (-len(s) % 8))
+    raise CodecError(f"Unsupported CID encoding: {cid}")
+
+def cid_from_bytes(data):
+    """ String form of a binary CID, CIDv1 is encoded as base32 like the daemon does """
+    if data[:2] == bytes([SHA2_256, 32]) and len(data) == 34:
+        return base58_encode(data)
+    return 'b' + base64.b32encode(data).decode().lower().rstrip('=')
+
+def cid_v1(cid):
+    """ Base32 CIDv1 of a CID string, a CIDv0 is the dag-pb CIDv1 of the same multihash """
+    if cid.startswith('b'):
+        return cid
+    data = cid_to_bytes(cid)
+    if data[:2] == bytes([SHA2_256, 32]) and len(data) == 34:
+        data = varint_encode(1) + varint_encode(DAG_PB) + data
+    return cid_from_bytes(data)
+
+def cid_codec(cid):
+    """ Return the multicodec of a CID string """
+    data = cid_to_bytes(cid)
+    if data[:2] == bytes([SHA2_256, 32]) and len(data) == 34:
+        return DAG_PB
+    version, offset = varint_decode(data)
+    codec, offset = varint_decode(data, offset)
+    return codec
+
+def cid_digest(cid):
+    """ Return the multihash of a CID string """
+    data = cid_to_bytes(cid)
+    if data[:2] == bytes([SHA2_256, 32]) and len(data) == 34:
+        return data
+    version, offset = varint_decode(data)
+    codec, offset = varint_decode(data, offset)
+    return data[offset:]
+
+def make_cid(data, codec):
+    """ CIDv1 with sha2-256, identical to the CID the daemon gives the same block """
+    digest = hashlib.sha256(data).digest()
+    return cid_from_bytes(varint_encode(1) + varint_encode(codec) + bytes([SHA2_256, len(digest)]) + digest)
+
+
+def is_link(value):
+    return type(value) == dict and len(value) == 1 and '/' in value and type(value['/']) == str
+
+
+def _cbor_head(major, n):
+    if n < 24:
+        return bytes([major << 5 | n])
+    if n < 0x100:
+        return bytes([major << 5 | 24, n])
+    if n < 0x10000:
+        return bytes([major << 5 | 25]) + struct.pack('>H', n)
+    if n < 0x100000000:
+        return bytes([major << 5 | 26]) + struct.pack('>I', n)
+    return bytes([major << 5 | 27]) + struct.pack('>Q', n)
+
+def _cbor_encode(obj, out):
+    if obj is None:
+        out.append(0xf6)
+    elif obj is True:
+        out.append(0xf5)
+    elif obj is False:
+        out.append(0xf4)
+    elif type(obj) == int:
+        out += _cbor_head(0, obj) if obj >= 0 else _cbor_head(1, -1 - obj)
+    elif type(obj) == float:
+        if not math.isfinite(obj):
+            raise ValueError(f"dag-cbor doesn't allow NaN or infinity: {obj}")
+        out += b'\xfb' + struct.pack('>d', obj)
+    elif type(obj) == str:
+        data = obj.encode()
+        out += _cbor_head(3, len(data)) + data
+    elif type(obj) == bytes:
+        out += _cbor_head(2, len(obj)) + obj
+    elif type(obj) in (list, tuple):
+        out += _cbor_head(4, len(obj))
+        for item in obj:
+            _cbor_encode(item, out)
+    elif is_link(obj):
+        data = b'\0' + cid_to_bytes(obj['/'])
+        out += _cbor_head(6, 42) + _cbor_head(2, len(data)) + data
+    elif type(obj) == dict:
+        if not all(type(k) == str for k in obj.keys()):
+            raise CodecError(f"Map keys must be strings: {list(obj.keys())}")
+        # dag-cbor sorts map keys by length first, then bytewise
+        keys = sorted((k.encode() for k in obj.keys()), key=lambda k: (len(k), k))
+        out += _cbor_head(5, len(keys))
+        for key in keys:
+            out += _cbor_head(3, len(key)) + key
+            _cbor_encode(obj[key.decode()], out)
+    else:
+        raise CodecError(f"Can't encode type: {type(obj)}")
+
+def _cbor_decode(data, offset):
+    """ Returns (object, offset after the object) """
+    initial = data[offset]
+    major, info = initial >> 5, initial & 0x1f
+    offset += 1
+
+    if major == 7:
+        if info == 20: return False, offset
+        if info == 21: return True, offset
+        if info == 22: return None, offset
+        if info == 25: return _half_float(data[offset:offset+2]), offset + 2
+        if info == 26: return struct.unpack('>f', data[offset:offset+4])[0], offset + 4
+        if info == 27: return struct.unpack('>d', data[offset:offset+8])[0], offset + 8
+        raise CodecError(f"Unsupported simple value: {info}")
+
+    if info < 24:
+        n = info
+    elif info < 28:
+        size = 1 << (info - 24)
+        n = int.from_bytes(data[offset:offset+size], 'big')
+        offset += size
+    else:
+        raise CodecError("Indefinite length items are not allowed in dag-cbor")
+
+    if major == 0:
+        return n, offset
+    if major == 1:
+        return -1 - n, offset
+    if major == 2:
+        return bytes(data[offset:offset+n]), offset + n
+    if major == 3:
+        return bytes(data[offset:offset+n]).decode(), offset + n
+    if major == 4:
+        items = []
+        for i in range(n):
+            item, offset = _cbor_decode(data, offset)
+            items.append(item)
+        return items, offset
+    if major == 5:
+        obj = {}
+        for i in range(n):
+            key, offset = _cbor_decode(data, offset)
+            obj[key], offset = _cbor_decode(data, offset)
+        return obj, offset
+    if major == 6:
+        value, offset = _cbor_decode(data, offset)
+        if n != 42:
+            raise CodecError(f"Unsupported tag: {n}")
+        return {'/': cid_from_bytes(value[1:])}, offset
+
+def _half_float(data):
+    half = int.from_bytes(data, 'big')
+    exp, mant = (half >> 10) & 0x1f, half & 0x3ff
+    if exp == 0:
+        value = mant * 2 ** -24
+    elif exp == 31:
+        value = float('inf') if mant == 0 else float('nan')
+    else:
+        value = (mant + 1024) * 2 ** (exp - 25)
+    return -value if half & 0x8000 else value
+
+
+def encode(obj, codec=DAG_CBOR):
+    """ Encode object as block, links are dicts like: {'/': cid} """
+    if codec == DAG_CBOR:
+        out = bytearray()
+        _cbor_encode(obj, out)
+        return bytes(out)
+    if codec == DAG_JSON:
+        # allow_nan=False raises ValueError on NaN and infinity, like dag-cbor
+        return json.dumps(obj, sort_keys=True, separators=(',', ':'), ensure_ascii=False, allow_nan=False).encode()
+    raise CodecError(f"Unsupported codec: {codec}")
+
+def decode(data, codec=DAG_CBOR):
+    """ Decode block, links are returned as: {'/': cid} """
+    if codec == DAG_CBOR:
+        obj, offset = _cbor_decode(data, 0)
+        if offset != len(data):
+            raise CodecError("Trailing data after dag-cbor object")
+        return obj
+    if codec == DAG_JSON:
+        return json.loads(data)
+    raise CodecError(f"Unsupported codec: {codec}")
+
+def links(obj):
+    """ Return the CIDs of all links in a decoded block """
+    found = []
+    stack = [obj]
+    while stack:
+        value = stack.pop()
+        if is_link(value):
+            found.append(value['/'])
+        elif type(value) == dict:
+            stack += value.values()
+        elif type(value) == list:
+            stack += value
+    return found
+
+
+def _pb_fields(data):
+    """ Yield (field number, value) of a protobuf message, only varint and length delimited fields """
+    offset = 0
+    while offset < len(data):
+        key, offset = varint_decode(data, offset)
+        field, wire_type = key >> 3, key & 0x7
+        if wire_type == 0:
+            value, offset = varint_decode(data, offset)
+        elif wire_type == 2:
+            length, offset = varint_decode(data, offset)
+            if offset + length > len(data):
+                raise CodecError("Truncated dag-pb field")
+            value = bytes(data[offset:offset+length])
+            offset += length
+        else:
+            raise CodecError(f"Unsupported protobuf wire type in dag-pb block: {wire_type}")
+        yield field, value
+
+def dag_pb_links(data):
+    """ Return the CIDs a dag-pb block links to, eg: a UnixFS file or directory.
+            PBNode {Links = 2, Data = 1}, PBLink {Hash = 1, Name = 2, Tsize = 3}
+        Only the links are read, dag-pb blocks can't be decoded or encoded """
+    found = []
+    for field, value in _pb_fields(data):
+        if field == 2 and type(value) == bytes:
+            found += [cid_from_bytes(h) for f, h in _pb_fields(value) if f == 1 and type(h) == bytes]
+    return found
+
+def block_links(data, codec):
+    """ Return the CIDs an encoded block links to, raw blocks have no links """
+    if codec == RAW:
+        return []
+    if codec == DAG_PB:
+        return dag_pb_links(data)
+    return links(decode(data, codec))
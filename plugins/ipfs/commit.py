@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+
+import contextvars
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future, wait
+
+from core import config
+from core import metrics
+
+from plugins.ipfs.models import load_tree, write_branches, submit
+from plugins.ipfs.models import CommentNode
+from plugins.ipfs.codec import CodecError
+from plugins.ipfs.blockstore import get_block_store
+from plugins.ipfs.roots import get_root_store, RootStoreConflictError
+
+logger = logging.getLogger('app')
+
+
+class PendingComment():
+    """ A comment that waits in the queue for the next commit.
+        The work for the comment runs in the context of the request that submitted it,
+        so its I/O is counted for that request """
+    def __init__(self, site_id, blog_id, post_id, data):
+        self.site_id = site_id
+        self.blog_id = blog_id
+        self.post_id = post_id
+        self.data = data
+        self.comment = None
+        self.future = Future()
+        self.context = contextvars.copy_context()
+        self.io = metrics.get_request_io()
+
+
+class CommitQueue():
+    """ Group commit for comments.
+        Comments that arrive within window seconds of the first one, or until batch_size
+        is reached, are added to the tree together. Every changed node is written once
+        and the new root CID is published once per batch.
+        When another writer published a root in the meantime the batch is applied
+        again on top of that root.
+        The block store and root store default to the process wide ones.
+        close() commits what is queued and stops the commit thread """
+    def __init__(self, window=0.05, batch_size=100, retries=5, store=None, root_store=None):
+        self._store = store
+        self._root_store = root_store
+        self._window = window
+        self._batch_size = batch_size
+        self._retries = retries
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._closed = False
+        self._stopping = False
+
+    def submit(self, site_id, blog_id, post_id, data):
+        """ Queue a comment, returns a future that resolves to the written CommentNode """
+        pending = PendingComment(site_id, blog_id, post_id, data)
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Commit queue is closed")
+            self._ensure_thread()
+            self._queue.put(pending)
+        return pending.future
+
+    def close(self, timeout=None):
+        """ Stop accepting comments, wait until the queued ones are committed and the thread exits """
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            thread = self._thread
+            # sentinel, the thread stops after the batch it ends up in
+            self._queue.put(None)
+        if thread != None:
+            thread.join(timeout)
+
+    def _ensure_thread(self):
+        # called with the lock held
+        if self._thread == None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='ipfs-commit', daemon=True)
+            self._thread.start()
+
+    def _get(self, timeout=None):
+        pending = self._queue.get(timeout=timeout)
+        if pending == None:
+            self._stopping = True
+        return pending
+
+    def _next_batch(self):
+        """ Block until a comment arrives, then collect more until the window closes """
+        first = self._get()
+        if first == None:
+            return []
+        batch = [first]
+        deadline = time.monotonic() + self._window
+
+        while len(batch) < self._batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                pending = self._get(timeout=timeout)
+            except queue.Empty:
+                break
+            if pending == None:
+                break
+            batch.append(pending)
+        return batch
+
+    def _run(self):
+        while not self._stopping:
+            batch = self._next_batch()
+            if not batch:
+                continue
+            try:
+                for attempt in range(self._retries):
+                    try:
+                        self.commit(batch)
+                        break
+                    except RootStoreConflictError as e:
+                        logger.info(f"Root changed while committing, retrying: {e}")
+                else:
+                    raise RootStoreConflictError(f"Failed to commit after {self._retries} attempts")
+            except Exception as e:
+                logger.error(f"Failed to commit batch of {len(batch)} comments: {e}")
+                for pending in batch:
+                    if not pending.future.done():
+                        pending.future.set_exception(e)
+
+    def find_post(self, root, pending):
+        return root.get_site(pending.site_id).get_blog(pending.blog_id).get_post(pending.post_id)
+
+    def commit(self, batch):
+        """ Add all comments in batch to the tree and publish the new root """
+        root_store = self._root_store or get_root_store()
+        version, root_cid = root_store.get()
+
+        store = self._store or get_block_store()
+        root = load_tree(store, root_cid, lazy=True)
+
+        # find posts first, a comment for a post that doesn't exist only fails its own request
+        accepted = []
+        for pending in batch:
+            # failed in an earlier attempt
+            if pending.future.done():
+                continue
+            try:
+                post = pending.context.run(self.find_post, root, pending)
+                if type(pending.data.get('name')) != str:
+                    raise CodecError("Comment name must be a string, it is the link key in the post")
+                pending.comment = CommentNode(store, **pending.data, parent=post)
+                # a comment that can't be encoded fails its own request, not the batch
+                pending.comment.encode()
+            except Exception as e:
+                pending.future.set_exception(e)
+                continue
+            accepted.append(pending)
+
+        if not accepted:
+            return
+
+        # comment blocks don't depend on each other
+        futures = [submit(p.comment.write, context=p.context) for p in accepted]
+        wait(futures)
+        for f in futures:
+            f.result()
+
+        posts = []
+        for pending in accepted:
+            post = pending.comment._parent
+            post.add_link("comments", pending.comment)
+            posts.append(post)
+
+        # the branches are shared by the batch, every request waited for all of their I/O
+        route = next((p.io.route for p in accepted if p.io != None), 'none')
+        batch_io = metrics.start_request(route)
+        try:
+            write_branches(posts)
+        finally:
+            metrics.end_request()
+        for pending in accepted:
+            if pending.io != None:
+                pending.io.merge(batch_io)
+
+        root_store.compare_and_swap(version, root.cid)
+        logger.debug(f">>>> Root CID: {root.cid}, committed {len(accepted)} comments")
+
+        for pending in accepted:
+            pending.future.set_result(pending.comment)
+
+
+_commit_queue = None
+_commit_queue_lock = threading.Lock()
+
+def get_commit_queue():
+    """ Return the process wide commit queue, create it on first use """
+    global _commit_queue
+    with _commit_queue_lock:
+        if _commit_queue == None:
+            cfg = config['plugins']['ipfs']
+            _commit_queue = CommitQueue(window=float(cfg.get('commit_window', 0.05)),
+                                        batch_size=int(cfg.get('commit_batch_size', 100)))
+    return _commit_queue
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+
+import hashlib
+import logging
+
+from core import config
+from plugins.ipfs.codec import is_link
+
+logger = logging.getLogger('app')
+
+# every level of the HAMT consumes one byte of the hashed name
+MAX_DEPTH = 32
+
+
+def bucket_key(name, depth):
+    """ Return the bucket that name falls in at depth of the HAMT """
+    return hashlib.sha256(name.encode()).hexdigest()[2*depth:2*depth+2]
+
+
+class LinkMap():
+    """ Name keyed map of child links as it is stored in a node.
+
+        Small maps are stored inline as: {name: {'/': cid}}, so the daemon can resolve
+        a path like: <root>/sites/<site>/blogs/<blog>/posts/<post> in one call.
+
+        When a map grows beyond the shard threshold it is stored as a link to a HAMT,
+        in the same spirit as UnixFS sharded directories:
+            shard block: {"depth": d, "buckets": {"<2 hex chars>": {'/': cid}}}
+            leaf block:  {"entries": {name: {'/': cid}}}
+        The bucket of a name at depth d is byte d of sha256(name).
+
+        The legacy layout, a list of: {name: {'/': cid}, 'Name': name}, is still read
+        and is converted to the new layout on the next write. """
+    def __init__(self, node, value=None):
+        # node does the block I/O
+        self._node = node
+        self._threshold = int(config['plugins']['ipfs'].get('shard_threshold', 256))
+        self._shard_cid = None
+        self._flat = {}
+        self._pending = {}
+
+        if value == None:
+            pass
+        elif is_link(value):
+            self._shard_cid = value['/']
+        elif type(value) == list:
+            self._flat = {x['Name']: x[x['Name']]['/'] for x in value}
+        else:
+            self._flat = {k: v['/'] for k,v in value.items()}
+
+    @property
+    def sharded(self):
+        return self._shard_cid != None
+
+    def get(self, name):
+        """ Return CID of name or None, a sharded map only reads the blocks on the path to name """
+        if name in self._pending:
+            return self._pending[name]
+        if not self.sharded:
+            return self._flat.get(name)
+
+        cid = self._shard_cid
+        for depth in range(MAX_DEPTH):
+            link = self._node.get_dag(cid)['buckets'].get(bucket_key(name, depth))
+            if link == None:
+                return
+            block = self._node.get_dag(link['/'])
+            if 'buckets' in block:
+                cid = link['/']
+                continue
+            if (entry := block['entries'].get(name)) != None:
+                return entry['/']
+            return
+
+    def items(self):
+        """ Return all (name, cid) pairs sorted by name """
+        if self.sharded:
+            entries = self._read_shard(self._shard_cid)
+        else:
+            entries = dict(self._flat)
+        entries.update(self._pending)
+        return sorted(entries.items())
+
+    def set(self, name, cid):
+        """ Set the link for name, nothing is written until serialize() """
+        if self.get(name) != cid:
+            self._pending[name] = cid
+
+    def serialize(self):
+        """ Return the value as it should be stored in the parent node, write shard blocks if needed """
+        if self.sharded:
+            if self._pending:
+                self._shard_cid = self._update_shard(self._shard_cid, self._pending, 0)
+                self._pending = {}
+            return {'/': self._shard_cid}
+
+        self._flat.update(self._pending)
+        self._pending = {}
+
+        if len(self._flat) > self._threshold:
+            logger.debug(f"Sharding link map with {len(self._flat)} entries")
+            self._shard_cid = self._build_shard(self._flat, 0)
+            self._flat = {}
+            return {'/': self._shard_cid}
+
+        return {name: {'/': cid} for name, cid in sorted(self._flat.items())}
+
+    def _read_shard(self, cid):
+        """ Read all entries below shard, each level of buckets is fetched concurrently """
+        entries = {}
+        shards = [cid]
+        while shards:
+            links = [l['/'] for block in self._node.get_dags(shards) for l in block['buckets'].values()]
+            shards = []
+            for link, block in zip(links, self._node.get_dags(links)):
+                if 'buckets' in block:
+                    shards.append(link)
+                else:
+                    entries.update({k: v['/'] for k,v in block['entries'].items()})
+        return entries
+
+    def _write_bucket(self, entries, depth):
+        """ Write entries as a leaf, or as a deeper shard if they don't fit in one """
+        if len(entries) > self._threshold and depth < MAX_DEPTH:
+            return self._build_shard(entries, depth)
+        return self._node.put_dag({"entries": {k: {'/': v} for k,v in sorted(entries.items())}})
+
+    def _build_shard(self, entries, depth):
+        groups = {}
+        for name, cid in entries.items():
+            groups.setdefault(bucket_key(name, depth), {})[name] = cid
+
+        buckets = {k: {'/': self._write_bucket(v, depth+1)} for k,v in sorted(groups.items())}
+        return self._node.put_dag({"depth": depth, "buckets": buckets})
+
+    def _update_shard(self, cid, changes, depth):
+        """ Apply changes to shard, only the blocks on the path of a changed name are rewritten """
+        buckets = dict(self._node.get_dag(cid)['buckets'])
+
+        groups = {}
+        for name, child_cid in changes.items():
+            groups.setdefault(bucket_key(name, depth), {})[name] = child_cid
+
+        for key, group in groups.items():
+            if (link := buckets.get(key)) == None:
+                buckets[key] = {'/': self._write_bucket(group, depth+1)}
+                continue
+
+            block = self._node.get_dag(link['/'])
+            if 'buckets' in block:
+                buckets[key] = {'/': self._update_shard(link['/'], group, depth+1)}
+            else:
+                entries = {k: v['/'] for k,v in block['entries'].items()}
+                entries.update(group)
+                buckets[key] = {'/': self._write_bucket(entries, depth+1)}
+
+        return self._node.put_dag({"depth": depth, "buckets": dict(sorted(buckets.items()))})
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+
+import json
+import logging
+from concurrent.futures import wait
+
+from plugins.ipfs.models import RootNode, CommentNode
+from plugins.ipfs.models import load_tree, write_branches, get_executor
+
+logger = logging.getLogger('app')
+
+# fields of a comment record, besides site_id, blog_id and post_id
+COMMENT_FIELDS = ('name', 'author', 'datetime', 'reply_to', 'content')
+
+
+def read_records(f, chunk_size=64*1024):
+    """ Yield comment records from a text stream with a JSON array of records or with one record per line (NDJSON).
+        The stream is read in chunks, so the dump doesn't have to fit in memory """
+    buf = f.read(chunk_size).lstrip()
+
+    if not buf.startswith('['):
+        while True:
+            lines = buf.split('\n')
+            buf = lines.pop()
+            for line in lines:
+                if line.strip():
+                    yield json.loads(line)
+            if not (chunk := f.read(chunk_size)):
+                break
+            buf += chunk
+        if buf.strip():
+            yield json.loads(buf)
+        return
+
+    decoder = json.JSONDecoder()
+    pos = 1
+    while True:
+        while pos < len(buf) and buf[pos] in ' \t\r\n,':
+            pos += 1
+
+        if pos < len(buf) and buf[pos] == ']':
+            return
+
+        try:
+            record, end = decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError:
+            # record is cut off by the end of the buffer
+            if not (chunk := f.read(chunk_size)):
+                raise
+            buf = buf[pos:] + chunk
+            pos = 0
+            continue
+
+        yield record
+        pos = end
+
+
+class BulkImporter():
+    """ Add comments to a tree without going through the API.
+        Comments are collected in batches, the comment blocks of a batch are written concurrently,
+        and full comment pages are written and dropped from memory as soon as they fill up.
+        Posts, blogs and sites are only written once, in finish(), every level concurrently.
+        Sites, blogs and posts that don't exist yet are created """
+    def __init__(self, store, root_cid=None, batch_size=1000):
+        self._store = store
+        self._batch_size = batch_size
+        self._batch = []
+        self._posts = {}
+
+        if root_cid:
+            self._root = load_tree(store, root_cid, lazy=True)
+        else:
+            self._root = RootNode(store, 'root')
+
+        self.imported = 0
+        self.skipped = 0
+
+    def get_post(self, site_id, blog_id, post_id):
+        key = (site_id, blog_id, post_id)
+        if (post := self._posts.get(key)) == None:
+            post = self._root.get_or_add_child(site_id).get_or_add_child(blog_id).get_or_add_child(post_id)
+            self._posts[key] = post
+        return post
+
+    def add(self, record):
+        """ Queue a comment record, write the batch when it's full """
+        try:
+            post = self.get_post(str(record['site_id']), str(record['blog_id']), str(record['post_id']))
+        except (KeyError, TypeError):
+            logger.warning(f"Skipping record without site_id, blog_id or post_id: {record}")
+            self.skipped += 1
+            return
+
+        data = {k: record.get(k) for k in COMMENT_FIELDS}
+        # the name is used as link key in the post block
+        data['name'] = str(data['name'] or '')
+        self._batch.append(CommentNode(self._store, **data, parent=post))
+
+        if len(self._batch) >= self._batch_size:
+            self.flush()
+
+    def flush(self):
+        """ Write the queued comments and link them to their posts """
+        if not self._batch:
+            return
+
+        futures = [get_executor().submit(comment.write) for comment in self._batch]
+        wait(futures)
+        for f in futures:
+            f.result()
+
+        posts = {}
+        for comment in self._batch:
+            post = comment._parent
+            post.add_link("comments", comment)
+            posts[id(post)] = post
+
+        for post in posts.values():
+            post.flush_pages(keep=False)
+
+        self.imported += len(self._batch)
+        logger.info(f"Imported {self.imported} comments")
+        self._batch = []
+
+    def finish(self):
+        """ Write the rest of the tree, return the new RootNode """
+        self.flush()
+        write_branches(self._posts.values())
+        return self._root
+
+    def import_records(self, records):
+        for record in records:
+            self.add(record)
+        return self.finish()
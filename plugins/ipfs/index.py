@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+
+import logging
+import threading
+
+from sqlalchemy.exc import SQLAlchemyError
+
+from core import db
+from core.exceptions import NotFoundError, InternalServerError
+
+from plugins.ipfs.models import RootNode
+
+logger = logging.getLogger('app')
+
+
+class IndexedPost(db.Model):
+    """ Post as it is in the indexed root """
+    __tablename__ = 'comment_index_posts'
+    site_id = db.Column(db.String(255), primary_key=True)
+    blog_id = db.Column(db.String(255), primary_key=True)
+    post_id = db.Column(db.String(255), primary_key=True)
+    cid = db.Column(db.String(120), nullable=False)
+
+
+class IndexedComment(db.Model):
+    """ Materialized comment, keyed by its CID and position within the post.
+        The CID alone isn't unique, identical comments have the same CID and the same
+        comment block can be linked from two posts. Every copy is a row, like in the tree.
+        position is the place of the comment in the post's list of links """
+    __tablename__ = 'comment_index_comments'
+    site_id = db.Column(db.String(255), primary_key=True)
+    blog_id = db.Column(db.String(255), primary_key=True)
+    post_id = db.Column(db.String(255), primary_key=True)
+    position = db.Column(db.Integer, primary_key=True)
+    cid = db.Column(db.String(120), primary_key=True)
+
+    name = db.Column(db.String(255), nullable=True)
+    author = db.Column(db.String(255), nullable=True)
+    datetime = db.Column(db.String(64), nullable=True)
+    reply_to = db.Column(db.String(120), nullable=True)
+    content = db.Column(db.Text, nullable=True)
+
+    __table_args__ = (db.Index('ix_comment_index_comments_post_datetime', 'site_id', 'blog_id', 'post_id', 'datetime'),
+                      db.Index('ix_comment_index_comments_cid', 'cid'))
+
+    def get_json(self):
+        """ Same format as CommentNode.get_json() """
+        data = {}
+        data["Name"] = self.name
+        data["author"] = self.author
+        data["datetime"] = self.datetime
+        data["reply_to"] = self.reply_to
+        data["content"] = self.content
+        return data
+
+
+class IndexState(db.Model):
+    """ Root CID that the index reflects, there is only one row """
+    __tablename__ = 'comment_index_state'
+    id = db.Column(db.Integer, primary_key=True)
+    root_cid = db.Column(db.String(120), nullable=True)
+
+
+class CommentIndex():
+    """ Materialized view of all comments in the tree, so reading comments
+        is one indexed query instead of a walk over IPFS.
+
+        When the root moves the index catches up by comparing the old and the new tree.
+        Subtrees with an unchanged CID are skipped, and of a changed post only the
+        comments that are new are read from IPFS. """
+    def __init__(self):
+        self._lock = threading.Lock()
+        db.create_all()
+
+    def get_state(self):
+        state = IndexState.query.get(1)
+        if state == None:
+            state = IndexState(id=1, root_cid=None)
+            db.session.add(state)
+        return state
+
+    def sync(self, store, root_cid):
+        """ Update index to root_cid """
+        with self._lock:
+            state = self.get_state()
+            if state.root_cid == root_cid:
+                return
+
+            old = RootNode(store, 'root', cid=state.root_cid, lazy=True) if state.root_cid else None
+            new = RootNode(store, 'root', cid=root_cid, lazy=True)
+
+            logger.info(f"Syncing comment index: {state.root_cid} -> {root_cid}")
+            self._diff(old, new, [])
+            state.root_cid = root_cid
+            self._commit()
+
+    def rebuild(self, store, root_cid):
+        """ Throw away the index and build it from root_cid """
+        with self._lock:
+            IndexedComment.query.delete()
+            IndexedPost.query.delete()
+            self.get_state().root_cid = None
+            self._commit()
+
+        self.sync(store, root_cid)
+
+    def _commit(self):
+        try:
+            db.session.commit()
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            raise InternalServerError("Failed to update comment index", trace=e)
+
+    def _diff(self, old, new, path):
+        """ Walk down to the posts that differ between old and new """
+        old_links = dict(old.get_links()) if old != None else {}
+        new_links = dict(new.get_links()) if new != None else {}
+
+        for name in old_links.keys() | new_links.keys():
+            if old_links.get(name) == new_links.get(name):
+                continue
+
+            old_child = old.get_child(name) if name in old_links else None
+            new_child = new.get_child(name) if name in new_links else None
+
+            # root > site > blog > post
+            if len(path) == 2:
+                self._index_post(*path, name, new_child)
+            else:
+                self._diff(old_child, new_child, path + [name])
+
+    def _index_post(self, site_id, blog_id, post_id, post):
+        """ Bring the comments of one post up to date """
+        key = dict(site_id=site_id, blog_id=blog_id, post_id=post_id)
+
+        if post == None:
+            IndexedComment.query.filter_by(**key).delete()
+            IndexedPost.query.filter_by(**key).delete()
+            return
+
+        db.session.merge(IndexedPost(**key, cid=post.cid))
+
+        indexed = {(c.cid, c.position): c for c in IndexedComment.query.filter_by(**key)}
+        current = {(cid, position): name for position, (name, cid) in enumerate(post.get_links())}
+
+        # appending comments doesn't move any, so usually only new rows are added
+        for row_key in indexed.keys() - current.keys():
+            db.session.delete(indexed[row_key])
+
+        added = sorted((position, current[(cid, position)], cid) for cid, position in current.keys() - indexed.keys())
+        # identical comments are read once
+        cids = list(dict.fromkeys(cid for position, name, cid in added))
+        blocks = dict(zip(cids, post.get_dags(cids)))
+        for position, name, cid in added:
+            block = blocks[cid]
+            db.session.add(IndexedComment(**key,
+                                          position=position,
+                                          cid=cid,
+                                          name=name,
+                                          author=block.get('author'),
+                                          datetime=block.get('datetime'),
+                                          reply_to=block.get('reply_to'),
+                                          content=block.get('content')))
+
+    def get_post_cid(self, site_id, blog_id, post_id):
+        if (post := IndexedPost.query.get((site_id, blog_id, post_id))) == None:
+            raise NotFoundError(f"Failed to find post: {site_id}>{blog_id}>{post_id}")
+        return post.cid
+
+    def get_comments(self, site_id, blog_id, post_id):
+        """ Return comments of post in the order of the tree """
+        if not IndexedPost.query.filter_by(site_id=site_id, blog_id=blog_id, post_id=post_id).first():
+            raise NotFoundError(f"Failed to find comments for: {site_id}>{blog_id}>{post_id}")
+
+        comments = IndexedComment.query.filter_by(site_id=site_id, blog_id=blog_id, post_id=post_id)\
+                                       .order_by(IndexedComment.position)
+        return [c.get_json() for c in comments]
+
+
+_comment_index = None
+_comment_index_lock = threading.Lock()
+
+def get_comment_index():
+    """ Return the process wide comment index, create it on first use """
+    global _comment_index
+    with _comment_index_lock:
+        if _comment_index == None:
+            _comment_index = CommentIndex()
+    return _comment_index
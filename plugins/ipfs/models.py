@@ -3,28 +3,85 @@
 import sys
 from pprint import pprint
 import inspect
-import io
-import json
 import logging
 from dataclasses import dataclass, field
 from typing import Dict, List
 import random
+import threading
+import hashlib
+import hmac
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from core import config
+from core import metrics
+from core.exceptions import NotFoundError, BadRequestError
+from plugins.ipfs.cache import get_block_cache
+from plugins.ipfs.hamt import LinkMap
+from plugins.ipfs import codec
+from plugins.ipfs.blockstore import BlockStore, BlockStoreException, get_block_store
 
-from core.exceptions import NotFoundError
+logger = logging.getLogger('app')
 
-import ipfshttpclient
+def get_block_codec():
+    """ Return the name of the codec that new blocks are written in """
+    codec_name = config['plugins']['ipfs'].get('block_codec', 'dag-cbor')
+    if codec_name not in codec.CODECS:
+        raise codec.CodecError(f"Unsupported block codec: {codec_name}, choose from: {', '.join(codec.CODECS)}")
+    return codec_name
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def get_executor():
+    """ Return the thread pool that is used to fetch blocks concurrently, create it on first use.
+        Only leaf jobs (a single block fetch) are submitted so the pool can't deadlock on itself. """
+    global _executor
+    with _executor_lock:
+        if _executor == None:
+            max_workers = config['plugins']['ipfs'].get('max_concurrency', 8)
+            _executor = ThreadPoolExecutor(max_workers=int(max_workers), thread_name_prefix='ipfs')
+            logger.info(f"Created IPFS fetch pool, max_workers={max_workers}")
+    return _executor
+
+def submit(fn, *args, context=None):
+    """ Run fn in the fetch pool, in a copy of the caller's context so its I/O is counted for the caller's request.
+        context is the context of another thread, eg: of the request that queued a comment """
+    if context == None:
+        context = contextvars.copy_context()
+    return get_executor().submit(context.run, fn, *args)
 
-logger = logging.getLogger('app')
 
 class NodeBaseClass():
     """ These classes represent the IPFS tree.
-        A full tree can be read from IPFS, changed and written back. """
-    def __init__(self, client:ipfshttpclient, name:str=None, cid=None, parent=None):
-        self._client = client
+        A full tree can be read from IPFS, changed and written back.
+        A lazy node only knows its name and CID, its block is fetched the first time it is used.
+        Children are linked by name under _child_key, see LinkMap for the layout. """
+
+    # key in the block that links to the children
+    _child_key = None
+
+    def __init__(self, store:BlockStore, name:str=None, cid=None, parent=None, lazy=False):
+        self._store = store
         self._name = name
-        self._cid = None
+        self._cid = cid
         self._json = {"Name" : self._name}
         self._parent = parent
+        self._lazy = lazy
+        self._loaded = not lazy
+        # node differs from its stored block, a node without CID was never written
+        self._dirty = cid == None
+        # memo key of the fields when the node was last read or written, see memo_key()
+        self._clean_key = None
+        # (codec, memo key, bytes) of the last serialization
+        self._encoded = None
+
+        # children that were created or used, by name
+        self._children = {}
+        # stored links, the children that are not in _children yet are only created when needed
+        self._links = LinkMap(self) if self._child_key else None
+        self._enumerated = True
 
     @property
     def json(self):
@@ -38,6 +95,31 @@ class NodeBaseClass():
     def name(self):
         return self._name
 
+    @property
+    def dirty(self):
+        """ Fields that are set directly don't call changed(), they're compared with the memo key
+            of the last read or write. A lazy node that wasn't read can't have changed """
+        return self._dirty or (self._loaded and self.memo_key() != self._clean_key)
+
+    def mark_clean(self):
+        """ Node is equal to its stored block """
+        self._dirty = False
+        self._clean_key = self.memo_key()
+
+    @property
+    def depth(self):
+        """ Distance to the root node """
+        depth = 0
+        parent = self._parent
+        while parent != None:
+            depth += 1
+            parent = parent._parent
+        return depth
+
+    def child_class(self):
+        """ Return the class of the children of this node """
+        return None
+
     def print(self, data=None, indent=0, prefix=''):
         magenta = "\033[35m"
         white = "\033[37m"
@@ -45,7 +127,7 @@ class NodeBaseClass():
         reset = "\033[0m"
 
         if data == None:
-            data = self._client.dag.get(self._cid).as_json()
+            data = self.get_dag(self._cid)
 
         spaces = " " * indent
 
@@ -58,7 +140,7 @@ class NodeBaseClass():
             print(spaces + magenta + prefix + "DICT" + reset)
             for k,v in data.items():
                 if k == '/':
-                    d = self._client.dag.get(v).as_json()
+                    d = self.get_dag(v)
                     self.print(d, prefix=f"{white}{k}:{reset} ", indent=indent+2)
                 else:
                     if v == None:
@@ -68,37 +150,219 @@ class NodeBaseClass():
             print(spaces + prefix + "\t" + str(data))
 
     def add_link(self, key, node):
-        """ Append a link in the list at key """
-        if not key in self._json.keys():
-            self._json[key] = []
-
-        link = {node.name: {'/' : node.cid}, 'Name' : node.name}
-        self._json[key].append(link)
+        """ Add node as a child, it is linked under key when this node is written """
+        if key != self._child_key:
+            raise KeyError(f"{type(self).__name__} has no children at key: {key}")
+
+        self.load()
+        node._parent = self
+        self._children[node.name] = node
+        self.changed()
+
+    def changed(self):
+        """ Mark node as changed, it is serialized again and written on the next write """
+        self._dirty = True
+        self._encoded = None
+
+    def memo_key(self):
+        """ Value that changes when a field of the node changes outside of changed() """
+        return None
+
+    def encode(self):
+        """ Return (codec name, bytes) of the block of this node in the configured block codec.
+            The bytes are kept until the node changes, encoding a clean node costs nothing """
+        codec_name = get_block_codec()
+        key = self.memo_key()
+        if self._encoded == None or self._encoded[0] != codec_name or self._encoded[1] != key:
+            self._encoded = (codec_name, key, codec.encode(self.get_json(), codec.CODECS[codec_name]))
+        return codec_name, self._encoded[2]
+
+    def put_block(self, codec_name, encoded):
+        """ Write encoded block to IPFS, return CID """
+        with metrics.ipfs_io('put') as io:
+            cid = self._store.put(encoded, codec_name)
+            io.bytes = len(encoded)
+
+        # we know what's behind the new CID so the next read doesn't have to hit IPFS
+        get_block_cache().put(cid, codec.decode(encoded, codec.CODECS[codec_name]), size=len(encoded))
+        return cid
+
+    def put_dag(self, data):
+        """ Write dag object to IPFS in the configured block codec, return CID """
+        codec_name = get_block_codec()
+        return self.put_block(codec_name, codec.encode(data, codec.CODECS[codec_name]))
 
     def write(self):
-        """ Write object to IPFS """
-        res = self._client.dag.put(io.BytesIO(json.dumps(self.get_json()).encode()))
-        self._cid = res['Cid']['/']
+        """ Write object to IPFS, the put is skipped when the block is already stored under the node's CID """
+        codec_name, encoded = self.encode()
+        if codec.make_cid(encoded, codec.CODECS[codec_name]) == self._cid:
+            cid = self._cid
+        else:
+            cid = self.put_block(codec_name, encoded)
+
+        if cid != self._cid and self._parent != None:
+            self._parent.changed()
+        self._cid = cid
+        self.mark_clean()
         return self._cid
 
+    def get_raw_block(self, cid):
+        """ Return the encoded block from the block store """
+        with metrics.ipfs_io('get') as io:
+            data = self._store.get(cid)
+            io.bytes = len(data)
+        return data
+
+    def get_raw_blocks(self, cids):
+        """ Get multiple encoded blocks concurrently, in the order of cids """
+        if len(cids) < 2:
+            return [self.get_raw_block(cid) for cid in cids]
+
+        futures = [submit(self.get_raw_block, cid) for cid in cids]
+        wait(futures)
+        return [f.result() for f in futures]
+
     def get_dag(self, cid):
-        """ Get dag object from IPFS """
-        return self._client.dag.get(cid).as_json()
+        """ Get dag object from block cache or block store.
+            Blocks are shared between readers and must not be changed in place """
+        cache = get_block_cache()
+        if (block := cache.get(cid)) != None:
+            return block
 
-    def node_factory(self, key, cid, _class):
-        """ Create object from _class if key is found in ipfs data """
+        # the codec is part of the CID, so dag-json and dag-cbor blocks can be mixed in one tree
         try:
-            node_json = self.get_dag(cid)[key]
-        except KeyError as e:
-            raise NotFoundError("Failed to find key", trace=e)
+            block_codec = codec.cid_codec(cid)
+        except (codec.CodecError, ValueError):
+            block_codec = None
+
+        if block_codec in codec.CODECS.values():
+            data = self.get_raw_block(cid)
+            block = codec.decode(data, block_codec)
+            cache.put(cid, block, size=len(data))
+        else:
+            with metrics.ipfs_io('get'):
+                block = self._store.get_decoded(cid)
+            cache.put(cid, block)
+        return block
+
+    def get_block(self):
+        """ Return the stored block of this node """
+        return self.get_dag(self._cid)
+
+    def get_dags(self, cids):
+        """ Get multiple dag objects concurrently, blocks are returned in the order of cids.
+            All fetches are waited for before an error is raised, so a failing block can't
+            leave the others running in the background """
+        if len(cids) < 2:
+            return [self.get_dag(cid) for cid in cids]
+
+        futures = [submit(self.get_dag, cid) for cid in cids]
+        wait(futures)
+        return [f.result() for f in futures]
+
+    def load(self):
+        """ Read the block of a lazy node if that didn't happen yet """
+        if not self._loaded:
+            self.read_node(self._cid)
+
+    def read_node(self, cid, block=None):
+        """ Read object from ipld, retrieve children.
+            Lazy nodes only read the block, children are looked up by name when they're used """
+        if block == None:
+            block = self.get_dag(cid)
+
+        self._links = LinkMap(self, block.get(self._child_key))
+        self._children = {}
+        self._enumerated = False
+        self._cid = cid
+        self._loaded = True
+        self.mark_clean()
+        self._encoded = None
+
+        if not self._lazy:
+            self.get_children()
+
+    def node_factory(self, items, lazy=False):
+        """ Create child objects from (name, cid) pairs.
+            When lazy, children are created as proxies that are read on first use,
+            otherwise the child blocks are fetched concurrently """
+        _class = self.child_class()
+        nodes = [_class(self._store, name, cid=cid, parent=self, lazy=lazy) for name, cid in items]
+
+        if not lazy:
+            self.read_nodes(nodes)
+        return nodes
 
-        nodes = []
-        for item in node_json:
-            node = _class(self._client, item['Name'], parent=self)
-            node.read_node(item[item['Name']]['/'])
-            nodes.append(node)
+    def read_nodes(self, nodes):
+        """ Read nodes from their CID, blocks are fetched concurrently """
+        blocks = self.get_dags([node.cid for node in nodes])
+        for node, block in zip(nodes, blocks):
+            node.read_node(node.cid, block=block)
+
+    def load_nodes(self, nodes):
+        """ Read the lazy nodes that weren't read yet """
+        self.read_nodes([node for node in nodes if not node._loaded])
+
+    def get_links(self):
+        """ Return (name, cid) of all children as they are stored, without reading the children """
+        self.load()
+        return self._links.items()
+
+    def get_loaded_children(self):
+        """ Return the children that are in memory, without reading anything """
+        return list(self._children.values())
+
+    def get_dirty_nodes(self):
+        """ Return the changed nodes in this subtree, only nodes that are in memory are visited """
+        dirty = []
+        nodes = [self]
+        while nodes:
+            node = nodes.pop()
+            if node.dirty:
+                dirty.append(node)
+            nodes += node.get_loaded_children()
+        return dirty
+
+    def get_children(self):
+        """ Return all children, children that were used before are kept """
+        self.load()
+        if not self._enumerated:
+            items = [(name, cid) for name, cid in self._links.items() if name not in self._children]
+            for node in self.node_factory(items, lazy=self._lazy):
+                self._children[node.name] = node
+            self._children = dict(sorted(self._children.items()))
+            self._enumerated = True
+        return list(self._children.values())
+
+    def get_child(self, name):
+        """ Return child by name, only read the blocks that are needed to find it """
+        self.load()
+        if not name in self._children:
+            if (cid := self._links.get(name)) == None:
+                raise NotFoundError(f"Failed to find {name}")
+            self._children[name] = self.node_factory([(name, cid)], lazy=self._lazy)[0]
+        return self._children[name]
+
+    def get_or_add_child(self, name):
+        """ Return child by name, create an empty child when it doesn't exist """
+        try:
+            return self.get_child(name)
+        except NotFoundError:
+            node = self.child_class()(self._store, name)
+            self.add_link(self._child_key, node)
+            return node
+
+    def reset_links(self):
+        """ Forget how the children are stored, the next write stores all of them from scratch """
+        self.get_children()
+        self._links = LinkMap(self)
+        self.changed()
 
-        return nodes
+    def get_json(self):
+        for node in self._children.values():
+            self._links.set(node.name, node.cid)
+        self._json[self._child_key] = self._links.serialize()
+        return self._json
 
     def write_branch(self):
         """ Write branch from tree up all the way to the root node, leave other branches unchanged """
@@ -110,115 +374,315 @@ class NodeBaseClass():
             parent = parent._parent
 
 
+def write_branches(nodes):
+    """ Write the branches of all nodes up to the root node.
+        Every node is written once, and only after all of its changed children.
+        Nodes on the same level don't depend on each other and are written concurrently.
+        A write only does direct block I/O, it never submits to the pool itself """
+    levels = {}
+    seen = set()
+    for node in nodes:
+        while node != None and id(node) not in seen:
+            seen.add(id(node))
+            levels.setdefault(node.depth, []).append(node)
+            node = node._parent
 
-class RootNode(NodeBaseClass):
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.sites = []
+    for depth in sorted(levels, reverse=True):
+        logger.debug(f">>>> writing {len(levels[depth])} nodes at depth: {depth}")
+        futures = [submit(node.write) for node in levels[depth]]
+        wait(futures)
+        for f in futures:
+            f.result()
 
-        self.links = {}
-        self.links['sites'] = []
 
-    def read_node(self, cid):
-        """ Read object from ipld, retrieve children """
-        self.sites = self.node_factory('sites', cid, SiteNode)
-        self._cid = cid
+class RootNode(NodeBaseClass):
+    _child_key = 'sites'
 
-    def get_json(self):
-        for s in self.sites:
-            self.add_link("sites", s)
-        return self._json
+    def child_class(self):
+        return SiteNode
+
+    @property
+    def sites(self):
+        return self.get_children()
 
     def get_comments(self, site_id, blog_id, post_id):
-        try:
-            site = next(iter([x for x in self.sites if x.name == site_id]))
-            blog = next(iter([x for x in site.blogs if x.name == blog_id]))
-            post = next(iter([x for x in blog.posts if x.name == post_id]))
-            return post.comments
-        except StopIteration as e:
-            raise NotFoundError(f"Failed to find comments for: {site_id}>{blog_id}>{post_id}, error={e}", trace=e)
+        return self.find_post(site_id, blog_id, post_id).comments
 
     def get_site(self, site_id):
-        try:
-            return next(iter(x for x in self.sites if x.name == site_id))
-        except StopIteration as e:
-            raise NotFoundError(f"Failed to find {site_id}", trace=e)
+        return self.get_child(site_id)
+
+    def find_post(self, site_id, blog_id, post_id):
+        """ Find a post for reading.
+            With name keyed links the daemon resolves the path to the post in one call,
+            when that fails (eg: a sharded map on the path) the tree is walked instead.
+            A failed resolve is remembered for the root CID so the walk is taken right away,
+            stores that can't resolve paths are always walked.
+            The returned post has no parents so it can't be written """
+        walk = lambda: self.get_site(site_id).get_blog(blog_id).get_post(post_id)
+        if not self._store.can_resolve:
+            return walk()
+
+        # a path below a CID can never change so it is cached like a block
+        cache = get_block_cache()
+        unresolvable = f"{self._cid}/unresolvable"
+        path = f"{self._cid}/sites/{site_id}/blogs/{blog_id}/posts/{post_id}"
+        if (cid := cache.get(path)) == None:
+            if cache.get(unresolvable):
+                return walk()
+            try:
+                with metrics.ipfs_io('resolve'):
+                    cid = self._store.resolve(path)
+            except BlockStoreException as e:
+                logger.debug(f"Failed to resolve path, walking tree: {path}, {e}")
+                cache.put(unresolvable, True, size=len(unresolvable))
+                return walk()
+
+            cache.put(path, cid, size=len(path) + len(cid))
+
+        return PostNode(self._store, post_id, cid=cid, lazy=True)
 
     def write_tree(self):
-        """ Write full tree to IPFS """
-        blogs = [b for sublist in self.sites for b in sublist.blogs]
-        posts = [p for sublist in blogs for p in sublist.posts]
-        comments = [c for sublist in posts for c in sublist.comments]
-
-        for c in comments:
-            c.write()
-        for p in posts:
-            p.write()
-        for b in blogs:
-            b.write()
-        for s in self.sites:
-            s.write()
-
-        self.write()
+        """ Write the changed nodes of the tree to IPFS, deepest level first and every level concurrently.
+            Unchanged subtrees keep their CID and are not written again """
+        write_branches(self.get_dirty_nodes())
 
 
 class SiteNode(NodeBaseClass):
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.blogs = []
+    _child_key = 'blogs'
 
-    def read_node(self, cid):
-        """ Read object from ipld, retrieve children """
-        self.blogs = self.node_factory('blogs', cid, BlogNode)
-        self._cid = cid
+    def child_class(self):
+        return BlogNode
 
-    def get_blog(self, blog_id):
-        try:
-            return next(iter(x for x in self.blogs if x.name == blog_id))
-        except StopIteration as e:
-            raise NotFoundError(f"Failed to find {blog_id}", trace=e)
+    @property
+    def blogs(self):
+        return self.get_children()
 
-    def get_json(self):
-        for b in self.blogs:
-            self.add_link("blogs", b)
-        return self._json
+    def get_blog(self, blog_id):
+        return self.get_child(blog_id)
 
 
 class BlogNode(NodeBaseClass):
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.posts = []
+    _child_key = 'posts'
 
-    def get_post(self, post_id):
-        try:
-            return next(iter(x for x in self.posts if x.name == post_id))
-        except StopIteration as e:
-            raise NotFoundError(f"Failed to find {post_id}", trace=e)
+    def child_class(self):
+        return PostNode
 
-    def read_node(self, cid):
-        """ Read object from ipld, retrieve children """
-        self.posts = self.node_factory('posts', cid, PostNode)
-        self._cid = cid
+    @property
+    def posts(self):
+        return self.get_children()
 
-    def get_json(self):
-        for p in self.posts:
-            self.add_link("posts", p)
-        return self._json
+    def get_post(self, post_id):
+        return self.get_child(post_id)
 
 
 class PostNode(NodeBaseClass):
+    """ Comments are not keyed by name, names of comments don't have to be unique.
+        They're stored in the order they were added, in pages of page_size comments.
+
+        The post block holds the newest page (the head) and a link to the newest full page:
+            {"Name": name, "count": n, "comments": [links], "next": {'/': cid} or None}
+        Every full page links to the page before it:
+            {"comments": [links], "next": {'/': cid} or None}
+        Full pages never change, adding a comment only rewrites the post block, and when the
+        head is full, one new page. The newest comments can be read without touching older pages.
+        The legacy layout, all comments in one list without "next", is read as one big head
+        and is split into pages on the next write. """
+    _child_key = 'comments'
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.comments = []
+        self._page_size = int(config['plugins']['ipfs'].get('page_size', 50))
+        self._head = []
+        self._next = None
+        self._count = 0
+        # comments in full pages, oldest first, None until they're read
+        self._older = []
+        # CIDs of _older as they are stored in the pages
+        self._older_cids = []
+
+    def child_class(self):
+        return CommentNode
+
+    @staticmethod
+    def page_links(block):
+        """ Return (name, cid) of the comments in a post or page block """
+        return [(x['Name'], x[x['Name']]['/']) for x in block.get('comments', [])]
+
+    @property
+    def count(self):
+        self.load()
+        return self._count
 
-    def read_node(self, cid):
-        """ Read object from ipld, retrieve children """
-        self.comments = self.node_factory('comments', cid, CommentNode)
+    @property
+    def comments(self):
+        """ All comments, oldest first """
+        self.load()
+        if self._older == None:
+            self._older = self.node_factory(self.get_older_links(self._next), lazy=True)
+            self._older_cids = [c.cid for c in self._older]
+
+        comments = self._older + self._head
+        self.load_nodes(comments)
+        return comments
+
+    def get_children(self):
+        return self.comments
+
+    def get_loaded_children(self):
+        return (self._older or []) + self._head
+
+    def get_older_links(self, cid):
+        """ Return links in the full pages starting at cid, oldest first """
+        pages = []
+        while cid != None:
+            block = self.get_dag(cid)
+            pages.append(self.page_links(block))
+            cid = block['next']['/'] if block.get('next') else None
+        return [link for page in reversed(pages) for link in page]
+
+    def get_links(self, block=None):
+        """ Return (name, cid) of all comments as they are stored, without reading the comments """
+        if block == None:
+            block = self.get_dag(self._cid)
+        next_cid = block['next']['/'] if block.get('next') else None
+        return self.get_older_links(next_cid) + self.page_links(block)
+
+    @staticmethod
+    def cursor_signature(scope, cid, n):
+        """ Cursors are signed, so a client can only continue where a page of the same post ended
+            and can't make the server read a block of its choice """
+        key = config['core']['jwt_secret_key'].encode()
+        return hmac.new(key, f"cursor/{scope}/{cid}:{n}".encode(), hashlib.sha256).hexdigest()[:32]
+
+    def make_cursor(self, scope, cid, n=None):
+        """ n is the number of comments of block cid that are left, None for the whole block """
+        n = '' if n == None else n
+        return f"{cid}:{n}:{self.cursor_signature(scope, cid, n)}"
+
+    def parse_cursor(self, scope, cursor):
+        """ Return (cid, n) of a cursor made by make_cursor() """
+        try:
+            cid, n, signature = cursor.split(':')
+            offset = int(n) if n != '' else None
+        except ValueError as e:
+            raise BadRequestError(f"Malformed cursor: {cursor}", trace=e)
+
+        if (offset != None and offset < 0) or not hmac.compare_digest(signature, self.cursor_signature(scope, cid, n)):
+            raise BadRequestError(f"Invalid cursor: {cursor}")
+        return cid, offset
+
+    def get_page_block(self, cid):
+        """ Return (links, next cid) of a post or page block """
+        block = self.get_dag(cid)
+        try:
+            # every post and page block has a list of comments, eg: a comment block has none
+            if type(block['comments']) != list:
+                raise TypeError(f"comments is a {type(block['comments']).__name__}")
+            links = self.page_links(block)
+            next_cid = block['next']['/'] if block.get('next') else None
+        except (KeyError, TypeError, AttributeError) as e:
+            raise BadRequestError(f"Not a page of comments: {cid}", trace=e)
+        return links, next_cid
+
+    def get_page(self, limit, cursor=None, scope=None):
+        """ Return up to limit comments, newest first, and the cursor for the next page or None.
+            A cursor is <cid>:<n>:<signature>, continue with the n first comments of the post or page block cid,
+            or with all of them when n is empty.
+            scope names the post, eg: site/blog/post, a cursor is only valid for the scope it was made for.
+            Only the blocks of the page are read, no matter how many comments the post has """
+        scope = scope or self._name
+        if cursor:
+            cid, n = self.parse_cursor(scope, cursor)
+        else:
+            cid, n = self._cid, None
+
+        links = []
+        while cid != None and len(links) < limit:
+            page, next_cid = self.get_page_block(cid)
+            page = page[:n]
+            take = page[max(0, len(page) - (limit - len(links))):]
+            links += reversed(take)
+
+            if len(take) < len(page):
+                # page has more comments than fit
+                return self.read_links(links), self.make_cursor(scope, cid, len(page) - len(take))
+
+            cid = next_cid
+            n = None
+
+        # the next block is read whole, whatever page size it was written with
+        return self.read_links(links), self.make_cursor(scope, cid) if cid != None else None
+
+    def read_links(self, links):
+        """ Read comments from (name, cid) pairs """
+        return self.node_factory(links)
+
+    def add_link(self, key, node):
+        """ Append comment to the head page """
+        if key != self._child_key:
+            raise KeyError(f"{type(self).__name__} has no children at key: {key}")
+
+        self.load()
+        node._parent = self
+        self._head.append(node)
+        self._count += 1
+        self.changed()
+
+    def read_node(self, cid, block=None):
+        """ Read object from ipld, comments are read when they're used """
+        if block == None:
+            block = self.get_dag(cid)
+
+        self._head = self.node_factory(self.page_links(block), lazy=True)
+        self._next = block['next']['/'] if block.get('next') else None
+        self._count = block.get('count', len(self._head))
+        self._older = [] if self._next == None else None
+        self._older_cids = []
         self._cid = cid
+        self._loaded = True
+        self.mark_clean()
+        self._encoded = None
+
+        if not self._lazy:
+            self.get_children()
+
+    def reset_links(self):
+        """ Forget the stored pages, the next write splits all comments into new pages """
+        self._head = self.comments
+        self._older = []
+        self._older_cids = []
+        self._next = None
+        self.changed()
+
+    def flush_pages(self, keep=True):
+        """ Move comments from the head into full pages until the head fits in one page.
+            When not keep, comments in full pages are dropped from memory, they're read again when needed """
+        if not keep and len(self._head) > self._page_size:
+            self._older = None
+            self._older_cids = []
+
+        while len(self._head) > self._page_size:
+            page = self._head[:self._page_size]
+            self._next = self.put_dag({"comments" : [{c.name: {'/' : c.cid}, 'Name' : c.name} for c in page],
+                                       "next"     : {'/' : self._next} if self._next != None else None})
+            self._head = self._head[self._page_size:]
+            if self._older != None:
+                self._older += page
+                self._older_cids += [c.cid for c in page]
+            self.changed()
+
+    def write(self):
+        """ Full pages are only written here, reading a post never writes to the store.
+            When a comment in a full page was changed, all pages are written again """
+        if self._older and [c.cid for c in self._older] != self._older_cids:
+            self.reset_links()
+        self.flush_pages()
+        return super().write()
 
     def get_json(self):
-        for c in self.comments:
-            self.add_link("comments", c)
+        self._json['count'] = self._count
+        self._json['comments'] = [{c.name: {'/' : c.cid}, 'Name' : c.name} for c in self._head]
+        self._json['next'] = {'/' : self._next} if self._next != None else None
         return self._json
 
 
@@ -230,8 +694,24 @@ class CommentNode(NodeBaseClass):
         self.reply_to = reply_to
         self.content = content
 
-    def read_node(self, cid):
-        node_json = self.get_dag(cid)
+    def get_children(self):
+        return []
+
+    def get_loaded_children(self):
+        return []
+
+    def memo_key(self):
+        # fields are set directly
+        return (self._name, self.author, self.datetime, self.reply_to, self.content)
+
+    def get_links(self):
+        return []
+
+    def reset_links(self):
+        self.changed()
+
+    def read_node(self, cid, block=None):
+        node_json = block if block != None else self.get_dag(cid)
         try:
             self.author = node_json['author']
             self.datetime = node_json['datetime']
@@ -240,6 +720,15 @@ class CommentNode(NodeBaseClass):
         except KeyError as e:
             print("Missing key:",e)
         self._cid = cid
+        self._loaded = True
+        self.mark_clean()
+        self._encoded = None
+
+    def serialize(self):
+        """ Comment as returned by the API, includes the CID """
+        data = dict(self.get_json())
+        data['cid'] = self._cid
+        return data
 
     def get_json(self):
         self._json['author'] = self.author
@@ -250,50 +739,65 @@ class CommentNode(NodeBaseClass):
 
 
 
-def load_tree(cid):
-    """ Load a full node tree from IPFS.
+def load_tree(store, cid, lazy=False):
+    """ Load a full node tree from the block store.
+        When lazy, nothing is read until the tree is first accessed, and then only the
+        blocks that are needed, eg: a lookup of one post only reads that branch.
         Returns: RootNode """
-
-    with ipfshttpclient.connect() as client:
-        root = RootNode(client, 'root')
+    root = RootNode(store, 'root', cid=cid, lazy=lazy)
+    if not lazy:
         root.read_node(cid)
-        return root
+    return root
+
+
+def migrate_tree(store, cid):
+    """ Read the full tree at cid and write every block again in the configured block codec.
+        Returns the new RootNode """
+    root = load_tree(store, cid)
 
+    nodes = [root]
+    while nodes:
+        node = nodes.pop()
+        nodes += node.get_children()
+        node.reset_links()
+
+    root.write_tree()
+    return root
 
 
 def write_example_node():
-    with ipfshttpclient.connect() as client:
+    store = get_block_store()
+
+    root = RootNode(store, 'disko')
+    for i in range(1):
+        site = SiteNode(store, "chmod777")
 
-        root = RootNode(client, 'disko')
         for i in range(1):
-            site = SiteNode(client, "chmod777")
+            blog = BlogNode(store, f"blog_{i}")
 
-            for i in range(1):
-                blog = BlogNode(client, f"blog_{i}")
+            for i in range(3):
+                post = PostNode(store, f"post_{i}")
 
                 for i in range(3):
-                    post = PostNode(client, f"post_{i}")
-
-                    for i in range(3):
-                        comment = CommentNode(client,
-                                              name=f"comment_title_{i}",
-                                              author="bever",
-                                              datetime="2021-02-33 23:34",
-                                              reply_to=None,
-                                              content="post content")
-                        comment.write()
-                        post.add_link("comments", comment)
-
-                    post.write()
-                    blog.add_link("posts", post)
-
-                blog.write()
-                site.add_link("blogs", blog)
-
-            site.write()
-            root.add_link("sites", site)
-
-        root.write()
-        #root.print()
-        print(">>>>>>>>>>>>>>>>", root.cid)
-        return root
+                    comment = CommentNode(store,
+                                          name=f"comment_title_{i}",
+                                          author="bever",
+                                          datetime="2021-02-33 23:34",
+                                          reply_to=None,
+                                          content="post content")
+                    comment.write()
+                    post.add_link("comments", comment)
+
+                post.write()
+                blog.add_link("posts", post)
+
+            blog.write()
+            site.add_link("blogs", blog)
+
+        site.write()
+        root.add_link("sites", site)
+
+    root.write()
+    #root.print()
+    print(">>>>>>>>>>>>>>>>", root.cid)
+    return root
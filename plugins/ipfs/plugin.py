@@ -1,75 +1,211 @@
 #!/usr/bin/env python3
 
-from core.exceptions import NotFoundError
+from core.exceptions import NotFoundError, BadRequestError, ServiceUnavailableError
 import logging
 from pathlib import Path
 from pprint import pprint
 import datetime
+from concurrent.futures import TimeoutError
 
 from core import plugin_manager
 from core import config
+from core import metrics
 
 
 from plugins.ipfs.models import load_tree
-from plugins.ipfs.models import CommentNode
-
-import ipfshttpclient
+from plugins.ipfs.models import NodeBaseClass, PostNode
+from plugins.ipfs.commit import get_commit_queue
+from plugins.ipfs.roots import get_root_store
+from plugins.ipfs.cache import get_block_cache, get_response_cache
+from plugins.ipfs.blockstore import get_block_store, BlockStoreException
+from plugins.ipfs.threads import build_threads
+from plugins.ipfs import codec
 
 logger = logging.getLogger('app')
 
 
+# attributes of a comment a client can set
+COMMENT_FIELDS = ('name', 'author', 'reply_to', 'content')
+
+
 class Plugin():
     def __init__(self):
         self.name = 'ipfs'
 
-    def get_comments(self, site_id, blog_id, post_id):
-        root_cid = config['plugins']["ipfs"]["root_cid"]
-        print(root_cid)
+    def get_comments(self, site_id, blog_id, post_id, limit=None, cursor=None, threaded=False, max_depth=None, max_children=None):
+        version, root_cid = get_root_store().get()
         if not root_cid:
-            raise NotFoundError("No CID found in config file")
+            raise NotFoundError("No root CID found")
+
+        if threaded:
+            return self.get_threads(root_cid, site_id, blog_id, post_id, max_depth, max_children)
+
+        if limit != None:
+            return self.get_comments_page(root_cid, site_id, blog_id, post_id, limit, cursor)
 
-        root = load_tree(root_cid)
+        if config['plugins']['ipfs'].get('comment_index', False):
+            return self.get_indexed_comments(root_cid, site_id, blog_id, post_id)
+
+        # only read the blocks on the path to the post
+        root = load_tree(get_block_store(), root_cid, lazy=True)
 
         comments = root.get_comments(site_id, blog_id, post_id)
+        logger.debug(f"Block cache: {get_block_cache().stats()}")
         if not comments:
             return
 
         return [c.get_json() for c in comments]
 
-    def add_comment(self, site_id, blog_id, post_id, data):
-        root_cid = config['plugins']["ipfs"]["root_cid"]
+    def get_post_cid(self, site_id, blog_id, post_id):
+        """ Return CID of post, it changes whenever the comments of the post change """
+        version, root_cid = get_root_store().get()
         if not root_cid:
-            raise NotFoundError("No CID found in config file")
+            raise NotFoundError("No root CID found")
+
+        if config['plugins']['ipfs'].get('comment_index', False):
+            from plugins.ipfs.index import get_comment_index
+            index = get_comment_index()
+            index.sync(get_block_store(), root_cid)
+            return index.get_post_cid(site_id, blog_id, post_id)
+
+        root = load_tree(get_block_store(), root_cid, lazy=True)
+        return root.find_post(site_id, blog_id, post_id).cid
+
+    def get_threads(self, root_cid, site_id, blog_id, post_id, max_depth=None, max_children=None):
+        """ Return comments as a forest of replies, cached per post CID """
+        cfg = config['plugins']['ipfs']
+        max_depth = max_depth or int(cfg.get('thread_max_depth', 10))
+        max_children = max_children or int(cfg.get('thread_max_children', 100))
 
-        # read full tree from IPFS and create model
-        root = load_tree(root_cid)
+        root = load_tree(get_block_store(), root_cid, lazy=True)
+        post = root.find_post(site_id, blog_id, post_id)
 
-        # try to find the post where the comment should be added to
-        site = root.get_site(site_id)
-        blog = site.get_blog(blog_id)
-        post = blog.get_post(post_id)
+        key = f"{post.cid}/threads/{max_depth}/{max_children}"
+        cache = get_response_cache()
+        if (threads := cache.get(key)) != None:
+            return threads
 
-        # create and write comment to IPFS
-        with ipfshttpclient.connect() as client:
-            data["datetime"] = str(datetime.datetime.utcnow())
-            comment = CommentNode(client, **data, parent=post)
-            comment.write()
+        threads = build_threads([c.serialize() for c in post.comments], max_depth, max_children)
 
-        # add comment to post and write branch up to the root node
-        post.add_link("comments", comment)
-        comment.write_branch()
+        cache.put(key, threads)
+        return threads
 
-        # save and write changed root_cid to disk
-        config['plugins']['ipfs']['root_cid'] = root.cid
-        config.write()
-                              
-        logger.debug(">>>> Root CID: "+ root.cid)
-        return comment.get_json()
-         
+    def get_comments_page(self, root_cid, site_id, blog_id, post_id, limit, cursor):
+        """ Return one page of comments, newest first """
+        root = load_tree(get_block_store(), root_cid, lazy=True)
+        post = root.find_post(site_id, blog_id, post_id)
+        comments, next_cursor = post.get_page(limit, cursor, scope=f"{site_id}/{blog_id}/{post_id}")
 
+        return {"comments"    : [c.get_json() for c in comments],
+                "count"       : post.count,
+                "next_cursor" : next_cursor}
+
+    def get_indexed_comments(self, root_cid, site_id, blog_id, post_id):
+        """ Read comments from the local comment index, catch up with root_cid first """
+        # core.db doesn't exist yet when plugins are loaded
+        from plugins.ipfs.index import get_comment_index
+        index = get_comment_index()
+
+        index.sync(get_block_store(), root_cid)
+
+        comments = index.get_comments(site_id, blog_id, post_id)
+        if not comments:
+            return
+        return comments
+
+    def read_local_node(self, node):
+        """ Return the block of a node for the CID endpoints.
+            Only blocks in a codec of the tree that are already in the block store are served,
+            the daemon is never asked to find a block on the network for an anonymous request """
+        try:
+            block_codec = codec.cid_codec(node.cid)
+        except (codec.CodecError, ValueError, IndexError) as e:
+            raise BadRequestError(f"Invalid CID: {node.cid}", trace=e)
+
+        if block_codec not in codec.CODECS.values():
+            raise NotFoundError(f"Not a node of the comment tree: {node.cid}")
+
+        store = get_block_store()
+        try:
+            # a cached block was read from the store before
+            if node.cid not in get_block_cache() and not store.has(node.cid):
+                raise NotFoundError(f"Failed to find node: {node.cid}")
+            return node.get_block()
+        except BlockStoreException as e:
+            raise NotFoundError(f"Failed to read node: {node.cid}", trace=e)
+        except (codec.CodecError, ValueError, IndexError) as e:
+            raise BadRequestError(f"Failed to decode node: {node.cid}", trace=e)
+
+    def get_node(self, cid):
+        """ Return the block of any node in the tree """
+        return self.read_local_node(NodeBaseClass(get_block_store(), cid=cid))
+
+    def get_comments_by_cid(self, cid):
+        """ Return comments of the post with cid, the result never changes so it is cached """
+        cache = get_response_cache()
+        if (comments := cache.get(f"{cid}/comments")) != None:
+            return comments
+
+        post = PostNode(get_block_store(), cid=cid, lazy=True)
+        block = self.read_local_node(post)
+        if type(block) != dict or not 'comments' in block:
+            raise NotFoundError(f"Not a post: {cid}")
+
+        try:
+            comments = [c.get_json() for c in post.comments]
+        except BlockStoreException as e:
+            raise NotFoundError(f"Failed to read comments of post: {cid}", trace=e)
+        except (codec.CodecError, ValueError, KeyError, TypeError) as e:
+            raise BadRequestError(f"Not a post: {cid}", trace=e)
+
+        cache.put(f"{cid}/comments", comments)
+        return comments
+
+    def add_comment(self, site_id, blog_id, post_id, data):
+        version, root_cid = get_root_store().get()
+        if not root_cid:
+            raise NotFoundError("No root CID found")
+
+        # only known fields are passed on to the CommentNode, the datetime is set here
+        if not isinstance(data, dict):
+            raise BadRequestError("Comment must be an object")
+        fields = {}
+        for key in COMMENT_FIELDS:
+            value = data.get(key)
+            if value != None and not isinstance(value, str):
+                raise BadRequestError(f"Invalid comment attribute: {key}")
+            fields[key] = value
+        # the name is used as link key in the post block, like in the importer
+        fields["name"] = fields["name"] or ''
+        fields["datetime"] = str(datetime.datetime.utcnow())
+
+        # comments are written in batches, wait for the batch that contains this comment
+        timeout = float(config['plugins']['ipfs'].get('commit_timeout', 30))
+        try:
+            comment = get_commit_queue().submit(site_id, blog_id, post_id, fields).result(timeout=timeout)
+        except TimeoutError as e:
+            raise ServiceUnavailableError("Timed out waiting for the comment to be written", trace=e)
+        except (codec.CodecError, UnicodeError) as e:
+            raise BadRequestError("Comment can't be encoded", trace=e)
+        return comment.serialize()
+
+
+def collect_cache_stats():
+    """ Statistics of the block and response cache for the metrics endpoint """
+    caches = {'block' : get_block_cache().stats(), 'response' : get_response_cache().stats()}
+    collected = []
+    for key, _type in [('hits', 'counter'), ('misses', 'counter'), ('evictions', 'counter'), ('blocks', 'gauge'), ('bytes', 'gauge'), ('max_bytes', 'gauge')]:
+        name = f"ipfs_cache_{key}_total" if _type == 'counter' else f"ipfs_cache_{key}"
+        collected.append((name, _type, f"Cache {key.replace('_', ' ')}", [({'cache': cache}, stats[key]) for cache, stats in caches.items()]))
+    return collected
 
 
 def register():
+    metrics.registry.register_collector(collect_cache_stats)
+
     plugin = Plugin()
     plugin_manager.subscribe_hook('get_comments', 'ipfs', plugin.get_comments)
+    plugin_manager.subscribe_hook('get_post_cid', 'ipfs', plugin.get_post_cid)
+    plugin_manager.subscribe_hook('get_node', 'ipfs', plugin.get_node)
+    plugin_manager.subscribe_hook('get_comments_by_cid', 'ipfs', plugin.get_comments_by_cid)
     plugin_manager.subscribe_hook('add_comment', 'ipfs', plugin.add_comment)
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+
+import logging
+import queue
+import threading
+from contextlib import contextmanager
+
+from core import config
+from core.exceptions import InternalServerError
+
+import ipfshttpclient
+
+logger = logging.getLogger('app')
+
+
+class ClientPool():
+    """ Process wide pool of IPFS clients.
+        Clients keep their HTTP session (keep-alive) open between requests, a client
+        can be shared by the threads that work on the same request.
+        A client that loses its connection, eg: because the daemon restarted,
+        is thrown away and replaced by a fresh one on the next acquire. """
+    def __init__(self, addr, size=8, timeout=30, acquire_timeout=30):
+        self._addr = addr
+        self._size = size
+        self._timeout = timeout
+        self._acquire_timeout = acquire_timeout
+
+        # most recently used client first, so its connection is most likely still alive
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        logger.debug(f"Connecting to IPFS daemon: {self._addr}")
+        return ipfshttpclient.connect(self._addr, session=True, timeout=self._timeout)
+
+    def _acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            create = self._created < self._size
+            if create:
+                self._created += 1
+
+        if create:
+            try:
+                return self._connect()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+
+        try:
+            return self._idle.get(timeout=self._acquire_timeout)
+        except queue.Empty as e:
+            raise InternalServerError("No IPFS client available", trace=e)
+
+    def _release(self, client):
+        self._idle.put(client)
+
+    def _discard(self, client):
+        with self._lock:
+            self._created -= 1
+        try:
+            client.close()
+        except Exception as e:
+            logger.debug(f"Failed to close IPFS client: {e}")
+
+    @contextmanager
+    def client(self):
+        """ Borrow a client from the pool, it is returned when the block exits """
+        client = self._acquire()
+        try:
+            yield client
+        except (ipfshttpclient.exceptions.ConnectionError, ipfshttpclient.exceptions.TimeoutError):
+            logger.error("Lost connection to IPFS daemon, dropping client")
+            self._discard(client)
+            client = None
+            raise
+        finally:
+            if client != None:
+                self._release(client)
+
+    def close(self):
+        """ Close all idle clients """
+        while True:
+            try:
+                self._discard(self._idle.get_nowait())
+            except queue.Empty:
+                return
+
+
+_client_pool = None
+_client_pool_lock = threading.Lock()
+
+def get_client_pool():
+    """ Return the process wide client pool, create it on first use """
+    global _client_pool
+    with _client_pool_lock:
+        if _client_pool == None:
+            cfg = config['plugins']['ipfs']
+            _client_pool = ClientPool(cfg.get('addr', ipfshttpclient.DEFAULT_ADDR),
+                                      size=int(cfg.get('pool_size', 8)),
+                                      timeout=cfg.get('timeout', 30),
+                                      acquire_timeout=cfg.get('pool_timeout', 30))
+            logger.info(f"Created IPFS client pool, size={_client_pool._size}")
+            if _client_pool._size < int(cfg.get('max_concurrency', 8)):
+                logger.warning("IPFS pool_size is smaller than max_concurrency, fetch threads wait for clients")
+    return _client_pool
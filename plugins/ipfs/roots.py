@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+
+import logging
+import sqlite3
+import threading
+import datetime
+from pathlib import Path
+
+from core import config
+
+logger = logging.getLogger('app')
+
+
+class RootStoreException(Exception): pass
+class RootStoreConflictError(RootStoreException): pass
+
+
+class RootStore():
+    """ Versioned pointer to the current root CID.
+        Every update adds a row, so earlier roots are kept as history.
+        Updates are a compare-and-swap on the version, a writer that worked
+        on an outdated root gets a RootStoreConflictError instead of silently
+        overwriting the other writer's root. """
+    def __init__(self, path):
+        self._path = str(path)
+        self._local = threading.local()
+
+        with self._connection() as conn:
+            conn.execute("""CREATE TABLE IF NOT EXISTS roots (
+                                version INTEGER PRIMARY KEY,
+                                cid TEXT NOT NULL,
+                                date_created TEXT NOT NULL)""")
+
+    def _connection(self):
+        """ Connections can't be shared between threads, every thread gets its own """
+        conn = getattr(self._local, 'conn', None)
+        if conn == None:
+            conn = sqlite3.connect(self._path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            # fsync on every commit, losing a root means losing comments
+            conn.execute("PRAGMA synchronous=FULL")
+            self._local.conn = conn
+        return conn
+
+    def get(self):
+        """ Return (version, cid) of the current root, (0, '') when there is none """
+        row = self._connection().execute("SELECT version, cid FROM roots ORDER BY version DESC LIMIT 1").fetchone()
+        if row == None:
+            return 0, ''
+        return row
+
+    def compare_and_swap(self, version, cid):
+        """ Publish cid as the new root if version is still the current version.
+            Returns the new version """
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            current, current_cid = self.get()
+            if current != version:
+                raise RootStoreConflictError(f"Root changed, expected version={version}, found version={current}")
+
+            conn.execute("INSERT INTO roots (version, cid, date_created) VALUES (?, ?, ?)",
+                         (version + 1, cid, str(datetime.datetime.utcnow())))
+            conn.execute("COMMIT")
+        except:
+            conn.execute("ROLLBACK")
+            raise
+
+        logger.debug(f"Published root: version={version + 1}, cid={cid}")
+        return version + 1
+
+    def history(self, limit=10):
+        """ Return list of (version, cid, date_created), newest first """
+        return self._connection().execute("SELECT version, cid, date_created FROM roots ORDER BY version DESC LIMIT ?",
+                                          (limit,)).fetchall()
+
+
+_root_store = None
+_root_store_lock = threading.Lock()
+
+def get_root_store():
+    """ Return the process wide root store, create it on first use.
+        A new store starts from the root_cid in the config file """
+    global _root_store
+    with _root_store_lock:
+        if _root_store == None:
+            cfg = config['plugins']['ipfs']
+            path = cfg.get('root_store_path') or Path(config['sqlite']['path']).parent / 'roots.sqlite'
+            _root_store = RootStore(path)
+
+            version, cid = _root_store.get()
+            if version == 0 and cfg.get('root_cid'):
+                _root_store.compare_and_swap(0, cfg['root_cid'])
+                logger.info(f"Imported root from config file: {cfg['root_cid']}")
+    return _root_store
@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+
+import logging
+
+logger = logging.getLogger('app')
+
+
+def build_threads(comments, max_depth=10, max_children=100):
+    """ Build the reply forest from a flat list of comments in one pass.
+        comments are dicts with 'cid' and 'reply_to', replies end up in 'replies'.
+        A reply to a comment that isn't in the list before it is shown as a top level comment.
+        Replies deeper than max_depth, or beyond max_children of one comment,
+        are left out and counted in 'more_replies'.
+        A client can compute the CID of a comment before posting it, so a reply to a later
+        comment is possible, it's also shown as a top level comment so there can't be any cycles. """
+    by_cid = {}
+    threads = []
+
+    for comment in comments:
+        node = dict(comment, replies=[], more_replies=0)
+        by_cid.setdefault(comment['cid'], node)
+
+        parent = by_cid.get(comment.get('reply_to'))
+        if parent == None or parent is node:
+            threads.append(node)
+        else:
+            parent['replies'].append(node)
+
+    # prune top down, every node is visited at most once
+    stack = [(node, 1) for node in threads]
+    while stack:
+        node, depth = stack.pop()
+        if depth >= max_depth:
+            node['more_replies'] += len(node['replies'])
+            node['replies'] = []
+        elif len(node['replies']) > max_children:
+            node['more_replies'] += len(node['replies']) - max_children
+            node['replies'] = node['replies'][:max_children]
+        stack += [(reply, depth + 1) for reply in node['replies']]
+
+    return threads
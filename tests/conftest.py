@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+
+import pytest
+
+
+@pytest.fixture(scope='session')
+def app(tmp_path_factory):
+    """ The app with its config file, database, root store and memory block store in a temporary directory.
+        Passwords are hashed on the calling thread, tests that need the pool create one """
+    from core import app, config, create_app, init_database
+
+    path = tmp_path_factory.mktemp('app')
+    config.set_path(path / 'config.yml')
+    config['sqlite']['path'] = str(path / 'db.sqlite')
+    config['core']['hash_workers'] = 0
+    config['core']['profiling_dir'] = str(path / 'profiles')
+    config['plugins']['ipfs']['root_store_path'] = str(path / 'roots.sqlite')
+    config['plugins']['ipfs']['blockstore'] = 'memory'
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{config['sqlite']['path']}"
+
+    create_app()
+    init_database()
+    return app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+@pytest.fixture
+def publish(app):
+    """ Import comment records into the block store of the app and make their tree the root """
+    from plugins.ipfs.blockstore import get_block_store
+    from plugins.ipfs.importer import BulkImporter
+    from plugins.ipfs.roots import get_root_store
+
+    def publish(records):
+        root = BulkImporter(get_block_store()).import_records(records)
+        root_store = get_root_store()
+        root_store.compare_and_swap(root_store.get()[0], root.cid)
+        return root.cid
+    return publish
+
+@pytest.fixture
+def admin_headers(app, client):
+    """ Authorization header of the admin user """
+    from core import config
+
+    admin = config['core']['admin']
+    r = client.post('/v0.1/auth', json={'username': admin['username'], 'password': admin['password']})
+    return {'Authorization': f"Bearer {r.json['payload']['access_token']}"}
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+
+import pytest
+
+from plugins.ipfs import codec
+from plugins.ipfs.blockstore import (MemoryBlockStore, FlatFSBlockStore, OverlayBlockStore,
+                                     BlockNotFoundError, BlockStoreException)
+
+# UnixFS empty directory, the daemon stores it as: blocks/X3/CIQFTFEEHEDF6KLBT32BFAGLXEZL4UWFNWM4LFTLMXQBCERZ6CMLX3Y.data
+EMPTY_DIR = bytes.fromhex('0a020801')
+EMPTY_DIR_V0 = 'QmUNLLsPACCz1vLxQVkXqqLX5R1X345qqfHbsf67hvA3Nn'
+EMPTY_DIR_KEY = 'CIQFTFEEHEDF6KLBT32BFAGLXEZL4UWFNWM4LFTLMXQBCERZ6CMLX3Y'
+
+
+@pytest.fixture(params=['memory', 'flatfs'])
+def store(request, tmp_path):
+    if request.param == 'memory':
+        return MemoryBlockStore()
+    return FlatFSBlockStore(tmp_path / 'blocks')
+
+def test_put_get_has(store):
+    data = codec.encode({"content": "block"})
+    cid = store.put(data, 'dag-cbor')
+
+    assert cid == codec.make_cid(data, codec.CODECS['dag-cbor'])
+    assert store.has(cid)
+    assert store.get(cid) == data
+    # same block, same CID
+    assert store.put(data, 'dag-cbor') == cid
+
+def test_missing_block(store):
+    cid = codec.make_cid(b"missing", codec.CODECS['dag-cbor'])
+    assert not store.has(cid)
+    with pytest.raises(BlockNotFoundError):
+        store.get(cid)
+
+def test_get_many_keeps_order(store):
+    cids = store.put_many([(codec.encode({"n": i}), 'dag-cbor') for i in range(5)])
+    assert store.get_many(cids[::-1]) == [codec.encode({"n": i}) for i in reversed(range(5))]
+
+def test_cid_v0_finds_dag_pb_block(store):
+    cid = store.put(EMPTY_DIR, 'dag-pb')
+    assert codec.cid_v1(EMPTY_DIR_V0) == cid
+    assert store.has(EMPTY_DIR_V0)
+    assert store.get(EMPTY_DIR_V0) == EMPTY_DIR
+
+def test_cant_resolve(store):
+    assert not store.can_resolve
+    with pytest.raises(BlockStoreException):
+        store.resolve(f"{EMPTY_DIR_V0}/sites")
+
+def test_flatfs_layout(tmp_path):
+    store = FlatFSBlockStore(tmp_path)
+    cid = store.put(EMPTY_DIR, 'dag-pb')
+
+    # next-to-last/2 sharding on the base32 multihash, like the daemon's blocks directory
+    path = tmp_path / 'X3' / f"{EMPTY_DIR_KEY}.data"
+    assert store.block_path(cid) == store.block_path(EMPTY_DIR_V0) == path
+    assert path.read_bytes() == EMPTY_DIR
+    assert list(tmp_path.glob('*/*.tmp')) == []
+
+def test_flatfs_reopen(tmp_path):
+    cid = FlatFSBlockStore(tmp_path).put(b"kept", 'raw')
+    assert FlatFSBlockStore(tmp_path).get(cid) == b"kept"
+
+def test_overlay():
+    overlay, store = MemoryBlockStore(), MemoryBlockStore()
+    in_overlay = overlay.put(b"overlay", 'raw')
+    in_store = store.put(b"store", 'raw')
+    blocks = OverlayBlockStore(overlay, store)
+
+    assert blocks.get(in_overlay) == b"overlay" and blocks.get(in_store) == b"store"
+    assert blocks.has(in_overlay) and blocks.has(in_store)
+
+    # writes never go to the overlay
+    cid = blocks.put(b"new", 'raw')
+    assert store.has(cid) and not overlay.has(cid)
+    with pytest.raises(BlockNotFoundError):
+        blocks.get(codec.make_cid(b"missing", codec.RAW))
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+
+from plugins.ipfs import codec
+from plugins.ipfs.blockstore import MemoryBlockStore
+from plugins.ipfs.cache import BlockCache, get_block_cache
+from plugins.ipfs.models import RootNode
+
+
+def test_hit_and_miss():
+    cache = BlockCache(100)
+    assert cache.get("a") == None
+    cache.put("a", {"x": 1}, size=10)
+    assert cache.get("a") == {"x": 1}
+    assert (cache.hits, cache.misses) == (1, 1)
+
+def test_evicts_least_recently_used_by_bytes():
+    cache = BlockCache(100)
+    cache.put("a", "a", size=40)
+    cache.put("b", "b", size=40)
+    # a is used after b, so b is evicted first
+    cache.get("a")
+    cache.put("c", "c", size=40)
+
+    assert "b" not in cache
+    assert "a" in cache and "c" in cache
+    assert cache.size == 80
+    assert cache.evictions == 1
+
+def test_evicts_until_under_budget():
+    cache = BlockCache(100)
+    for key in "abcd":
+        cache.put(key, key, size=25)
+    cache.put("big", "big", size=90)
+
+    assert list(cache._blocks) == ["big"]
+    assert cache.size == 90
+    assert cache.evictions == 4
+
+def test_block_larger_than_budget_is_not_cached():
+    cache = BlockCache(100)
+    cache.put("a", "a", size=50)
+    cache.put("huge", "huge", size=101)
+    assert "huge" not in cache
+    assert "a" in cache
+    assert cache.evictions == 0
+
+def test_put_existing_cid_counts_once():
+    cache = BlockCache(100)
+    cache.put("a", "a", size=40)
+    cache.put("a", "a", size=40)
+    assert cache.size == 40
+    assert len(cache) == 1
+
+def test_default_size_is_json_length():
+    cache = BlockCache(100)
+    cache.put("a", {"x": 1})
+    assert cache.size == len('{"x": 1}')
+
+def test_clear():
+    cache = BlockCache(100)
+    cache.put("a", "a", size=40)
+    cache.clear()
+    assert len(cache) == 0 and cache.size == 0
+
+def test_get_dag_reads_through_cache():
+    store = MemoryBlockStore()
+    data = codec.encode({"Name": "cached"})
+    cid = store.put(data, 'dag-cbor')
+    node = RootNode(store, "root")
+
+    cache = get_block_cache()
+    cache.clear()
+    assert node.get_dag(cid) == {"Name": "cached"}
+    assert cid in cache
+
+    # a cached block is served without the store
+    store._blocks.clear()
+    assert node.get_dag(cid) == {"Name": "cached"}
+    assert cache.size == len(data)
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+
+import hashlib
+
+import pytest
+
+from plugins.ipfs import codec
+from plugins.ipfs.bench import generate_records
+from plugins.ipfs.blockstore import MemoryBlockStore, FlatFSBlockStore, BlockNotFoundError, ReadOnlyError
+from plugins.ipfs.car import CarReader, CarWriter, CarException, export_car, import_car
+from plugins.ipfs.importer import BulkImporter
+from plugins.ipfs.models import RootNode, load_tree
+
+# UnixFS empty directory, PBNode {Data: {Type: Directory}}
+EMPTY_DIR = bytes.fromhex('0a020801')
+EMPTY_DIR_V0 = 'QmUNLLsPACCz1vLxQVkXqqLX5R1X345qqfHbsf67hvA3Nn'
+
+
+def cid_v0(data):
+    return codec.base58_encode(bytes([codec.SHA2_256, 32]) + hashlib.sha256(data).digest())
+
+def pb_field(field, value):
+    return codec.varint_encode(field << 3 | 2) + codec.varint_encode(len(value)) + value
+
+def pb_link(cid, name, size):
+    return (pb_field(1, codec.cid_to_bytes(cid)) + pb_field(2, name.encode())
+            + codec.varint_encode(3 << 3) + codec.varint_encode(size))
+
+def directory_block(raw_cid):
+    """ UnixFS directory with a file and an empty directory, links come before data """
+    return (pb_field(2, pb_link(raw_cid, "hello.txt", 5)) + pb_field(2, pb_link(EMPTY_DIR_V0, "empty", 4))
+            + pb_field(1, bytes.fromhex('0801')))
+
+def write_car(path, store, root_cid):
+    with open(path, 'wb') as f:
+        return export_car(RootNode(store, "root"), f, root_cid)
+
+@pytest.fixture
+def tree():
+    store = MemoryBlockStore()
+    root = BulkImporter(store).import_records(generate_records(2, 2, 3, 40))
+    return store, root.cid
+
+def test_dag_pb_links():
+    raw_cid = codec.make_cid(b'hello', codec.RAW)
+    directory = directory_block(raw_cid)
+    assert codec.dag_pb_links(directory) == [raw_cid, EMPTY_DIR_V0]
+    assert cid_v0(EMPTY_DIR) == EMPTY_DIR_V0
+    assert codec.dag_pb_links(EMPTY_DIR) == []
+
+def test_block_links():
+    assert codec.block_links(b'\x00anything', codec.RAW) == []
+    assert codec.block_links(codec.encode({"a": {'/': EMPTY_DIR_V0}}), codec.DAG_CBOR) == [EMPTY_DIR_V0]
+    with pytest.raises(codec.CodecError):
+        codec.dag_pb_links(bytes([0x0d, 0, 0, 0, 0]))
+
+def test_write_read(tmp_path):
+    blocks = [codec.encode({"n": i}) for i in range(5)]
+    cids = [codec.make_cid(data, codec.DAG_CBOR) for data in blocks]
+    with open(tmp_path / 'test.car', 'wb') as f:
+        writer = CarWriter(f, cids[:1])
+        for cid, data in zip(cids, blocks):
+            writer.write_block(cid, data)
+    assert writer.blocks == 5
+
+    reader = CarReader(tmp_path / 'test.car')
+    assert reader.roots == cids[:1]
+    assert reader.cids() == cids
+    assert [bytes(reader.get(cid)) for cid in cids] == blocks
+    assert reader.has(cids[0]) and not reader.has(EMPTY_DIR_V0)
+    with pytest.raises(BlockNotFoundError):
+        reader.get(EMPTY_DIR_V0)
+    with pytest.raises(ReadOnlyError):
+        reader.put(blocks[0], 'dag-cbor')
+    reader.close()
+
+def test_unsupported_version(tmp_path):
+    header = codec.encode({"roots": [], "version": 2})
+    (tmp_path / 'v2.car').write_bytes(codec.varint_encode(len(header)) + header)
+    with pytest.raises(CarException):
+        CarReader(tmp_path / 'v2.car')
+
+def test_export_import_round_trip(tmp_path, tree):
+    store, root_cid = tree
+    assert write_car(tmp_path / 'tree.car', store, root_cid) == len(store)
+
+    reader = CarReader(tmp_path / 'tree.car')
+    assert reader.roots == [root_cid]
+    copy = MemoryBlockStore()
+    assert import_car(reader, copy) == len(store)
+    assert copy._blocks == store._blocks
+
+    record = next(generate_records(2, 2, 3, 1))
+    post = (record['site_id'], record['blog_id'], record['post_id'])
+    original = [c.serialize() for c in load_tree(store, root_cid).get_comments(*post)]
+    assert [c.serialize() for c in load_tree(reader, root_cid).get_comments(*post)] == original
+    reader.close()
+
+def files_tree():
+    """ dag-cbor root that links a UnixFS directory with a raw file and an empty directory """
+    store = MemoryBlockStore()
+    raw_cid = store.put(b'hello', 'raw')
+    directory = directory_block(raw_cid)
+    store.put(EMPTY_DIR, 'dag-pb')
+    store.put(directory, 'dag-pb')
+    directory_cid = cid_v0(directory)
+    root_cid = store.put(codec.encode({"Name": "root", "files": {'/': directory_cid}}), 'dag-cbor')
+    return store, root_cid, directory_cid, raw_cid, directory
+
+def test_export_follows_dag_pb_links(tmp_path):
+    store, root_cid, directory_cid, raw_cid, directory = files_tree()
+
+    assert write_car(tmp_path / 'files.car', store, root_cid) == 4
+    reader = CarReader(tmp_path / 'files.car')
+    assert sorted(reader.cids()) == sorted([root_cid, directory_cid, raw_cid, EMPTY_DIR_V0])
+    assert bytes(reader.get(directory_cid)) == directory
+    assert bytes(reader.get(raw_cid)) == b'hello'
+    reader.close()
+
+@pytest.mark.parametrize('store_class', ['memory', 'flatfs'])
+def test_dag_pb_round_trip(tmp_path, store_class):
+    store, root_cid, directory_cid, raw_cid, directory = files_tree()
+    write_car(tmp_path / 'files.car', store, root_cid)
+
+    reader = CarReader(tmp_path / 'files.car')
+    copy = MemoryBlockStore() if store_class == 'memory' else FlatFSBlockStore(tmp_path / 'blocks')
+    assert import_car(reader, copy) == 4
+    reader.close()
+
+    # dag-pb blocks are found by their CIDv0
+    assert copy.has(directory_cid) and copy.has(EMPTY_DIR_V0)
+    assert bytes(copy.get(directory_cid)) == directory
+
+    write_car(tmp_path / 'again.car', copy, root_cid)
+    assert (tmp_path / 'again.car').read_bytes() == (tmp_path / 'files.car').read_bytes()
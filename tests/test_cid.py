@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+
+import pytest
+
+from plugins.ipfs import codec
+from plugins.ipfs.bench import generate_records
+from plugins.ipfs.blockstore import get_block_store
+from plugins.ipfs.models import load_tree
+
+
+@pytest.fixture
+def tree(publish):
+    records = list(generate_records(1, 1, 1, 5))
+    root = load_tree(get_block_store(), publish(records), lazy=True)
+    r = records[0]
+    post = root.find_post(r['site_id'], r['blog_id'], r['post_id'])
+    return root, post, records
+
+def test_comments_by_cid(client, tree):
+    root, post, records = tree
+    r = client.get(f'/v0.1/cid/{post.cid}/comments')
+    assert r.status_code == 200
+    assert [c['content'] for c in r.json['payload']] == [record['content'] for record in records]
+    assert 'time' not in r.json
+    assert r.get_etag() == (post.cid, False)
+    assert 'immutable' in r.headers['Cache-Control']
+
+    # the same CID always gives the same body
+    assert client.get(f'/v0.1/cid/{post.cid}/comments').data == r.data
+
+def test_node_by_cid(client, tree):
+    root, post, _ = tree
+    r = client.get(f'/v0.1/cid/{root.cid}')
+    assert r.status_code == 200
+    assert 'sites' in r.json['payload']
+
+    comment = post.comments[0]
+    r = client.get(f'/v0.1/cid/{comment.cid}')
+    assert r.json['payload']['content'] == comment.content
+
+@pytest.mark.parametrize('path', ['/v0.1/cid/{cid}', '/v0.1/cid/{cid}/comments'])
+def test_not_modified(client, tree, path):
+    _, post, _ = tree
+    url = path.format(cid=post.cid)
+    etag = client.get(url).headers['ETag']
+    r = client.get(url, headers={'If-None-Match': etag})
+    assert r.status_code == 304
+    assert 'immutable' in r.headers['Cache-Control']
+
+def test_unknown_cid(client, tree):
+    missing = codec.make_cid(codec.encode({"Name": "missing"}), codec.CODECS['dag-cbor'])
+    assert client.get(f'/v0.1/cid/{missing}').status_code == 404
+    assert client.get(f'/v0.1/cid/{missing}/comments').status_code == 404
+
+def test_cid_outside_the_tree(client, tree):
+    # the daemon is never asked for blocks in other codecs, eg: files
+    assert client.get('/v0.1/cid/QmUNLLsPACCz1vLxQVkXqqLX5R1X345qqfHbsf67hvA3Nn').status_code == 404
+
+def test_invalid_cid(client, tree):
+    assert client.get('/v0.1/cid/not-a-cid').status_code == 400
+
+def test_comments_of_a_comment(client, tree):
+    _, post, _ = tree
+    assert client.get(f'/v0.1/cid/{post.comments[0].cid}/comments').status_code == 404
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+
+import pytest
+
+from plugins.ipfs import codec
+
+
+EMPTY_MAP_CBOR = 'bafyreigbtj4x7ip5legnfznufuopl4sg4knzc2cof6duas4b3q2fy6swua'
+EMPTY_MAP_JSON = 'baguqeeraiqjw7i2vwntyuekgvulpp2det2kpwt6cd7tx5ayqybqpmhfk76fa'
+EMPTY_RAW = 'bafkreihdwdcefgh4dqkjv67uzcmw7ojee6xedzdetojuzjevtenxquvyku'
+EMPTY_DIR_V0 = 'QmUNLLsPACCz1vLxQVkXqqLX5R1X345qqfHbsf67hvA3Nn'
+
+
+def test_known_cids():
+    assert codec.make_cid(codec.encode({}), codec.DAG_CBOR) == EMPTY_MAP_CBOR
+    assert codec.make_cid(codec.encode({}, codec.DAG_JSON), codec.DAG_JSON) == EMPTY_MAP_JSON
+    assert codec.make_cid(b'', codec.RAW) == EMPTY_RAW
+
+def test_cid_codec():
+    assert codec.cid_codec(EMPTY_MAP_CBOR) == codec.DAG_CBOR
+    assert codec.cid_codec(EMPTY_MAP_JSON) == codec.DAG_JSON
+    assert codec.cid_codec(EMPTY_RAW) == codec.RAW
+    assert codec.cid_codec(EMPTY_DIR_V0) == codec.DAG_PB
+
+@pytest.mark.parametrize('cid', [EMPTY_MAP_CBOR, EMPTY_MAP_JSON, EMPTY_RAW, EMPTY_DIR_V0])
+def test_cid_bytes_round_trip(cid):
+    assert codec.cid_from_bytes(codec.cid_to_bytes(cid)) == cid
+
+def test_base58_cidv1():
+    data = codec.cid_to_bytes(EMPTY_MAP_CBOR)
+    assert codec.cid_to_bytes('z' + codec.base58_encode(data)) == data
+
+def test_cid_digest():
+    digest = codec.cid_digest(EMPTY_RAW)
+    assert digest[:2] == bytes([codec.SHA2_256, 32])
+    assert digest[2:].hex() == 'e3b0c44298fc1c149afbf4c8996fb92427ae41e4649b934ca495991b7852b855'
+
+def test_unsupported_cid_encoding():
+    with pytest.raises(codec.CodecError):
+        codec.cid_to_bytes('mAXESIA')
+
+@pytest.mark.parametrize('n', [0, 1, 127, 128, 300, 2**32, 2**63])
+def test_varint_round_trip(n):
+    encoded = codec.varint_encode(n)
+    assert codec.varint_decode(encoded) == (n, len(encoded))
+
+def test_varint_truncated():
+    with pytest.raises(codec.CodecError):
+        codec.varint_decode(b'\x80')
+
+@pytest.mark.parametrize('obj, encoded', [
+    (0, '00'),
+    (23, '17'),
+    (24, '1818'),
+    (1000000, '1a000f4240'),
+    (-1000, '3903e7'),
+    (1.1, 'fb3ff199999999999a'),
+    ('IETF', '6449455446'),
+    ([1, [2, 3], [4, 5]], '8301820203820405'),
+    ({'a': 1, 'b': [2, 3]}, 'a26161016162820203'),
+    (None, 'f6'),
+    (True, 'f5'),
+])
+def test_cbor_known_encodings(obj, encoded):
+    assert codec.encode(obj).hex() == encoded
+    assert codec.decode(bytes.fromhex(encoded)) == obj
+
+def test_cbor_map_key_order():
+    # length first, then bytewise
+    assert list(codec.decode(codec.encode({'bb': 1, 'a': 2, 'ab': 3}))) == ['a', 'ab', 'bb']
+
+def test_cbor_link():
+    encoded = codec.encode({'/': EMPTY_MAP_CBOR})
+    assert encoded[:2] == bytes([0xd8, 42])
+    assert codec.decode(encoded) == {'/': EMPTY_MAP_CBOR}
+
+@pytest.mark.parametrize('block_codec', [codec.DAG_CBOR, codec.DAG_JSON])
+def test_round_trip(block_codec):
+    block = {"Name"     : "post_1",
+             "count"    : 2,
+             "score"    : -0.5,
+             "comments" : [{"Name": "c", "c": {'/': EMPTY_MAP_CBOR}}],
+             "next"     : None,
+             "unicode"  : "reactie éè \U0001f600"}
+    assert codec.decode(codec.encode(block, block_codec), block_codec) == block
+
+def test_links():
+    block = {"a": {'/': EMPTY_MAP_CBOR}, "b": [{'/': EMPTY_RAW}, {"c": {'/': EMPTY_MAP_JSON}}]}
+    assert sorted(codec.links(block)) == sorted([EMPTY_MAP_CBOR, EMPTY_RAW, EMPTY_MAP_JSON])
+
+@pytest.mark.parametrize('value', [float('nan'), float('inf'), float('-inf')])
+@pytest.mark.parametrize('block_codec', [codec.DAG_CBOR, codec.DAG_JSON])
+def test_non_finite_floats(value, block_codec):
+    with pytest.raises(ValueError):
+        codec.encode({"x": value}, block_codec)
+
+def test_non_string_keys():
+    with pytest.raises(codec.CodecError):
+        codec.encode({1: 'a'})
+
+def test_trailing_data():
+    with pytest.raises(codec.CodecError):
+        codec.decode(codec.encode({}) + b'\x00')
+
+def test_indefinite_length():
+    with pytest.raises(codec.CodecError):
+        codec.decode(bytes([0x9f, 0x01, 0xff]))
+
+def test_half_float():
+    assert codec.decode(bytes.fromhex('f93e00')) == 1.5
+
+def test_cid_v1():
+    v1 = codec.cid_v1(EMPTY_DIR_V0)
+    assert v1.startswith('bafybei')
+    assert codec.cid_codec(v1) == codec.DAG_PB
+    assert codec.cid_digest(v1) == codec.cid_digest(EMPTY_DIR_V0)
+    assert codec.cid_v1(EMPTY_MAP_CBOR) == EMPTY_MAP_CBOR
+    assert codec.cid_v1('z' + codec.base58_encode(codec.cid_to_bytes(EMPTY_RAW))) == EMPTY_RAW
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+
+import pytest
+
+from plugins.ipfs.bench import generate_records
+from plugins.ipfs.codec import CodecError
+from plugins.ipfs.blockstore import MemoryBlockStore
+from plugins.ipfs.commit import CommitQueue
+from plugins.ipfs.importer import BulkImporter
+from plugins.ipfs.models import load_tree
+from plugins.ipfs.roots import RootStore, RootStoreConflictError
+from plugins.ipfs import __main__ as cli
+
+
+def comment(content):
+    return {"name": "c", "author": "a", "datetime": "", "reply_to": None, "content": content}
+
+class RacingRootStore(RootStore):
+    """ Another writer publishes a root right before each of the first `races` swaps """
+    def __init__(self, path, store, races):
+        super().__init__(path)
+        self._store = store
+        self.races = races
+
+    def compare_and_swap(self, version, cid):
+        if self.races > 0:
+            self.races -= 1
+            current_version, current = self.get()
+            other = BulkImporter(self._store, root_cid=current).import_records([dict(first_record(), content="other")])
+            super().compare_and_swap(current_version, other.cid)
+        return super().compare_and_swap(version, cid)
+
+def first_record():
+    return next(generate_records(1, 1, 2, 1))
+
+def post_of(record):
+    return record['site_id'], record['blog_id'], record['post_id']
+
+def racing_queue(tmp_path, races, retries=5):
+    store = MemoryBlockStore()
+    root = BulkImporter(store).import_records(generate_records(1, 1, 2, 4))
+    root_store = RacingRootStore(tmp_path / 'roots.sqlite', store, races)
+    RootStore.compare_and_swap(root_store, 0, root.cid)
+    return CommitQueue(window=0, retries=retries, store=store, root_store=root_store)
+
+@pytest.fixture
+def queue(tmp_path):
+    store = MemoryBlockStore()
+    root = BulkImporter(store).import_records(generate_records(1, 1, 2, 4))
+    root_store = RootStore(tmp_path / 'roots.sqlite')
+    root_store.compare_and_swap(0, root.cid)
+    return CommitQueue(window=0.5, store=store, root_store=root_store)
+
+def test_close_commits_queued_comments(queue):
+    record = next(generate_records(1, 1, 2, 1))
+    post = (record['site_id'], record['blog_id'], record['post_id'])
+    futures = [queue.submit(*post, comment(f"c{i}")) for i in range(3)]
+    queue.close()
+
+    assert all(f.done() for f in futures)
+    assert not queue._thread.is_alive()
+
+    root = load_tree(queue._store, queue._root_store.get()[1])
+    contents = [c.content for c in root.get_comments(*post)]
+    assert contents[-3:] == ["c0", "c1", "c2"]
+
+def test_submit_after_close(queue):
+    queue.close()
+    with pytest.raises(RuntimeError):
+        queue.submit("site", "blog", "post", comment("late"))
+
+def test_close_without_thread(queue):
+    queue.close()
+    queue.close()
+    assert queue._thread == None
+
+@pytest.mark.parametrize('bad', [dict(comment("no name"), name=None), comment("\ud800")])
+def test_bad_comment_fails_alone(queue, bad):
+    record = next(generate_records(1, 1, 2, 1))
+    post = (record['site_id'], record['blog_id'], record['post_id'])
+    good = queue.submit(*post, comment("good"))
+    failed = queue.submit(*post, bad)
+
+    assert good.result(timeout=5).content == "good"
+    with pytest.raises((CodecError, UnicodeError)):
+        failed.result(timeout=5)
+    queue.close()
+
+def test_compare_and_swap(tmp_path):
+    root_store = RootStore(tmp_path / 'roots.sqlite')
+    assert root_store.get() == (0, '')
+    assert root_store.compare_and_swap(0, "a") == 1
+    assert root_store.compare_and_swap(1, "b") == 2
+
+    with pytest.raises(RootStoreConflictError):
+        root_store.compare_and_swap(1, "stale")
+    assert root_store.get() == (2, "b")
+    assert [cid for _, cid, _ in root_store.history()] == ["b", "a"]
+
+def test_commit_retries_on_conflict(tmp_path):
+    queue = racing_queue(tmp_path, races=2)
+    future = queue.submit(*post_of(first_record()), comment("mine"))
+    assert future.result(timeout=5).content == "mine"
+    queue.close()
+
+    # the batch is applied again on top of the other writer's roots, nothing is lost
+    version, root_cid = queue._root_store.get()
+    contents = [c.content for c in load_tree(queue._store, root_cid).get_comments(*post_of(first_record()))]
+    assert version == 4
+    assert contents.count("other") == 2 and contents[-1] == "mine"
+
+def test_commit_gives_up_after_retries(tmp_path):
+    queue = racing_queue(tmp_path, races=3, retries=3)
+    future = queue.submit(*post_of(first_record()), comment("mine"))
+    with pytest.raises(RootStoreConflictError):
+        future.result(timeout=5)
+    queue.close()
+
+def test_cli_import_reports_conflict(tmp_path, monkeypatch, capsys):
+    store = MemoryBlockStore()
+    root_store = RacingRootStore(tmp_path / 'roots.sqlite', store, races=1)
+    monkeypatch.setattr(cli, 'get_block_store', lambda: store)
+    monkeypatch.setattr(cli, 'get_root_store', lambda: root_store)
+
+    dump = tmp_path / 'dump.ndjson'
+    dump.write_text(json.dumps(dict(first_record(), content="imported")) + "\n")
+    args = argparse.Namespace(file=str(dump), new=False, batch_size=10)
+
+    assert cli.import_comments(args) == 1
+    assert "Root changed while running, not published" in capsys.readouterr().out
+    assert root_store.get()[0] == 1
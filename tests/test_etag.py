@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+
+import pytest
+
+from core import config
+from plugins.ipfs.bench import generate_records
+
+URL = '/v0.1/sites/site_0/blogs/blog_0/posts/post_0/comments'
+
+
+@pytest.fixture(autouse=True)
+def tree(publish):
+    publish(generate_records(1, 1, 1, 5))
+
+@pytest.fixture
+def stable(monkeypatch):
+    monkeypatch.setitem(config['core'], 'stable_responses', True)
+
+def test_weak_etag_with_timestamp(client):
+    r = client.get(URL)
+    assert r.status_code == 200
+    assert 'time' in r.json
+    etag, weak = r.get_etag()
+    assert weak and etag.startswith('bafy')
+
+def test_strong_etag_for_stable_body(client, stable):
+    r = client.get(URL)
+    assert 'time' not in r.json
+    assert r.get_etag()[1] == False
+    assert client.get(URL).data == r.data
+
+@pytest.mark.parametrize('use_stable', [False, True])
+def test_not_modified(client, request, use_stable):
+    if use_stable:
+        request.getfixturevalue('stable')
+    etag = client.get(URL).headers['ETag']
+    r = client.get(URL, headers={'If-None-Match': etag})
+    assert r.status_code == 304
+    assert r.headers['ETag'] == etag
+
+def test_weak_and_strong_match(client):
+    etag, weak = client.get(URL).get_etag()
+    assert client.get(URL, headers={'If-None-Match': f'"{etag}"'}).status_code == 304
+    assert client.get(URL, headers={'If-None-Match': f'W/"{etag}"'}).status_code == 304
+    assert client.get(URL, headers={'If-None-Match': '"other"'}).status_code == 200
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+
+import random
+import threading
+import time
+
+import pytest
+
+from core import config
+from plugins.ipfs import codec
+from plugins.ipfs import models
+from plugins.ipfs.bench import generate_records
+from plugins.ipfs.blockstore import MemoryBlockStore, BlockNotFoundError
+from plugins.ipfs.cache import get_block_cache
+from plugins.ipfs.importer import BulkImporter
+from plugins.ipfs.models import RootNode, load_tree
+
+
+class SlowStore(MemoryBlockStore):
+    """ Gets take a random few milliseconds and count how many run at the same time """
+    def __init__(self):
+        super().__init__()
+        self.running = 0
+        self.max_running = 0
+        self.gets = 0
+        self._count_lock = threading.Lock()
+
+    def get(self, cid):
+        with self._count_lock:
+            self.running += 1
+            self.gets += 1
+            self.max_running = max(self.max_running, self.running)
+        try:
+            time.sleep(random.uniform(0.001, 0.01))
+            return super().get(cid)
+        finally:
+            with self._count_lock:
+                self.running -= 1
+
+@pytest.fixture
+def executor(monkeypatch):
+    """ A fetch pool of 3 workers for this test only """
+    monkeypatch.setitem(config['plugins']['ipfs'], 'max_concurrency', 3)
+    monkeypatch.setattr(models, '_executor', None)
+    get_block_cache().clear()
+    yield
+    models.get_executor().shutdown()
+
+@pytest.fixture
+def store():
+    store = SlowStore()
+    store.cids = [store.put(codec.encode({"n": i}), 'dag-cbor') for i in range(20)]
+    return store
+
+def test_get_dags_keeps_order(executor, store):
+    blocks = RootNode(store, "root").get_dags(store.cids[::-1])
+    assert [b["n"] for b in blocks] == list(reversed(range(20)))
+
+def test_concurrency_is_bounded(executor, store):
+    RootNode(store, "root").get_dags(store.cids)
+    assert 1 < store.max_running <= 3
+
+def test_failed_block_waits_for_the_others(executor, store):
+    missing = codec.make_cid(b"missing", codec.CODECS['dag-cbor'])
+    with pytest.raises(BlockNotFoundError):
+        RootNode(store, "root").get_dags(store.cids[:10] + [missing] + store.cids[10:])
+    # every fetch finished before the error was raised, none is left running
+    assert store.running == 0 and store.gets == 21
+
+def test_full_load_reads_children_in_order(executor):
+    store = SlowStore()
+    records = list(generate_records(2, 3, 4, 40))
+    cid = BulkImporter(store).import_records(records).cid
+    get_block_cache().clear()
+
+    def contents(root):
+        return [(s.name, b.name, p.name, [c.content for c in p.comments]) for s in root.sites for b in s.blogs for p in b.posts]
+
+    loaded = contents(load_tree(store, cid))
+    assert store.max_running > 1
+    # a lazy tree reads the same children one at a time
+    assert loaded == contents(load_tree(store, cid, lazy=True))
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+
+import pytest
+
+from core import config
+from plugins.ipfs import codec
+from plugins.ipfs.blockstore import MemoryBlockStore
+from plugins.ipfs.hamt import LinkMap, bucket_key
+from plugins.ipfs.models import RootNode
+
+
+def cid(i):
+    return codec.make_cid(codec.encode({"i": i}), codec.DAG_CBOR)
+
+@pytest.fixture
+def node():
+    return RootNode(MemoryBlockStore(), "root")
+
+@pytest.fixture(autouse=True)
+def threshold(monkeypatch):
+    monkeypatch.setitem(config['plugins']['ipfs'], 'shard_threshold', 4)
+
+def test_small_map_is_inline(node):
+    links = LinkMap(node)
+    for i in range(4):
+        links.set(f"n{i}", cid(i))
+    assert links.serialize() == {f"n{i}": {'/': cid(i)} for i in range(4)}
+    assert not links.sharded
+    assert len(node._store) == 0
+
+def test_legacy_list(node):
+    links = LinkMap(node, [{"Name": "a", "a": {'/': cid(1)}}, {"Name": "b", "b": {'/': cid(2)}}])
+    assert links.items() == [("a", cid(1)), ("b", cid(2))]
+    assert links.serialize() == {"a": {'/': cid(1)}, "b": {'/': cid(2)}}
+
+def test_split(node):
+    links = LinkMap(node)
+    entries = {f"n{i}": cid(i) for i in range(50)}
+    for name, value in entries.items():
+        links.set(name, value)
+    value = links.serialize()
+    assert codec.is_link(value)
+
+    shard = node.get_dag(value['/'])
+    assert shard['depth'] == 0
+    assert set(shard['buckets']) == {bucket_key(name, 0) for name in entries}
+
+    loaded = LinkMap(node, value)
+    assert loaded.sharded
+    assert loaded.items() == sorted(entries.items())
+    for name, value in entries.items():
+        assert loaded.get(name) == value
+    assert loaded.get("missing") == None
+
+def test_update_existing_shard(node):
+    links = LinkMap(node)
+    entries = {f"n{i}": cid(i) for i in range(50)}
+    for name, value in entries.items():
+        links.set(name, value)
+    first = links.serialize()
+
+    loaded = LinkMap(node, first)
+    blocks = len(node._store)
+    # same link again is not a change
+    loaded.set("n0", cid(0))
+    assert loaded.serialize() == first
+
+    loaded.set("n1", cid(100))
+    loaded.set("new", cid(101))
+    second = loaded.serialize()
+    assert second != first
+    # only the blocks on the paths of the changed names are rewritten
+    assert len(node._store) - blocks <= 2 * 4
+
+    entries.update({"n1": cid(100), "new": cid(101)})
+    reloaded = LinkMap(node, second)
+    assert reloaded.items() == sorted(entries.items())
+    assert reloaded.get("n1") == cid(100)
+    assert reloaded.get("new") == cid(101)
+    # the old version is still readable
+    assert LinkMap(node, first).get("n1") == cid(1)
+
+def test_bucket_overflow_becomes_deeper_shard(node, monkeypatch):
+    monkeypatch.setitem(config['plugins']['ipfs'], 'shard_threshold', 1)
+    links = LinkMap(node)
+    entries = {f"n{i}": cid(i) for i in range(300)}
+    for name, value in entries.items():
+        links.set(name, value)
+    value = links.serialize()
+
+    depths = set()
+    shards = [value['/']]
+    while shards:
+        block = node.get_dag(shards.pop())
+        depths.add(block['depth'])
+        shards.extend(l['/'] for l in block['buckets'].values() if 'buckets' in node.get_dag(l['/']))
+    assert {0, 1} <= depths
+
+    loaded = LinkMap(node, value)
+    loaded.set("n7", cid(1000))
+    reloaded = LinkMap(node, loaded.serialize())
+    entries["n7"] = cid(1000)
+    assert reloaded.items() == sorted(entries.items())
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+
+import os
+import time
+
+import pytest
+from passlib.hash import sha256_crypt
+
+from core import config, hashing
+from core.exceptions import ServiceUnavailableError
+from core.hashing import HashPool
+
+
+@pytest.fixture
+def pool():
+    """ A pool with one worker process """
+    pool = HashPool(1, 2, timeout=10)
+    yield pool
+    pool.shutdown()
+
+def test_inline_without_workers():
+    pool = HashPool(0, 1)
+    password_hash = pool.hash("secret")
+    assert pool.verify("secret", password_hash) and not pool.verify("wrong", password_hash)
+    assert pool._pool == None
+
+def test_hash_in_worker(pool):
+    password_hash = pool.hash("secret")
+    assert sha256_crypt.verify("secret", password_hash)
+    assert pool.verify("secret", password_hash)
+    assert pool.pending == 0
+
+def test_full_pool_fails_fast(pool):
+    pool._pending = 2
+    start = time.perf_counter()
+    with pytest.raises(ServiceUnavailableError):
+        pool.hash("secret")
+    assert time.perf_counter() - start < 0.1
+    assert pool.rejected == 1 and pool.pending == 2
+
+def test_timeout(pool):
+    pool._timeout = 0.05
+    with pytest.raises(ServiceUnavailableError):
+        pool.run(time.sleep, 2)
+
+def test_dead_worker_restarts_pool(pool):
+    with pytest.raises(ServiceUnavailableError):
+        pool.run(os._exit, 1)
+    assert pool.restarts == 1
+    assert pool.verify("secret", pool.hash("secret"))
+    assert pool.pending == 0
+
+def test_login_when_pool_is_full(app, client, monkeypatch):
+    full = HashPool(1, 1)
+    full._pending = 1
+    monkeypatch.setattr(hashing, '_hash_pool', full)
+
+    admin = config['core']['admin']
+    r = client.post('/v0.1/auth', json={'username': admin['username'], 'password': admin['password']})
+    assert r.status_code == 503
+    assert full.rejected == 1
+    full.shutdown()
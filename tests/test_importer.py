@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+
+import io
+import json
+
+import pytest
+
+from plugins.ipfs.bench import generate_records
+from plugins.ipfs.blockstore import MemoryBlockStore
+from plugins.ipfs.importer import BulkImporter, read_records
+from plugins.ipfs.models import load_tree
+
+
+class CountingReader(io.StringIO):
+    def __init__(self, text):
+        super().__init__(text)
+        self.reads = 0
+
+    def read(self, size=-1):
+        self.reads += 1
+        return super().read(size)
+
+def post_of(record):
+    return record['site_id'], record['blog_id'], record['post_id']
+
+@pytest.fixture
+def records():
+    return list(generate_records(2, 2, 3, 60))
+
+@pytest.mark.parametrize('dump', [lambda rs: '\n'.join(json.dumps(r) for r in rs),
+                                  lambda rs: '\n\n'.join(json.dumps(r) for r in rs) + '\n',
+                                  lambda rs: json.dumps(rs),
+                                  lambda rs: json.dumps(rs, indent=4)])
+def test_read_records(records, dump):
+    # records are cut off by the chunks
+    assert list(read_records(io.StringIO(dump(records)), chunk_size=50)) == records
+
+def test_read_empty_array():
+    assert list(read_records(io.StringIO(' [ ] '))) == []
+
+def test_read_records_streams(records):
+    for text in ['\n'.join(json.dumps(r) for r in records), json.dumps(records)]:
+        f = CountingReader(text)
+        reader = read_records(f, chunk_size=256)
+        next(reader)
+        assert f.reads <= 2
+
+def test_truncated_array(records):
+    with pytest.raises(json.JSONDecodeError):
+        list(read_records(io.StringIO(json.dumps(records)[:-20]), chunk_size=50))
+
+def test_import_groups_by_post(records):
+    store = MemoryBlockStore()
+    root = load_tree(store, BulkImporter(store, batch_size=7).import_records(records).cid)
+
+    for post in {post_of(r) for r in records}:
+        expected = [r['content'] for r in records if post_of(r) == post]
+        assert [c.content for c in root.get_comments(*post)] == expected
+
+def test_batch_size_gives_same_root(records):
+    cids = {BulkImporter(MemoryBlockStore(), batch_size=n).import_records(records).cid for n in (1, 13, 1000)}
+    assert len(cids) == 1
+
+def test_skips_records_without_post(records):
+    importer = BulkImporter(MemoryBlockStore())
+    importer.import_records([records[0], {"content": "nowhere"}, records[1]])
+    assert (importer.imported, importer.skipped) == (2, 1)
+
+def test_import_into_existing_root(records):
+    store = MemoryBlockStore()
+    cid = BulkImporter(store).import_records(records[:30]).cid
+    root = BulkImporter(store, root_cid=cid).import_records(records[30:])
+
+    # adding in two runs gives the same tree as one run
+    assert root.cid == BulkImporter(MemoryBlockStore()).import_records(records).cid
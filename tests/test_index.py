@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+
+import pytest
+
+from plugins.ipfs.blockstore import MemoryBlockStore
+from plugins.ipfs.importer import BulkImporter
+from plugins.ipfs.models import CommentNode, load_tree
+
+POST = ("site", "blog", "post")
+
+
+def record(name, content, datetime="2021-01-01 00:00:00", post=POST):
+    return {"site_id": post[0], "blog_id": post[1], "post_id": post[2], "name": name, "author": "a",
+            "datetime": datetime, "reply_to": None, "content": content}
+
+@pytest.fixture
+def index(app):
+    from plugins.ipfs.index import get_comment_index
+    with app.app_context():
+        yield get_comment_index()
+
+@pytest.fixture
+def store():
+    return MemoryBlockStore()
+
+def tree_comments(store, root_cid, post=POST):
+    return [c.get_json() for c in load_tree(store, root_cid, lazy=True).get_comments(*post)]
+
+def add_comments(store, root_cid, records):
+    root = load_tree(store, root_cid)
+    for r in records:
+        post = root.get_or_add_child(r['site_id']).get_or_add_child(r['blog_id']).get_or_add_child(r['post_id'])
+        data = {k: r[k] for k in ('name', 'author', 'datetime', 'reply_to', 'content')}
+        post.add_link("comments", CommentNode(store, **data))
+    root.write_tree()
+    return root.cid
+
+def test_identical_comments_match_tree(index, store):
+    # the same comment twice has one CID
+    records = [record("a", "same"), record("b", "other", "2021-01-01 00:00:01"), record("a", "same")]
+    root = BulkImporter(store).import_records(records)
+    index.rebuild(store, root.cid)
+
+    assert len(tree_comments(store, root.cid)) == 3
+    assert index.get_comments(*POST) == tree_comments(store, root.cid)
+
+def test_sync_appended_comments(index, store):
+    root = BulkImporter(store).import_records([record("a", "same"), record("b", "b")])
+    index.rebuild(store, root.cid)
+
+    root_cid = add_comments(store, root.cid, [record("a", "same"), record("c", "c", "2021-01-02 00:00:00")])
+    index.sync(store, root_cid)
+    assert [c['content'] for c in index.get_comments(*POST)] == ["same", "b", "same", "c"]
+    assert index.get_comments(*POST) == tree_comments(store, root_cid)
+
+def test_sync_new_post(index, store):
+    root = BulkImporter(store).import_records([record("a", "a")])
+    index.rebuild(store, root.cid)
+
+    other = ("site", "blog", "other")
+    root_cid = add_comments(store, root.cid, [record("x", "x", post=other)])
+    index.sync(store, root_cid)
+    assert index.get_comments(*other) == tree_comments(store, root_cid, other)
+    assert index.get_post_cid(*other) == load_tree(store, root_cid).find_post(*other).cid
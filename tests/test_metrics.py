@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+
+import pytest
+
+from core import config, hashing, metrics
+from core.metrics import Registry
+from plugins.ipfs.bench import generate_records
+from plugins.ipfs.cache import get_block_cache, get_response_cache
+
+URL = '/v0.1/sites/site_0/blogs/blog_0/posts/post_0/comments'
+ROUTE = '/v0.1/sites/<site_id>/blogs/<blog_id>/posts/<post_id>/comments'
+
+
+def value(text, line_start):
+    return [float(line.split()[-1]) for line in text.splitlines() if line.startswith(line_start)]
+
+def test_counter_and_histogram_render():
+    registry = Registry()
+    counter = registry.counter('calls_total', "Calls", labels=('op',))
+    histogram = registry.histogram('call_seconds', "Call time", labels=('op',), buckets=(0.1, 1.0))
+    counter.inc(op='get')
+    counter.inc(2, op='get')
+    histogram.observe(0.05, op='get')
+    histogram.observe(0.5, op='get')
+    registry.register_collector(lambda: [("entries", 'gauge', "Entries", [({'cache': 'a"b'}, 3)])])
+
+    lines = registry.render().splitlines()
+    assert '# TYPE calls_total counter' in lines
+    assert 'calls_total{op="get"} 3' in lines
+    assert 'call_seconds_bucket{op="get",le="0.1"} 1' in lines
+    assert 'call_seconds_bucket{op="get",le="1.0"} 2' in lines
+    assert 'call_seconds_bucket{op="get",le="+Inf"} 2' in lines
+    assert 'call_seconds_count{op="get"} 2' in lines
+    assert 'entries{cache="a\\"b"} 3' in lines
+
+def test_failing_collector_is_skipped():
+    registry = Registry()
+    registry.register_collector(lambda: 1 / 0)
+    registry.register_collector(lambda: [("ok", 'gauge', "Ok", [({}, 1)])])
+    assert registry.render().splitlines()[-1] == 'ok 1'
+
+def test_ipfs_io_counts_per_request():
+    before = metrics.ipfs_calls.get(op='get', route='test')
+    io = metrics.start_request('test')
+    try:
+        with metrics.ipfs_io('get') as call:
+            call.bytes = 10
+        with metrics.ipfs_io('get') as call:
+            call.bytes = 5
+    finally:
+        metrics.end_request()
+
+    assert (io.calls, io.bytes) == (2, 15)
+    assert metrics.ipfs_calls.get(op='get', route='test') == before + 2
+    assert metrics.get_request_io() == None
+
+def test_metrics_need_admin(client, admin_headers):
+    assert client.get('/metrics').status_code == 401
+    r = client.get('/metrics', headers=admin_headers)
+    assert r.status_code == 200
+    assert r.headers['Content-Type'].startswith('text/plain; version=0.0.4')
+
+def test_public_metrics_count_route_io(client, publish, monkeypatch):
+    monkeypatch.setitem(config['core'], 'metrics_public', True)
+    publish(generate_records(1, 1, 1, 5))
+    get_block_cache().clear()
+    get_response_cache().clear()
+    assert client.get(URL).status_code == 200
+
+    text = client.get('/metrics').data.decode()
+    # blocks are read on the route of the request that needed them
+    assert value(text, f'ipfs_calls_total{{op="get",route="{ROUTE}"}}')[0] > 0
+    assert value(text, f'http_request_duration_seconds_count{{route="{ROUTE}",method="GET",status="200"}}')[0] > 0
+
+def test_hash_stats_before_pool_started(monkeypatch):
+    monkeypatch.setattr(hashing, '_hash_pool', None)
+    stats = {name: values[0][1] for name, _, _, values in hashing.collect_hash_stats()}
+    assert stats == {'hash_pool_pending': 0, 'hash_pool_rejected_total': 0, 'hash_pool_restarts_total': 0}
+    assert hashing._hash_pool == None
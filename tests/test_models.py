@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+
+import pytest
+
+from core import config
+from plugins.ipfs import codec
+from plugins.ipfs.bench import generate_records
+from plugins.ipfs.blockstore import BlockStoreException, MemoryBlockStore
+from plugins.ipfs.cache import get_block_cache
+from plugins.ipfs.importer import BulkImporter
+from plugins.ipfs.models import load_tree
+
+
+class CountingStore(MemoryBlockStore):
+    def __init__(self):
+        super().__init__()
+        self.puts = 0
+
+    def put(self, data, codec_name):
+        self.puts += 1
+        return super().put(data, codec_name)
+
+class ResolvingStore(CountingStore):
+    """ A store that claims to resolve paths but fails like a daemon on a sharded map """
+    can_resolve = True
+
+    def __init__(self):
+        super().__init__()
+        self.resolves = 0
+
+    def resolve(self, path):
+        self.resolves += 1
+        raise BlockStoreException(f"Failed to resolve: {path}")
+
+@pytest.fixture
+def tree(monkeypatch):
+    monkeypatch.setitem(config['plugins']['ipfs'], 'page_size', 10)
+    store = CountingStore()
+    records = list(generate_records(2, 2, 2, 200))
+    root = BulkImporter(store).import_records(records)
+    r = records[0]
+    return load_tree(store, root.cid), (r['site_id'], r['blog_id'], r['post_id'])
+
+def get_post(root, post):
+    site_id, blog_id, post_id = post
+    return root.get_site(site_id).get_blog(blog_id).get_post(post_id)
+
+def test_clean_tree_writes_nothing(tree):
+    root, _ = tree
+    cid = root.cid
+    root._store.puts = 0
+    assert root.get_dirty_nodes() == []
+    root.write_tree()
+    assert root._store.puts == 0
+    assert root.cid == cid
+
+def test_edit_field_writes_changed_levels(tree):
+    root, post = tree
+    comment = get_post(root, post).comments[-1]
+    comment.content = "edited"
+    assert comment.dirty
+    assert root.get_dirty_nodes() == [comment]
+
+    root._store.puts = 0
+    root.write_tree()
+    # comment, post, blog, site and root
+    assert root._store.puts == 5
+    assert not comment.dirty and root.get_dirty_nodes() == []
+
+    reloaded = get_post(load_tree(root._store, root.cid), post).comments
+    assert reloaded[-1].content == "edited"
+
+def test_edit_in_full_page(tree):
+    root, post = tree
+    comments = get_post(root, post).comments
+    assert len(comments) > 10
+    names = [c.name for c in comments]
+    comments[0].content = "edited"
+    root.write_tree()
+
+    reloaded = get_post(load_tree(root._store, root.cid), post).comments
+    assert [c.name for c in reloaded] == names
+    assert reloaded[0].content == "edited"
+    assert [c.content for c in reloaded[1:]] == [c.content for c in comments[1:]]
+
+def test_edit_back_is_clean(tree):
+    root, post = tree
+    comment = get_post(root, post).comments[-1]
+    content = comment.content
+    comment.content = "edited"
+    comment.content = content
+    assert not comment.dirty
+
+@pytest.mark.parametrize('store_class, resolves', [(CountingStore, None), (ResolvingStore, 1)])
+def test_find_post_failed_resolve_walks(store_class, resolves):
+    get_block_cache().clear()
+    store = store_class()
+    records = list(generate_records(1, 1, 2, 5))
+    root = load_tree(store, BulkImporter(store).import_records(records).cid)
+    r = records[0]
+
+    for _ in range(3):
+        post = root.find_post(r['site_id'], r['blog_id'], r['post_id'])
+        assert [c.content for c in post.comments][0] == r['content']
+    assert getattr(store, 'resolves', None) == resolves
+
+def test_get_json_is_idempotent(tree):
+    root, post = tree
+    site = root.get_site(post[0])
+    site.get_children()
+    assert site.get_json() == site.get_json()
+    assert codec.encode(site.get_json()) == root._store.get(site.cid)
+
+def test_encode_is_memoized(tree, monkeypatch):
+    root, post = tree
+    blog = root.get_site(post[0]).get_blog(post[1])
+    encodes = []
+    encode = codec.encode
+    monkeypatch.setattr(codec, 'encode', lambda *args: encodes.append(args) or encode(*args))
+
+    first = blog.encode()
+    assert blog.encode()[1] is first[1]
+    assert len(encodes) == 1
+
+    # a change or another block codec encodes again
+    blog.changed()
+    assert blog.encode() == first
+    monkeypatch.setitem(config['plugins']['ipfs'], 'block_codec', 'dag-json')
+    assert blog.encode()[0] == 'dag-json'
+    assert len(encodes) == 3
+
+def test_unchanged_block_is_not_put(tree):
+    root, post = tree
+    post_node = get_post(root, post)
+    cid = post_node.cid
+    post_node.changed()
+
+    root._store.puts = 0
+    assert post_node.write() == cid
+    assert post_node.write() == cid
+    assert root._store.puts == 0
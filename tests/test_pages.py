@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+
+import pytest
+
+from core import config
+from core.exceptions import BadRequestError
+from plugins.ipfs.bench import generate_records
+from plugins.ipfs.blockstore import MemoryBlockStore
+from plugins.ipfs.importer import BulkImporter
+from plugins.ipfs.models import PostNode, load_tree
+
+SCOPE = "site/blog/post"
+
+
+@pytest.fixture
+def post(monkeypatch):
+    monkeypatch.setitem(config['plugins']['ipfs'], 'page_size', 10)
+    store = MemoryBlockStore()
+    records = list(generate_records(1, 1, 1, 45))
+    root = BulkImporter(store).import_records(records)
+    r = records[0]
+    return load_tree(store, root.cid).find_post(r['site_id'], r['blog_id'], r['post_id'])
+
+def names(comments):
+    return [c._name for c in comments]
+
+def all_pages(post, limit, scope=SCOPE):
+    comments, cursor = post.get_page(limit, scope=scope)
+    pages = [comments]
+    while cursor != None:
+        comments, cursor = post.get_page(limit, cursor, scope=scope)
+        pages.append(comments)
+    return pages
+
+def test_post_is_paged(post):
+    block = post.get_dag(post.cid)
+    assert block['count'] == 45
+    assert len(block['comments']) == 5
+    assert block['next'] != None
+
+@pytest.mark.parametrize('limit', [1, 7, 10, 20, 45, 100])
+def test_pages_are_newest_first(post, limit):
+    newest_first = [f"comment_{i}" for i in reversed(range(45))]
+    pages = all_pages(post, limit)
+    assert [names(p) for p in pages if p] == [newest_first[i:i+limit] for i in range(0, 45, limit)]
+
+def test_last_page_has_no_cursor(post):
+    comments, cursor = post.get_page(45, scope=SCOPE)
+    assert len(comments) == 45
+    assert cursor == None
+
+def test_cursor_is_bound_to_scope(post):
+    _, cursor = post.get_page(7, scope=SCOPE)
+    with pytest.raises(BadRequestError):
+        post.get_page(7, cursor, scope="site/blog/other")
+
+@pytest.mark.parametrize('cursor', ["garbage", "a:b", "a:1:2:3", "cid:notanumber:sig", ""])
+def test_malformed_cursor(post, cursor):
+    if cursor == "":
+        # no cursor is the first page
+        assert names(post.get_page(1, cursor, scope=SCOPE)[0]) == ["comment_44"]
+        return
+    with pytest.raises(BadRequestError):
+        post.get_page(7, cursor, scope=SCOPE)
+
+def test_tampered_cursor(post):
+    _, cursor = post.get_page(7, scope=SCOPE)
+    cid, n, signature = cursor.split(':')
+    with pytest.raises(BadRequestError):
+        post.get_page(7, f"{cid}:{int(n) + 1}:{signature}", scope=SCOPE)
+    with pytest.raises(BadRequestError):
+        post.get_page(7, f"{cid}:{n}:{'0' * len(signature)}", scope=SCOPE)
+
+def test_negative_offset(post):
+    cursor = post.make_cursor(SCOPE, post.cid, -1)
+    with pytest.raises(BadRequestError):
+        post.get_page(7, cursor, scope=SCOPE)
+
+def test_cursor_to_non_page_block(post):
+    # a signed cursor that points at a comment instead of a page
+    comment_cid = post.get_links()[0][1]
+    with pytest.raises(BadRequestError):
+        post.get_page(7, post.make_cursor(SCOPE, comment_cid, 3), scope=SCOPE)
+
+@pytest.mark.parametrize('page_size', [4, 25])
+def test_page_size_changed_after_write(post, monkeypatch, page_size):
+    # the post was written with pages of 10
+    monkeypatch.setitem(config['plugins']['ipfs'], 'page_size', page_size)
+    post = PostNode(post._store, post.name, cid=post.cid, lazy=True)
+    assert post._page_size == page_size
+    newest_first = [f"comment_{i}" for i in reversed(range(45))]
+    for limit in [1, 7, 10, 45]:
+        assert [name for page in all_pages(post, limit) for name in names(page)] == newest_first
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+
+import itertools
+
+import pytest
+from flask_jwt_extended import jwt_required
+
+from core import permissions
+from core.api import check_appid_permissions
+from core.exceptions import UnauthorizedError
+from core.permissions import PermissionCache, get_permission_cache
+
+_names = itertools.count()
+
+
+@pytest.fixture
+def user(client, admin_headers):
+    """ A user that may post to app ids a and b, with its authorization header """
+    username = f"user_{next(_names)}"
+    r = client.post('/v0.1/users', headers=admin_headers, json={'username': username, 'password': 'secret', 'app_ids': ['a', 'b']})
+    assert r.status_code == 200
+    token = client.post('/v0.1/auth', json={'username': username, 'password': 'secret'}).json['payload']['access_token']
+    return r.json['payload']['user_id'], {'Authorization': f"Bearer {token}"}
+
+@pytest.fixture
+def loads(monkeypatch):
+    """ Count the users that are read from the database """
+    calls = []
+    load = PermissionCache.load
+    monkeypatch.setattr(PermissionCache, 'load', lambda self, user_id: calls.append(user_id) or load(self, user_id))
+    return calls
+
+def test_cached_until_ttl(app, user, loads, monkeypatch):
+    user_id, _ = user
+    now = [1000.0]
+    monkeypatch.setattr(permissions.time, 'monotonic', lambda: now[0])
+    cache = PermissionCache(ttl=10)
+
+    with app.app_context():
+        assert cache.get(user_id).app_ids == frozenset({'a', 'b'})
+        assert cache.get(user_id) is cache.get(user_id)
+        assert len(loads) == 1
+
+        now[0] += 11
+        cache.get(user_id)
+    assert len(loads) == 2
+    assert (cache.hits, cache.misses) == (2, 2)
+
+def test_unknown_user_is_not_cached(app, loads):
+    cache = PermissionCache(ttl=10)
+    with app.app_context():
+        assert cache.get(999999) == None
+        assert cache.get(999999) == None
+    assert len(loads) == 2 and len(cache) == 0
+
+def test_put_user_invalidates(app, client, admin_headers, user):
+    user_id, _ = user
+    with app.app_context():
+        assert get_permission_cache().get(user_id).allows('a')
+
+        r = client.put(f'/v0.1/users/{user_id}', headers=admin_headers, json={'app_ids': ['c']})
+        assert r.status_code == 200
+        assert get_permission_cache().get(user_id).app_ids == frozenset({'c'})
+
+def test_delete_user_invalidates(app, client, admin_headers, user):
+    user_id, _ = user
+    with app.app_context():
+        assert get_permission_cache().get(user_id) != None
+        assert client.delete(f'/v0.1/users/{user_id}', headers=admin_headers).status_code == 200
+        assert get_permission_cache().get(user_id) == None
+
+@pytest.mark.parametrize('use_admin, body, allowed', [(False, {'app_id': 'a'}, True),
+                                                      (False, {'app_id': ' b '}, True),
+                                                      (False, {'app_id': 'x'}, False),
+                                                      (False, {}, False),
+                                                      (True, {}, True)])
+def test_check_appid_permissions(app, user, admin_headers, loads, use_admin, body, allowed):
+    headers = admin_headers if use_admin else user[1]
+    check = jwt_required()(check_appid_permissions(lambda: True))
+
+    # warm the cache, then authorization makes no database round trip
+    with app.test_request_context('/', method='POST', headers=headers, json=body):
+        try:
+            check()
+        except UnauthorizedError:
+            pass
+    loads.clear()
+
+    with app.test_request_context('/', method='POST', headers=headers, json=body):
+        if allowed:
+            assert check()
+        else:
+            with pytest.raises(UnauthorizedError):
+                check()
+    assert loads == []
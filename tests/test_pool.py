@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+
+import threading
+
+import pytest
+import ipfshttpclient
+
+from core.exceptions import InternalServerError
+from plugins.ipfs.blockstore import HttpBlockStore, BlockNotFoundError
+from plugins.ipfs.pool import ClientPool
+
+
+class FakeClient():
+    def __init__(self, n):
+        self.n = n
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+@pytest.fixture
+def pool(monkeypatch):
+    pool = ClientPool('/dns/localhost/tcp/5001/http', size=2, acquire_timeout=0.05)
+    pool.connects = 0
+
+    def connect():
+        pool.connects += 1
+        return FakeClient(pool.connects)
+    monkeypatch.setattr(pool, '_connect', connect)
+    return pool
+
+def test_client_is_reused(pool):
+    with pool.client() as first:
+        pass
+    with pool.client() as second:
+        pass
+    assert first is second and pool.connects == 1
+
+def test_size_is_bounded(pool):
+    with pool.client(), pool.client():
+        with pytest.raises(InternalServerError):
+            with pool.client():
+                pass
+    assert pool.connects == 2
+
+def test_waits_for_released_client(pool):
+    pool._acquire_timeout = 5
+    held = [pool._acquire(), pool._acquire()]
+    threading.Timer(0.05, pool._release, args=(held[0],)).start()
+    with pool.client() as client:
+        assert client is held[0]
+
+def test_lost_connection_drops_client(pool):
+    with pytest.raises(ipfshttpclient.exceptions.ConnectionError):
+        with pool.client() as lost:
+            raise ipfshttpclient.exceptions.ConnectionError(None)
+    assert lost.closed
+
+    # the next borrower connects again, eg: to a restarted daemon
+    with pool.client() as client:
+        assert client is not lost and pool.connects == 2
+    assert pool._created == 1
+
+def test_other_errors_keep_client(pool):
+    with pytest.raises(KeyError):
+        with pool.client() as client:
+            raise KeyError("not a connection error")
+    assert not client.closed
+    with pool.client() as again:
+        assert again is client
+
+def test_failed_connect_frees_slot(pool, monkeypatch):
+    def refuse():
+        raise ipfshttpclient.exceptions.ConnectionError(None)
+    monkeypatch.setattr(pool, '_connect', refuse)
+    for _ in range(3):
+        with pytest.raises(ipfshttpclient.exceptions.ConnectionError):
+            pool._acquire()
+    assert pool._created == 0
+
+def test_close_closes_idle_clients(pool):
+    with pool.client() as a, pool.client() as b:
+        pass
+    pool.close()
+    assert a.closed and b.closed and pool._created == 0
+
+def test_http_store_borrows_from_pool(pool):
+    class Block():
+        def get(self, cid):
+            raise ipfshttpclient.exceptions.ErrorResponse("block not found", None)
+
+    with pool.client() as client:
+        client.block = Block()
+    store = HttpBlockStore(pool)
+    with pytest.raises(BlockNotFoundError):
+        store.get("bafyreimissing")
+    # the client went back to the pool
+    assert pool._idle.qsize() == 1 and pool.connects == 1
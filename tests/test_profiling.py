@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+
+import json
+import pstats
+import time
+
+import pytest
+from flask import g, make_response
+
+from core import config, metrics
+from core.profiling import PROFILE_HEADER, RequestProfiler, start_profile, stop_profile, abort_profile
+
+URL = '/v0.1/sites/site_0/blogs/blog_0/posts/post_0/comments'
+
+
+@pytest.fixture
+def profiling_dir(tmp_path, monkeypatch):
+    monkeypatch.setitem(config['core'], 'profiling_dir', str(tmp_path))
+    return tmp_path
+
+def busy(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+def profiled_request(app, headers):
+    """ Run the profiling hooks around a request that makes two IPFS calls """
+    with app.test_request_context(URL, headers=headers):
+        app.preprocess_request()
+        start_profile()
+        profiled = 'profiler' in g
+        with metrics.ipfs_io('get'), metrics.ipfs_io('get'):
+            busy(0.05)
+        response = stop_profile(make_response('ok'))
+    return profiled, response
+
+def test_off_by_default(app):
+    assert start_profile not in app.before_request_funcs.get(None, [])
+
+def test_profile_of_admin_request(app, admin_headers, profiling_dir):
+    profiled, response = profiled_request(app, dict(admin_headers, **{PROFILE_HEADER: '1'}))
+    assert profiled
+    name = response.headers['X-Profile-Id']
+    assert name.endswith('_2calls')
+
+    info = json.loads((profiling_dir / f"{name}.json").read_text())
+    assert info['ipfs_calls'] == 2 and info['status'] == 200
+    assert info['route'] == '/v0.1/sites/<site_id>/blogs/<blog_id>/posts/<post_id>/comments'
+    assert pstats.Stats(str(profiling_dir / f"{name}.prof")).total_calls > 0
+    stacks = [line.rsplit(' ', 1) for line in (profiling_dir / f"{name}.collapsed").read_text().splitlines()]
+    assert any('busy (test_profiling.py' in stack for stack, count in stacks)
+
+@pytest.mark.parametrize('headers', [{}, {PROFILE_HEADER: '1'}, {PROFILE_HEADER: '1', 'Authorization': 'Bearer not-a-token'}])
+def test_not_profiled(app, profiling_dir, headers):
+    profiled, response = profiled_request(app, headers)
+    assert not profiled
+    assert 'X-Profile-Id' not in response.headers
+    assert list(profiling_dir.iterdir()) == []
+
+def test_one_profile_at_a_time(app, admin_headers, profiling_dir):
+    other = RequestProfiler(0.001)
+    assert other.start()
+    try:
+        profiled, response = profiled_request(app, dict(admin_headers, **{PROFILE_HEADER: '1'}))
+        assert not profiled
+    finally:
+        other.stop()
+
+def test_aborted_request_releases_profiler(app, admin_headers, profiling_dir):
+    with app.test_request_context(URL, headers=dict(admin_headers, **{PROFILE_HEADER: '1'})):
+        start_profile()
+        assert 'profiler' in g
+        abort_profile(RuntimeError("request failed"))
+    assert list(profiling_dir.iterdir()) == []
+
+    profiler = RequestProfiler(0.001)
+    assert profiler.start()
+    profiler.stop()
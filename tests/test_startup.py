@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+from core import config, db, startup_timings
+from core import utils
+from core.models import User
+
+
+@pytest.fixture
+def hashes(app, monkeypatch):
+    """ Count the sha256_crypt hashes init_db computes """
+    calls = []
+    hash_password = utils.get_password_hash
+    monkeypatch.setattr(utils, 'get_password_hash', lambda password: calls.append(password) or hash_password(password))
+    return calls
+
+def init_db(password):
+    utils.init_db(db, config['core']['admin']['username'], password, config['core']['jwt_secret_key'])
+
+def test_create_app_writes_config(app):
+    assert Path(config._config_path).exists()
+    assert {'plugins', 'extensions', 'routes', 'database'} <= startup_timings.keys()
+
+def test_import_writes_nothing(tmp_path):
+    root = Path(__file__).parent.parent
+    existed = (root / 'config.yml').exists()
+    subprocess.run([sys.executable, '-c', "import core"], cwd=tmp_path, check=True,
+                   env={'PYTHONPATH': str(root)})
+    assert list(tmp_path.iterdir()) == []
+    assert (root / 'config.yml').exists() == existed
+
+def test_admin_up_to_date_skips_hash(app, hashes):
+    with app.app_context():
+        init_db(config['core']['admin']['password'])
+    assert hashes == []
+
+def test_admin_password_changed(app, hashes):
+    password = config['core']['admin']['password']
+    with app.app_context():
+        init_db("changed")
+        init_db("changed")
+        assert utils.sha256_crypt.verify("changed", User.query.filter_by(username='admin').first().password)
+        init_db(password)
+    assert hashes == ["changed", password]
+
+def test_admin_hash_changed_elsewhere(app, hashes):
+    password = config['core']['admin']['password']
+    with app.app_context():
+        user = User.query.filter_by(username='admin').first()
+        user.password = utils.sha256_crypt.hash("set through the api")
+        db.session.commit()
+        init_db(password)
+        assert utils.sha256_crypt.verify(password, User.query.filter_by(username='admin').first().password)
+    assert hashes == [password]
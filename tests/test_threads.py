@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+
+from plugins.ipfs.threads import build_threads
+
+
+def comment(cid, reply_to=None):
+    return {"cid": cid, "reply_to": reply_to}
+
+def shape(threads):
+    """ Nested (cid, [replies], more_replies) tuples """
+    return [(n['cid'], shape(n['replies']), n['more_replies']) for n in threads]
+
+def test_replies():
+    threads = build_threads([comment("a"), comment("b", "a"), comment("c", "b"), comment("d", "a"), comment("e")])
+    assert shape(threads) == [("a", [("b", [("c", [], 0)], 0), ("d", [], 0)], 0), ("e", [], 0)]
+
+def test_reply_to_missing_parent():
+    threads = build_threads([comment("a"), comment("b", "gone")])
+    assert shape(threads) == [("a", [], 0), ("b", [], 0)]
+
+def test_reply_to_later_parent():
+    # b replies to c, which comes after it, so b is top level
+    threads = build_threads([comment("a"), comment("b", "c"), comment("c", "a")])
+    assert shape(threads) == [("a", [("c", [], 0)], 0), ("b", [], 0)]
+
+def test_reply_to_itself():
+    assert shape(build_threads([comment("a", "a")])) == [("a", [], 0)]
+
+def test_duplicate_cid():
+    # identical comments have the same CID, replies go to the first one
+    threads = build_threads([comment("a"), comment("a"), comment("b", "a")])
+    assert shape(threads) == [("a", [("b", [], 0)], 0), ("a", [], 0)]
+
+def test_max_depth():
+    comments = [comment("c0")] + [comment(f"c{i}", f"c{i-1}") for i in range(1, 5)]
+    threads = build_threads(comments, max_depth=3)
+    assert shape(threads) == [("c0", [("c1", [("c2", [], 1)], 0)], 0)]
+
+def test_max_children():
+    comments = [comment("a")] + [comment(f"r{i}", "a") for i in range(5)]
+    threads = build_threads(comments, max_children=2)
+    assert shape(threads) == [("a", [("r0", [], 0), ("r1", [], 0)], 3)]
+
+def test_input_is_not_changed():
+    comments = [comment("a"), comment("b", "a")]
+    build_threads(comments)
+    assert comments == [comment("a"), comment("b", "a")]
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+
+import itertools
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.pool import QueuePool
+
+from core import db
+from core.models import User, UserAppId
+from core.utils import get_engine_options, migrate_app_ids
+
+_names = itertools.count()
+
+
+@pytest.fixture
+def session(app):
+    with app.app_context():
+        yield db.session
+        db.session.rollback()
+
+def add_user(session, app_ids):
+    user = User(username=f"app_ids_{next(_names)}", password="x")
+    user.app_ids = app_ids
+    session.add(user)
+    session.commit()
+    return user
+
+@pytest.mark.parametrize('app_ids', ['b, a,,a', ['a', ' b', 'a', '']])
+def test_app_ids(session, app_ids):
+    user = add_user(session, app_ids)
+    assert user.app_ids == 'a,b'
+    assert user.serialize()['app_ids'] == 'a,b'
+    assert {(row.user_id, row.app_id) for row in user.app_id_rows} == {(user.user_id, 'a'), (user.user_id, 'b')}
+
+def test_change_app_ids(session):
+    user = add_user(session, 'a,b')
+    user.app_ids = ['b', 'c']
+    session.commit()
+    assert UserAppId.query.filter_by(user_id=user.user_id).count() == 2
+    assert user.app_ids == 'b,c'
+
+    user.app_ids = None
+    session.commit()
+    assert user.app_ids == None and UserAppId.query.filter_by(user_id=user.user_id).count() == 0
+
+def test_with_app_id(session):
+    first = add_user(session, 'only_here,shared')
+    second = add_user(session, 'shared')
+    assert [u.user_id for u in User.with_app_id('only_here')] == [first.user_id]
+    assert {u.user_id for u in User.with_app_id('shared')} == {first.user_id, second.user_id}
+
+def test_app_id_query_uses_index(session):
+    plan = session.execute(text("EXPLAIN QUERY PLAN SELECT user_id FROM user_app_ids WHERE app_id = 'a'")).fetchall()
+    assert 'ix_user_app_ids_app_id_user_id' in str(plan)
+
+def test_delete_user_deletes_app_ids(session):
+    user = add_user(session, 'a,b')
+    user_id = user.user_id
+    session.delete(user)
+    session.commit()
+    assert UserAppId.query.filter_by(user_id=user_id).count() == 0
+
+def test_pragmas(session):
+    assert session.execute(text("PRAGMA journal_mode")).scalar() == 'wal'
+    # NORMAL
+    assert session.execute(text("PRAGMA synchronous")).scalar() == 1
+    assert session.execute(text("PRAGMA foreign_keys")).scalar() == 1
+
+def test_migrate_app_ids(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'legacy.sqlite'}")
+    with engine.begin() as connection:
+        connection.execute(text("CREATE TABLE user (user_id INTEGER PRIMARY KEY, username VARCHAR(120), app_ids VARCHAR(1000))"))
+        connection.execute(text("INSERT INTO user VALUES (1, 'legacy', 'a, b,,a'), (2, 'none', NULL), (3, 'empty', '')"))
+    UserAppId.__table__.create(engine)
+
+    legacy = SimpleNamespace(engine=engine)
+    migrate_app_ids(legacy)
+    # the emptied column makes a second run a no-op
+    migrate_app_ids(legacy)
+
+    with engine.connect() as connection:
+        assert connection.execute(text("SELECT user_id, app_id FROM user_app_ids ORDER BY app_id")).fetchall() == [(1, 'a'), (1, 'b')]
+        assert connection.execute(text("SELECT count(*) FROM user WHERE app_ids IS NOT NULL")).scalar() == 0
+
+def test_engine_options():
+    options = get_engine_options({'busy_timeout': 2, 'pool_size': 3, 'max_overflow': 1, 'pool_timeout': 4})
+    assert options['poolclass'] == QueuePool
+    assert (options['pool_size'], options['max_overflow'], options['pool_timeout']) == (3, 1, 4.0)
+    assert options['connect_args']['timeout'] == 2.0
+
+    assert 'poolclass' not in get_engine_options({'pool_size': 0})